@@ -0,0 +1,267 @@
+# analytics.py
+# Admin reports computed with NumPy over columns pulled in bulk.
+#
+#   GET /api/analytics/ratings[?venue_id=]
+#       rating histogram (1-5), count, mean and percentiles per venue, and overall
+#   GET /api/analytics/attendance[?from=&to=&bucket=day|week|month]
+#       attendees per event type per time bucket, with per-event percentiles per type
+#   GET /api/analytics/artist-favorites[?from=&to=&bucket=&limit=]
+#       favorites added per artist per time bucket, for the most favorited artists
+#
+# Each report reads its rows with a single query (no ORM objects, no to_dict()), turns them
+# into NumPy arrays and aggregates them with bincount / cumsum, so a report over every
+# venue or event costs one round trip plus a few vectorized passes. from/to are YYYY-MM-DD
+# and default to the ANALYTICS_DEFAULT_DAYS (90) days up to today.
+#
+# Results are cached per worker, keyed by the report and its window and parameters, for
+# ANALYTICS_CACHE_SECONDS (default 300). Favorites added before artist_favorites.created_at
+# existed count toward an artist's total but fall outside every window.
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import func, select
+
+from app import db, AttendeeVenue, Event, artist_favorites, attendee_events, is_admin_user
+
+analytics_api = Blueprint('analytics', __name__)
+
+RATINGS = np.arange(1, 6)
+PERCENTILES = (25, 50, 75, 90)
+BUCKETS = {'day': 'D', 'week': 'W', 'month': 'M'}
+CACHE_MAX_ENTRIES = 256
+MAX_ARTISTS = 100
+
+
+class ReportCache:
+    """Report results by key, each kept for ttl seconds; least recently stored evicted first."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+
+    def get_or_compute(self, key, ttl, compute):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] > now:
+                return hit[1]
+        result = compute()
+        with self._lock:
+            self._entries[key] = (now + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+#-------------------------------#Helpers--------------------#
+def _window():
+    """(start, end) datetimes from ?from=&to=, end exclusive. Raises ValueError."""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d') if request.args.get('to') else today
+    start = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') else \
+        end - timedelta(days=current_app.config['ANALYTICS_DEFAULT_DAYS'])
+    if start > end:
+        raise ValueError("from must not be after to")
+    return start, end + timedelta(days=1)
+
+
+def _bucket_starts(dates, unit):
+    """Truncates datetime64 values to the start of their day, ISO week (Monday) or month."""
+    days = dates.astype('datetime64[D]')
+    if unit == 'W':
+        # 1970-01-01 was a Thursday, so day number + 3 is 0 on Mondays (mod 7)
+        return days - (days.astype(np.int64) + 3) % 7
+    return days.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+
+
+def _timeline(start, end, unit):
+    """Bucket start dates covering [start, end)."""
+    first = _bucket_starts(np.array([start], dtype='datetime64[D]'), unit)[0]
+    last = np.datetime64(end - timedelta(days=1), 'D')
+    if unit == 'M':
+        months = np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1)
+        return months.astype('datetime64[D]')
+    return np.arange(first, last + 1, 7 if unit == 'W' else 1)
+
+
+def _bucket_index(dates, timeline, unit):
+    return np.searchsorted(timeline, _bucket_starts(dates, unit))
+
+
+def _labels(timeline):
+    return [str(day) for day in timeline]
+
+
+def _percentiles(values):
+    if values.size == 0:
+        return {f'p{pct}': None for pct in PERCENTILES}
+    return {f'p{pct}': float(value) for pct, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+#-------------------------------#Reports--------------------#
+def rating_report(venue_id=None):
+    """Rating histograms and percentiles per venue, from one scan of attendee_venue."""
+    query = select(AttendeeVenue.venue_id, AttendeeVenue.rating).where(AttendeeVenue.rating.isnot(None))
+    if venue_id is not None:
+        query = query.where(AttendeeVenue.venue_id == venue_id)
+    rows = db.session.execute(query).all()
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    venue_ids, venue_index = np.unique(data[:, 0], return_inverse=True)
+    ratings = np.clip(data[:, 1], 1, 5) - 1
+
+    # One row of five rating counts per venue
+    histograms = np.bincount(venue_index * 5 + ratings, minlength=len(venue_ids) * 5).reshape(-1, 5)
+
+    def summarize(histogram):
+        count = int(histogram.sum())
+        if not count:
+            return {'count': 0, 'mean': None, 'histogram': {}, **_percentiles(np.empty(0))}
+        # Nearest-rank percentiles straight from the cumulative counts
+        cumulative = histogram.cumsum()
+        percentiles = {
+            f'p{pct}': int(RATINGS[np.searchsorted(cumulative, pct / 100 * count)]) for pct in PERCENTILES
+        }
+        return {
+            'count': count,
+            'mean': round(float(histogram @ RATINGS / count), 2),
+            'histogram': {int(rating): int(n) for rating, n in zip(RATINGS, histogram)},
+            **percentiles,
+        }
+
+    return {
+        'venues': [{'venue_id': int(id_), **summarize(histogram)} for id_, histogram in zip(venue_ids, histograms)],
+        'overall': summarize(histograms.sum(axis=0)),
+    }
+
+
+def attendance_report(start, end, unit):
+    """Attendees per event type per bucket, from one grouped scan of events x attendee_events."""
+    rows = db.session.execute(
+        select(Event.date, Event.event_type, func.count(attendee_events.c.attendee_id))
+        .select_from(Event).outerjoin(attendee_events, attendee_events.c.event_id == Event.id)
+        .where(Event.date >= start, Event.date < end)
+        .group_by(Event.id)
+    ).all()
+    timeline = _timeline(start, end, unit)
+    if not rows:
+        return {'buckets': _labels(timeline), 'event_types': {}}
+
+    dates, types, counts = zip(*rows)
+    dates = np.array(dates, dtype='datetime64[D]')
+    counts = np.array(counts, dtype=np.int64)
+    type_names, type_index = np.unique(np.array(types, dtype=object).astype(str), return_inverse=True)
+    bucket_index = _bucket_index(dates, timeline, unit)
+
+    # Sum of attendees per (type, bucket), and number of events per (type, bucket)
+    cells = type_index * len(timeline) + bucket_index
+    attendees = np.bincount(cells, weights=counts, minlength=len(type_names) * len(timeline)).reshape(len(type_names), -1)
+    events = np.bincount(cells, minlength=len(type_names) * len(timeline)).reshape(len(type_names), -1)
+
+    return {
+        'buckets': _labels(timeline),
+        'event_types': {
+            str(name): {
+                'attendees': attendees[row].astype(np.int64).tolist(),
+                'events': events[row].tolist(),
+                'total_attendees': int(attendees[row].sum()),
+                'per_event': _percentiles(counts[type_index == row]),
+            }
+            for row, name in enumerate(type_names)
+        },
+    }
+
+
+def artist_favorites_report(start, end, unit, limit):
+    """Favorites added per artist per bucket, from one scan of artist_favorites."""
+    rows = db.session.execute(select(artist_favorites.c.artist_id, artist_favorites.c.created_at)).all()
+    timeline = _timeline(start, end, unit)
+    if not rows:
+        return {'buckets': _labels(timeline), 'artists': []}
+
+    artist_column, created_column = zip(*rows)
+    artist_ids, artist_index = np.unique(np.array(artist_column, dtype=np.int64), return_inverse=True)
+    created = np.array(created_column, dtype='datetime64[s]')   # None becomes NaT
+    totals = np.bincount(artist_index, minlength=len(artist_ids))
+
+    in_window = ~np.isnat(created) & (created >= np.datetime64(start, 's')) & (created < np.datetime64(end, 's'))
+    cells = artist_index[in_window] * len(timeline) + _bucket_index(created[in_window], timeline, unit)
+    series = np.bincount(cells, minlength=len(artist_ids) * len(timeline)).reshape(len(artist_ids), -1)
+    added = series.sum(axis=1)
+
+    # Most favorites added in the window first, then most favorites overall
+    top = np.lexsort((-totals, -added))[:limit]
+    return {
+        'buckets': _labels(timeline),
+        'artists': [
+            {
+                'artist_id': int(artist_ids[row]),
+                'total_favorites': int(totals[row]),
+                'added': int(added[row]),
+                'series': series[row].tolist(),
+            }
+            for row in top
+        ],
+    }
+
+
+#-------------------------------#Routes--------------------#
+def _cached(key, compute):
+    cache = current_app.extensions['analytics']
+    return jsonify(cache.get_or_compute(key, current_app.config['ANALYTICS_CACHE_SECONDS'], compute)), 200
+
+
+def _window_and_unit():
+    unit = BUCKETS.get(request.args.get('bucket', 'week'))
+    if unit is None:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    start, end = _window()
+    return start, end, unit
+
+
+@analytics_api.before_request
+def require_admin():
+    if not is_admin_user():
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+
+@analytics_api.get('/api/analytics/ratings')
+def ratings_analytics():
+    venue_id = request.args.get('venue_id', type=int)
+    return _cached(('ratings', venue_id), lambda: rating_report(venue_id))
+
+
+@analytics_api.get('/api/analytics/attendance')
+def attendance_analytics():
+    try:
+        start, end, unit = _window_and_unit()
+    except ValueError as exception:
+        return jsonify({"error": f"Invalid window: {exception}. Use from/to as YYYY-MM-DD."}), 400
+    return _cached(('attendance', start, end, unit), lambda: attendance_report(start, end, unit))
+
+
+@analytics_api.get('/api/analytics/artist-favorites')
+def artist_favorites_analytics():
+    try:
+        start, end, unit = _window_and_unit()
+    except ValueError as exception:
+        return jsonify({"error": f"Invalid window: {exception}. Use from/to as YYYY-MM-DD."}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_ARTISTS))
+    return _cached(('artist-favorites', start, end, unit, limit),
+                   lambda: artist_favorites_report(start, end, unit, limit))
+
+
+def init_app(app):
+    app.config.setdefault('ANALYTICS_CACHE_SECONDS', 300)
+    app.config.setdefault('ANALYTICS_DEFAULT_DAYS', 90)
+    app.extensions['analytics'] = ReportCache()
+    app.register_blueprint(analytics_api)
@@ -1,73 +1,236 @@
 # app.py
-from flask import Flask, jsonify, request, session, abort
+from flask import Flask, Blueprint, current_app, jsonify, request, session, abort
 from flask_migrate import Migrate
 from flask_cors import CORS
 from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
 # from associations import attendee_events, attendee_favorites, artist_favorites, tour_events
 from sqlalchemy_serializer import SerializerMixin  # Import SerializerMixin
-from sqlalchemy.orm import relationship
-from sqlalchemy import Table, Column, Integer, ForeignKey  # Add this line
+from sqlalchemy.orm import relationship, configure_mappers, foreign
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import Table, Column, Integer, ForeignKey, event, func, select, update, delete  # Add this line
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import AddConstraint, CreateTable
 from sqlalchemy.ext.associationproxy import association_proxy
 from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv  # Import load_dotenv
+import json
 import os  # Import os
+import math
 import re
+import time
+import click
 
 load_dotenv()
 
+# Extensions are created unbound and attached to an app in create_app()
 db = SQLAlchemy()
+migrate = Migrate()
+bcrypt = Bcrypt()
+cors = CORS()
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv('DATABASE_URL') or 'sqlite:///local_database.db'
-# app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///main.db'
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.json.compact = False
-
-app.secret_key = os.getenv('SECRET_KEY', 'default_secret_key')
-
-# Initialize the db with the app
-db.init_app(app)
-migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
-CORS(app, supports_credentials=True)
+# All routes live on this blueprint so importing the module never builds an app
+api = Blueprint('api', __name__)
 
+# Deletes fan out in the database: association rows go with either side (ON DELETE CASCADE)
+# and relationships are passive_deletes, so deleting a parent is one DELETE statement
+# instead of loading and deleting every child. SQLite needs foreign_keys=ON for this
+# (see sqlite_profile.py); `flask sync-schema` migrates existing tables.
 attendee_events = Table('attendee_events', db.metadata,
-    Column('attendee_id', Integer, ForeignKey('attendees.id'), primary_key=True),
-    Column('event_id', Integer, ForeignKey('events.id'), primary_key=True)
+    Column('attendee_id', Integer, ForeignKey('attendees.id', ondelete='CASCADE'), primary_key=True),
+    Column('event_id', Integer, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
 )
 
 attendee_favorites = Table(
     'attendee_favorites', db.metadata,
-    Column('attendee_id', Integer, ForeignKey('attendees.id'), primary_key=True),
-    Column('event_id', Integer, ForeignKey('events.id'), primary_key=True)
+    Column('attendee_id', Integer, ForeignKey('attendees.id', ondelete='CASCADE'), primary_key=True),
+    Column('event_id', Integer, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
 )
 # Association table for artist and events
 artist_events = Table('artist_events', db.Model.metadata,
-    Column('artist_id', Integer, ForeignKey('artists.id'), primary_key=True),
-    Column('event_id', Integer, ForeignKey('events.id'), primary_key=True)
+    Column('artist_id', Integer, ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True),
+    Column('event_id', Integer, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
 )
 # Association table for artist and attendees
 artist_favorites = db.Table('artist_favorites',
-    db.Column('attendee_id', db.Integer, db.ForeignKey('attendees.id')),
-    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id'))
+    db.Column('attendee_id', db.Integer, db.ForeignKey('attendees.id', ondelete='CASCADE')),
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE')),
+    # When the favorite was added, for trends (see analytics.py); NULL for favorites added before it existed
+    db.Column('created_at', db.DateTime, nullable=True, default=datetime.utcnow, index=True)
 )
 tour_events = db.Table('tour_events',
-    db.Column('tour_id', db.Integer, db.ForeignKey('tours.id'), primary_key=True),
-    db.Column('event_id', db.Integer, db.ForeignKey('events.id'), primary_key=True)
+    db.Column('tour_id', db.Integer, db.ForeignKey('tours.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('event_id', db.Integer, db.ForeignKey('events.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_tour_events_event_id', 'event_id'),  # an event's tours; the key only covers a tour's events
 )
 
+
+def _cascade_rules(obj):
+    """(model, condition) for each kind of mapped row ON DELETE CASCADE removes along with `obj`."""
+    if isinstance(obj, Venue):
+        return [(Event, Event.venue_id == obj.id), (AttendeeVenue, AttendeeVenue.venue_id == obj.id)]
+    if isinstance(obj, User):
+        venue_ids = select(Venue.id).where(Venue.created_by_id == obj.id)
+        return [
+            (Venue, Venue.created_by_id == obj.id),
+            (Artist, Artist.created_by_id == obj.id),
+            (Event, (Event.created_by_id == obj.id) | Event.venue_id.in_(venue_ids)),
+            (AttendeeVenue, AttendeeVenue.venue_id.in_(venue_ids)),
+        ]
+    if isinstance(obj, Attendee):
+        return [(AttendeeVenue, AttendeeVenue.attendee_id == obj.id)]
+    return []
+
+
+def cascaded_rows(session, flush_context):
+    """
+    {model: [row, ...]}: the rows, with every column, that ON DELETE CASCADE removes along
+    with the objects this flush deletes (rows the flush deletes itself are left out).
+    Association rows aren't listed; they go with either side. For before_flush listeners:
+    the rows are read once per flush, by whichever listener asks first, and shared.
+    """
+    cached = session.info.get('cascaded_rows')
+    if cached is not None and cached[0] is flush_context:
+        return cached[1]
+    deleted = {(db.inspect(obj).mapper.class_, db.inspect(obj).identity) for obj in session.deleted}
+    found = {}
+    with session.no_autoflush:
+        for obj in session.deleted:
+            for model, condition in _cascade_rules(obj):
+                mapper = db.inspect(model)
+                rows = found.setdefault(model, {})
+                for row in session.execute(select(mapper.local_table).where(condition)):
+                    key = tuple(row._mapping[column] for column in mapper.primary_key)
+                    if (model, key) not in deleted:
+                        rows.setdefault(key, row)
+    result = {model: list(rows.values()) for model, rows in found.items() if rows}
+    session.info['cascaded_rows'] = (flush_context, result)
+    return result
+
+
+def _forget_cascaded_rows(session, *args):
+    session.info.pop('cascaded_rows', None)
+
+
+event.listen(db.session, 'after_flush_postexec', _forget_cascaded_rows)
+event.listen(db.session, 'after_rollback', _forget_cascaded_rows)
+
+
+def plain_json(value):
+    """A value as the API would serialize it (dates as HTTP dates, and so on), as plain JSON types."""
+    return json.loads(current_app.json.dumps(value))
+
+# ------------------------Optimistic concurrency----------------------------------#
+# Venues, events, attendees, artists and tours carry a version_id. Their detail GETs and
+# PATCH responses send it as the ETag; a PATCH sent with If-Match must name the current
+# version (412 otherwise), and one that loses a race with another edit gets 409.
+def with_etag(instance, status=200):
+    response = jsonify(instance.to_dict())
+    response.set_etag(str(instance.version_id))
+    return response, status
+
+def check_if_match(instance):
+    """Returns an error response unless the request's If-Match allows editing `instance`."""
+    if not request.if_match:
+        if current_app.config.get('REQUIRE_IF_MATCH'):
+            return jsonify({"error": "An If-Match header with the record's ETag is required."}), 428
+        return None
+    if request.if_match.star_tag or request.if_match.contains(str(instance.version_id)):
+        return None
+    response = jsonify({"error": "This record was changed since you loaded it. Reload it and try again."})
+    response.set_etag(str(instance.version_id))
+    return response, 412
+
+def bump_version(instance):
+    # Relationship-only edits issue no UPDATE of the row, so count every PATCH explicitly
+    instance.version_id += 1
+
+def edit_conflict():
+    db.session.rollback()
+    return jsonify({"error": "This record was changed by someone else while saving. Reload it and try again."}), 409
+
 # ------------------------AttendeeVenue----------------------------------#
 class AttendeeVenue(db.Model):
     __tablename__ = 'attendee_venue'
-    attendee_id = db.Column(db.Integer, db.ForeignKey('attendees.id'), primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), primary_key=True)
+    attendee_id = db.Column(db.Integer, db.ForeignKey('attendees.id', ondelete='CASCADE'), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
     rating = db.Column(db.Integer)
 
     attendee = db.relationship('Attendee', back_populates='venues')
     venue = db.relationship('Venue', back_populates='attendees')
 
-@app.post('/api/venues/<int:venue_id>/rate')
+RATING_CHUNK_SIZE = 500
+MAX_BATCH_RATINGS = 10000
+
+def valid_rating(rating):
+    return isinstance(rating, int) and not isinstance(rating, bool) and 1 <= rating <= 5
+
+def upsert_ratings(executor, rows):
+    """
+    Inserts or updates attendee_venue rows in a single statement.
+    `rows` are dicts with attendee_id, venue_id and rating; `executor` is a Session or Connection.
+    """
+    if not rows:
+        return
+    table = AttendeeVenue.__table__
+    dialect = executor.get_bind().dialect.name if hasattr(executor, 'get_bind') else executor.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.attendee_id, table.c.venue_id],
+            set_={'rating': stmt.excluded.rating},
+        )
+        executor.execute(stmt)
+    else:
+        # No portable upsert: replace the rows inside the caller's transaction instead
+        for row in rows:
+            executor.execute(delete(table).where(
+                table.c.attendee_id == row['attendee_id'], table.c.venue_id == row['venue_id']
+            ))
+        executor.execute(table.insert(), rows)
+
+    import changes  # the ORM never sees these rows, so log them for the change feed here
+    changes.record_changes(executor, [
+        ('attendee_venue', {'attendee_id': row['attendee_id'], 'venue_id': row['venue_id']}, 'upsert', {'rating': row['rating']})
+        for row in rows
+    ])
+
+def refresh_venue_ratings(executor, venue_ids):
+    """Recomputes the stored rating count/sum of the given venues in one UPDATE."""
+    venue_ids = {venue_id for venue_id in venue_ids if venue_id is not None}
+    if not venue_ids:
+        return
+    venues, ratings = Venue.__table__, AttendeeVenue.__table__
+    executor.execute(
+        update(venues)
+        .where(venues.c.id.in_(venue_ids))
+        .values(
+            rating_count=select(func.count(ratings.c.rating))
+            .where(ratings.c.venue_id == venues.c.id).scalar_subquery(),
+            rating_sum=select(func.coalesce(func.sum(ratings.c.rating), 0))
+            .where(ratings.c.venue_id == venues.c.id).scalar_subquery(),
+        )
+    )
+
+# Ratings changed through the ORM (attendee create/update, rating PATCH/DELETE) keep the
+# venue aggregates current too; the set-based paths call refresh_venue_ratings themselves.
+@event.listens_for(AttendeeVenue, 'after_insert')
+@event.listens_for(AttendeeVenue, 'after_update')
+@event.listens_for(AttendeeVenue, 'after_delete')
+def _refresh_rated_venue(mapper, connection, target):
+    refresh_venue_ratings(connection, [target.venue_id])
+
+@click.command('refresh-venue-ratings')
+def refresh_venue_ratings_command():
+    """Recompute every venue's stored rating count and sum."""
+    venue_ids = db.session.execute(select(Venue.id)).scalars().all()
+    for start in range(0, len(venue_ids), RATING_CHUNK_SIZE):
+        refresh_venue_ratings(db.session, venue_ids[start:start + RATING_CHUNK_SIZE])
+    db.session.commit()
+    click.echo(f"Refreshed ratings for {len(venue_ids)} venues.")
+
+@api.post('/api/venues/<int:venue_id>/rate')
 def rate_venue(venue_id):
     data = request.get_json()
     attendee_id = data.get('attendee_id')
@@ -76,32 +239,78 @@ def rate_venue(venue_id):
     if not attendee_id or rating is None:
         return jsonify({'error': 'Attendee ID and rating are required.'}), 400
 
-    attendee = Attendee.query.get(attendee_id)
-    venue = Venue.query.get(venue_id)
+    if not valid_rating(rating):
+        return jsonify({'error': 'Rating must be between 1 and 5.'}), 400
 
-    if not attendee or not venue:
-        return jsonify({'error': 'Attendee or Venue not found.'}), 404
+    # Both existence checks in one round trip
+    attendee_exists, venue_exists = db.session.execute(select(
+        select(Attendee.id).where(Attendee.id == attendee_id).exists(),
+        select(Venue.id).where(Venue.id == venue_id).exists(),
+    )).one()
 
-    # Check if the AttendeeVenue association already exists
-    av = AttendeeVenue.query.filter_by(attendee_id=attendee_id, venue_id=venue_id).first()
+    if not attendee_exists or not venue_exists:
+        return jsonify({'error': 'Attendee or Venue not found.'}), 404
 
-    if not av:
-        # Create a new association
-        av = AttendeeVenue(attendee_id=attendee_id, venue_id=venue_id, rating=rating)
-        db.session.add(av)
+    upsert_ratings(db.session, [{'attendee_id': attendee_id, 'venue_id': venue_id, 'rating': rating}])
+    refresh_venue_ratings(db.session, [venue_id])
+    db.session.commit()
 
-    if not (1 <= rating <= 5):
-        return jsonify({'error': 'Rating must be between 1 and 5.'}), 400
+    return jsonify({'message': 'Rating submitted successfully.'}), 200
 
-    else:
-        # Update existing rating
-        av.rating = rating
+@api.post('/api/ratings/batch')
+def rate_venues_batch():
+    """
+    Accepts {"ratings": [{"attendee_id", "venue_id", "rating"}, ...]} and upserts the valid ones
+    in chunks. Invalid entries are reported back by index instead of failing the whole batch.
+    """
+    data = request.get_json(silent=True) or {}
+    ratings = data.get('ratings')
+    if not isinstance(ratings, list) or not ratings:
+        return jsonify({'error': 'A non-empty list of ratings is required.'}), 400
+    if len(ratings) > MAX_BATCH_RATINGS:
+        return jsonify({'error': f'At most {MAX_BATCH_RATINGS} ratings per batch.'}), 400
+
+    rejected = []
+    candidates = {}  # (attendee_id, venue_id) -> rating; the last entry for a pair wins
+    for index, item in enumerate(ratings):
+        if not isinstance(item, dict):
+            rejected.append({'index': index, 'error': 'Rating must be an object.'})
+            continue
+        attendee_id, venue_id, rating = item.get('attendee_id'), item.get('venue_id'), item.get('rating')
+        if not isinstance(attendee_id, int) or not isinstance(venue_id, int):
+            rejected.append({'index': index, 'error': 'Attendee ID and venue ID are required.'})
+        elif not valid_rating(rating):
+            rejected.append({'index': index, 'error': 'Rating must be between 1 and 5.'})
+        else:
+            candidates[(attendee_id, venue_id)] = (index, rating)
+
+    # Existence of every referenced attendee and venue, checked with one IN query each
+    attendee_ids = {attendee_id for attendee_id, _ in candidates}
+    venue_ids = {venue_id for _, venue_id in candidates}
+    known_attendees = set(db.session.execute(select(Attendee.id).where(Attendee.id.in_(attendee_ids))).scalars())
+    known_venues = set(db.session.execute(select(Venue.id).where(Venue.id.in_(venue_ids))).scalars())
+
+    rows = []
+    for (attendee_id, venue_id), (index, rating) in candidates.items():
+        if attendee_id not in known_attendees or venue_id not in known_venues:
+            rejected.append({'index': index, 'error': 'Attendee or Venue not found.'})
+        else:
+            rows.append({'attendee_id': attendee_id, 'venue_id': venue_id, 'rating': rating})
 
-    db.session.commit()
+    try:
+        for start in range(0, len(rows), RATING_CHUNK_SIZE):
+            chunk = rows[start:start + RATING_CHUNK_SIZE]
+            upsert_ratings(db.session, chunk)
+            refresh_venue_ratings(db.session, [row['venue_id'] for row in chunk])
+            db.session.commit()
+    except Exception as exception:
+        db.session.rollback()
+        return jsonify({'error': str(exception), 'accepted': start}), 400
 
-    return jsonify({'message': 'Rating submitted successfully.'}), 200
+    rejected.sort(key=lambda entry: entry['index'])
+    return jsonify({'accepted': len(rows), 'rejected': rejected}), 200
 
-@app.get('/api/venues/<int:venue_id>/ratings')
+@api.get('/api/venues/<int:venue_id>/ratings')
 def get_venue_ratings(venue_id):
     venue = Venue.query.get(venue_id)
     if not venue:
@@ -117,7 +326,7 @@ def get_venue_ratings(venue_id):
 
     return jsonify(ratings), 200
 
-@app.get('/api/attendees/<int:attendee_id>/ratings')
+@api.get('/api/attendees/<int:attendee_id>/ratings')
 def get_attendee_ratings(attendee_id):
     attendee = Attendee.query.get(attendee_id)
     if not attendee:
@@ -133,7 +342,7 @@ def get_attendee_ratings(attendee_id):
 
     return jsonify(ratings), 200
 
-@app.patch('/api/venues/<int:venue_id>/rate')
+@api.patch('/api/venues/<int:venue_id>/rate')
 def update_venue_rating(venue_id):
     data = request.get_json()
     attendee_id = data.get('attendee_id')
@@ -152,7 +361,7 @@ def update_venue_rating(venue_id):
 
     return jsonify({'message': 'Rating updated successfully.'}), 200
 
-@app.delete('/api/venues/<int:venue_id>/rate')
+@api.delete('/api/venues/<int:venue_id>/rate')
 def delete_venue_rating(venue_id):
     data = request.get_json()
     attendee_id = data.get('attendee_id')
@@ -181,17 +390,24 @@ class Venue(db.Model, SerializerMixin):
     email = db.Column(db.String(100), nullable=False)
     earnings = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)  # Added description column
-    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_venue_created_by'), nullable=True)
-
-    attendees = db.relationship('AttendeeVenue', back_populates='venue', cascade='all, delete-orphan')
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    # Kept current by refresh_venue_ratings() so average_rating needs no rating rows loaded
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_venue_created_by', ondelete='CASCADE'), nullable=True)
+    # Bumped by SQLAlchemy on every UPDATE and checked in its WHERE clause; see check_if_match()
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
+    attendees = db.relationship('AttendeeVenue', back_populates='venue', cascade='all, delete-orphan', passive_deletes=True)
     attendee_list = association_proxy('attendees', 'attendee')
     creator = db.relationship('User', back_populates='venues')
 
     @property
     def average_rating(self):
-        ratings = [av.rating for av in self.attendees if av.rating is not None]
-        if ratings:
-            return round(sum(ratings) / len(ratings), 2)  # Rounded to 2 decimal places
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 2)  # Rounded to 2 decimal places
         else:
             return None  # Or return 0 if you prefer
     
@@ -211,6 +427,8 @@ class Venue(db.Model, SerializerMixin):
             'email': self.email,
             'earnings': self.earnings,
             'description': self.description,  # Include description in the dictionary
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'created_by': {'id': self.creator.id, 'username': self.creator.username} if self.creator else None,
             'events': [{'id': event.id, 'name': event.name} for event in self.events] if self.events else [],
             'attendees': [
@@ -223,12 +441,12 @@ class Venue(db.Model, SerializerMixin):
             'average_rating': self.average_rating  # Include average_rating here
         }
 # Update the decorators to use @app.route() instead of app.get()
-@app.get("/api/venues")
+@api.get("/api/venues")
 def index():
     venues = Venue.query.all()
     return jsonify([venue.to_dict() for venue in venues]), 200
 
-@app.post("/api/venues")
+@api.post("/api/venues")
 def create_venue():
     data = request.get_json()
     user_id = session.get('user_id')  # Retrieve user_id from session
@@ -241,6 +459,8 @@ def create_venue():
             email=data['email'],
             earnings=data['earnings'],
             description=data.get('description'),  # Get description, defaulting to None if not provided
+            latitude=data.get('latitude'),
+            longitude=data.get('longitude'),
             created_by_id=user_id  # Track the creator
         )
         # Add to the database
@@ -252,15 +472,15 @@ def create_venue():
     except Exception as exception:
         return jsonify({"error": str(exception)}), 400
     
-@app.get("/api/venues/<int:id>")
+@api.get("/api/venues/<int:id>")
 def get_venue_by_id(id):
     venue = db.session.get(Venue, id)
     if venue:
-        return jsonify(venue.to_dict()), 200
+        return with_etag(venue)
     else:
         return jsonify({"error":"Venue ID not Found"}), 404
 
-@app.patch("/api/venues/<int:id>")
+@api.patch("/api/venues/<int:id>")
 def update_venue(id):
     user_id = session.get('user_id')
 
@@ -272,20 +492,27 @@ def update_venue(id):
     # Check if the user is an admin or the creator of the venue
     if not (is_admin_user(user_id) or venue.created_by_id == user_id):
         return jsonify({"error": "Unauthorized access"}), 403
+    failed = check_if_match(venue)
+    if failed:
+        return failed
 
     # Proceed with the update if authorized
     data = request.json
     try:
         for key, value in data.items():
-            setattr(venue, key, value)  # Update each attribute
+            if key != 'version_id':
+                setattr(venue, key, value)  # Update each attribute
+        bump_version(venue)
         db.session.commit()
-        return jsonify(venue.to_dict()), 200
+        return with_etag(venue)
 
+    except StaleDataError:
+        return edit_conflict()
     except Exception as exception:
         db.session.rollback()
         return jsonify({"error": str(exception)}), 400
     
-@app.delete('/api/venues/<int:id>')
+@api.delete('/api/venues/<int:id>')
 def delete_venue(id):
     user_id = session.get('user_id')
 
@@ -300,14 +527,7 @@ def delete_venue(id):
 
     # Proceed with deletion if authorized
     try:
-        # Delete all associations with the venue
-        AttendeeVenue.query.filter_by(venue_id=id).delete()
-
-        # Delete all associated events first
-        for event in venue.events:
-            db.session.delete(event)
-
-        # Now delete the venue itself
+        # Its ratings and events (and theirs in turn) are removed by ON DELETE CASCADE
         db.session.delete(venue)
         db.session.commit()
         return jsonify({}), 204
@@ -317,7 +537,7 @@ def delete_venue(id):
         return jsonify({"error": str(exception)}), 400
 
 
-@app.get("/api/venues/search")
+@api.get("/api/venues/search")
 def search_venues_by_name():
     venue_name = request.args.get('name')
     if venue_name:
@@ -337,20 +557,37 @@ class Event(db.Model, SerializerMixin):
     __tablename__ = "events"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)
     time = db.Column(db.String(50), nullable=False)
     location = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(150), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), nullable=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), nullable=True)
     event_type = db.Column(db.String(50), nullable=False)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # For creator tracking
+    latitude = db.Column(db.Float, nullable=True)  # Falls back to the venue's coordinates when unset
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # Maintained by geo.py
+    # Booking interval derived from date + time (+ end_time); see set_schedule()
+    start_at = db.Column(db.DateTime, nullable=True)
+    end_at = db.Column(db.DateTime, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))  # For creator tracking
+    # Rows in attendee_events for this event, kept by database triggers (see checkins.py)
+    attendee_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_events_venue_schedule', 'venue_id', 'start_at', 'end_at'),
+        # Never hand out the id of a deleted or archived event again: events_archive keeps
+        # the ids, and the change log, audit log and idempotency keys refer to them
+        {'sqlite_autoincrement': True},
+    )
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     creator = db.relationship('User')  # Relationship to User model
-    venue = db.relationship('Venue', backref='events')
-    attendees = db.relationship('Attendee', secondary='attendee_events', back_populates='attended_events')
-    favorited_by = db.relationship('Attendee', secondary='attendee_favorites', back_populates='favorite_events')
-    artists = db.relationship('Artist', secondary='artist_events', back_populates='events')
-    tours = db.relationship('Tour', secondary='tour_events', back_populates='events')
+    venue = db.relationship('Venue', backref=db.backref('events', cascade='all', passive_deletes=True))
+    attendees = db.relationship('Attendee', secondary='attendee_events', back_populates='attended_events', passive_deletes=True)
+    favorited_by = db.relationship('Attendee', secondary='attendee_favorites', back_populates='favorite_events', passive_deletes=True)
+    artists = db.relationship('Artist', secondary='artist_events', back_populates='events', passive_deletes=True)
+    tours = db.relationship('Tour', secondary='tour_events', back_populates='events', passive_deletes=True)
 
     def to_dict(self):
         print("Creator:", self.creator)
@@ -363,21 +600,172 @@ class Event(db.Model, SerializerMixin):
             'location': self.location,
             'description': self.description,
             'event_type': self.event_type,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'start_at': self.start_at,
+            'end_at': self.end_at,
             'created_by': {'id': self.creator.id, 'username': self.creator.username} if self.creator else None,
-            'venue': {'id': self.venue.id, 'name': self.venue.name},
+            'venue': {'id': self.venue.id, 'name': self.venue.name} if self.venue else None,
             'attendees': [{'id': attendee.id, 'first_name': attendee.first_name} for attendee in self.attendees],
             'artists': [{'id': artist.id, 'name': artist.name} for artist in self.artists],  # Avoid deep references
         }
+
+    def set_schedule(self, end_time=None):
+        """
+        Fills start_at/end_at from date, the free-form time string and an optional end time.
+        Without an end time the event is booked for EVENT_DEFAULT_DURATION; an end time
+        earlier than the start means the show runs past midnight. A time that can't be read
+        ("TBD", "Doors 8") leaves the event unscheduled, so it blocks no booking.
+        """
+        day = datetime.combine(self.date.date(), datetime.min.time())
+        start = parse_time_of_day(self.time)
+        if start is None:
+            self.start_at = self.end_at = None
+            return
+        self.start_at = day + start
+        end = parse_time_of_day(end_time) if end_time else None
+        if end is None:
+            self.end_at = self.start_at + EVENT_DEFAULT_DURATION
+        else:
+            self.end_at = day + end
+            if self.end_at <= self.start_at:
+                self.end_at += timedelta(days=1)
+
+EVENT_DEFAULT_DURATION = timedelta(hours=3)
+TIME_OF_DAY = re.compile(r'^\s*(\d{1,2})(?::(\d{2}))?(?::\d{2})?\s*([ap])?\.?\s*m?\.?\s*$', re.IGNORECASE)
+
+def parse_time_of_day(text):
+    """Reads '20:00', '8:30 PM', '8pm', '20:00:00' etc. as a timedelta since midnight, or None."""
+    match = TIME_OF_DAY.match(text or '')
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), (match.group(3) or '').lower()
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == 'p' else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return timedelta(hours=hour, minutes=minute)
+
+def venue_conflicts(venue_id, start_at, end_at, exclude_id=None):
+    """Events already booked at the venue that overlap [start_at, end_at); served by ix_events_venue_schedule."""
+    if venue_id is None or start_at is None:
+        return []
+    query = Event.query.filter(
+        Event.venue_id == venue_id,
+        Event.start_at < end_at,
+        Event.end_at > start_at,
+    )
+    if exclude_id is not None:
+        query = query.filter(Event.id != exclude_id)
+    return query.order_by(Event.start_at).all()
+
+def conflict_response(conflicts):
+    return jsonify({
+        "error": "Venue is already booked at that time.",
+        "conflicts": [
+            {'id': event.id, 'name': event.name, 'start_at': event.start_at, 'end_at': event.end_at}
+            for event in conflicts
+        ],
+    }), 409
+
+@event.listens_for(Event, 'before_insert')
+def _default_schedule(mapper, connection, target):
+    # Events created outside the routes (seeds, scripts) still get a booking interval
+    if target.start_at is None and target.date is not None:
+        target.set_schedule()
+
+class EventCard(db.Model):
+    """
+    Read model: each event's to_dict() output, stored ready to serve.
+    Kept current by event_cards.py; listing endpoints read it instead of walking relationships.
+    """
+    __tablename__ = 'event_cards'
+    event_id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.JSON, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+def cards_built():
+    """False on a database with events but no cards yet, before `flask sync-schema` fills them."""
+    return bool(
+        db.session.query(EventCard.query.exists()).scalar() or not db.session.query(Event.query.exists()).scalar()
+    )
+
+@click.command('backfill-event-schedule')
+@click.option('--batch-size', type=int, default=500)
+def backfill_event_schedule_command(batch_size):
+    """Add events.start_at/end_at to an existing database and fill them in."""
+    sync_schema()
+
+    filled, last_id = 0, 0
+    while True:
+        # By id: events whose time can't be read stay unscheduled and would come round again
+        batch = Event.query.filter(Event.start_at.is_(None), Event.id > last_id).order_by(Event.id).limit(batch_size).all()
+        if not batch:
+            break
+        for row in batch:
+            row.set_schedule()
+        last_id = batch[-1].id
+        filled += sum(row.start_at is not None for row in batch)
+        db.session.commit()
+    click.echo(f"Scheduled {filled} events.")
+
+@api.get('/api/venues/<int:venue_id>/availability')
+def get_venue_availability(venue_id):
+    """Bookings and free slots for a venue between ?from= and ?to= (dates or ISO datetimes)."""
+    if not db.session.get(Venue, venue_id):
+        return jsonify({"error": "Venue ID not found"}), 404
+    try:
+        window_start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else \
+            datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        raw_to = request.args.get('to')
+        window_end = datetime.fromisoformat(raw_to) if raw_to else window_start + timedelta(days=30)
+        if raw_to and len(raw_to) == 10:
+            window_end += timedelta(days=1)  # a bare date includes that whole day
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD or ISO datetimes."}), 400
+    if window_end <= window_start:
+        return jsonify({"error": "'to' must be after 'from'."}), 400
+    if window_end - window_start > timedelta(days=366):
+        return jsonify({"error": "Availability window is limited to one year."}), 400
+
+    bookings = venue_conflicts(venue_id, window_start, window_end)
+
+    # Single pass over bookings sorted by start: every gap before the next start is free
+    free, cursor = [], window_start
+    for booking in bookings:
+        if booking.start_at > cursor:
+            free.append({'start': cursor, 'end': booking.start_at})
+        cursor = max(cursor, booking.end_at)
+    if cursor < window_end:
+        free.append({'start': cursor, 'end': window_end})
+
+    return jsonify({
+        'venue_id': venue_id,
+        'from': window_start,
+        'to': window_end,
+        'bookings': [
+            {'id': booking.id, 'name': booking.name, 'start_at': booking.start_at, 'end_at': booking.end_at}
+            for booking in bookings
+        ],
+        'free': free,
+    }), 200
+
 # GET all events
-@app.get("/api/events")
+@api.get("/api/events")
 def get_events():
-    return jsonify([
-        event.to_dict()
-        for event in Event.query.all()
-    ]), 200
+    # One scan of the prebuilt cards instead of five relationship loads per event
+    cards = [card.payload for card in EventCard.query.order_by(EventCard.event_id)]
+    if not cards and not cards_built():
+        cards = [event.to_dict() for event in Event.query.order_by(Event.id)]
+    if wants_archived():
+        cards += [event.to_dict() for event in ArchivedEvent.query.all()]
+    return jsonify(cards), 200
 
 # POST a new event with a venue
-@app.post("/api/events")
+@api.post("/api/events")
 def create_event():
     data = request.get_json()
     user_id = session.get('user_id')
@@ -409,9 +797,16 @@ def create_event():
             description=data['description'],
             venue_id=data.get('venue_id', None),  # Allow venue_id to be None
             event_type=data['event_type'],
+            latitude=data.get('latitude'),
+            longitude=data.get('longitude'),
             created_by_id=user_id  # Track the creator
 
         )
+        new_event.set_schedule(data.get('end_time'))
+
+        conflicts = venue_conflicts(new_event.venue_id, new_event.start_at, new_event.end_at)
+        if conflicts:
+            return conflict_response(conflicts)
 
         # Assign artists (if provided)
         if 'artist_ids' in data:
@@ -425,15 +820,15 @@ def create_event():
     except Exception as exception:
         return jsonify({"error": str(exception)}), 400
 # GET a specific event by ID
-@app.get("/api/events/<int:id>")
+@api.get("/api/events/<int:id>")
 def get_event_by_id(id):
     event = db.session.get(Event, id)
     if event:
-        return jsonify(event.to_dict()), 200
+        return with_etag(event)
     else:
         return jsonify({"error": "Event ID not found"}), 404
 
-@app.patch("/api/events/<int:id>")
+@api.patch("/api/events/<int:id>")
 def update_event(id):
     user_id = session.get('user_id')
 
@@ -443,15 +838,34 @@ def update_event(id):
     data = request.json
     event = Event.query.filter(Event.id == id).first()
     if event:
+        failed = check_if_match(event)
+        if failed:
+            return failed
         try:
+            # Length of the show as booked so far, kept when only the start moves
+            duration = None
+            if event.start_at and event.end_at and parse_time_of_day(event.time) is not None:
+                duration = event.end_at - event.start_at
+
             # If date is provided, ensure it's in the correct format
             if 'date' in data:
                 event.date = datetime.strptime(data['date'], '%Y-%m-%d')
 
             # Update the other fields
             for key in data:
-                if key != "date":  # Skip date since we already handled it
+                if key not in ("date", "end_time", "start_at", "end_at", "version_id"):  # Skip date and the derived schedule
                     setattr(event, key, data[key])
+
+            # Re-book the venue if anything that decides the booking changed
+            if any(key in data for key in ('date', 'time', 'end_time', 'venue_id')):
+                event.set_schedule(data.get('end_time'))
+                if 'end_time' not in data and duration and parse_time_of_day(event.time) is not None:
+                    event.end_at = event.start_at + duration
+                with db.session.no_autoflush:
+                    conflicts = venue_conflicts(event.venue_id, event.start_at, event.end_at, exclude_id=event.id)
+                if conflicts:
+                    db.session.rollback()
+                    return conflict_response(conflicts)
             
             # Update artists if artist_ids is provided
             if 'artist_ids' in data:
@@ -461,15 +875,18 @@ def update_event(id):
                 artists = Artist.query.filter(Artist.id.in_(data['artist_ids'])).all()
                 event.artists.extend(artists)  # Add new artists
 
+            bump_version(event)
             db.session.commit()
-            return jsonify(event.to_dict()), 200
+            return with_etag(event)
+        except StaleDataError:
+            return edit_conflict()
         except Exception as exception:
             db.session.rollback()  # Rollback on error
             return jsonify({"error": str(exception)}), 400
     else:
         return jsonify({"error": "Event ID not found"}), 404
 # DELETE an event by ID
-@app.delete('/api/events/<int:id>')
+@api.delete('/api/events/<int:id>')
 def delete_event(id):
     user_id = session.get('user_id')
 
@@ -491,27 +908,75 @@ def delete_event(id):
         db.session.rollback()
         return jsonify({"error": str(exception)}), 400
 
-@app.get("/api/events/search")
+@api.get("/api/events/search")
 def search_events_by_name():
     search_term = request.args.get('searchTerm')  # Accept a single search parameter
     if search_term:
         # Normalize the input: strip spaces and convert to lowercase
         search_term_normalized = search_term.strip().lower()
         
-        # Search for events by name, location, or event type
-        events = Event.query.filter(
+        # Search for events by name, location, or event type, serving the matches' cards
+        matches = (
             (Event.name.ilike(f'%{search_term_normalized}%')) |
             (Event.location.ilike(f'%{search_term_normalized}%')) |
             (Event.event_type.ilike(f'%{search_term_normalized}%'))
-        ).all()
+        )
+        events = db.session.execute(
+            select(EventCard.payload).join(Event, Event.id == EventCard.event_id).filter(matches).order_by(EventCard.event_id)
+        ).scalars().all()
+        if not events and not cards_built():
+            events = [event.to_dict() for event in Event.query.filter(matches).order_by(Event.id)]
+        if wants_archived():
+            events += [event.to_dict() for event in ArchivedEvent.query.filter(
+                (ArchivedEvent.name.ilike(f'%{search_term_normalized}%')) |
+                (ArchivedEvent.location.ilike(f'%{search_term_normalized}%')) |
+                (ArchivedEvent.event_type.ilike(f'%{search_term_normalized}%'))
+            ).all()]
         
         if events:
-            return jsonify([event.to_dict() for event in events]), 200
+            return jsonify(events), 200
         else:
             return jsonify({"error": "No events found with that search term"}), 404
     return jsonify({"error": "Search term not provided"}), 400
 
 
+#---------------------------------ARCHIVED EVENTS----------------------------#
+# Past events are moved here by archive.py so the hot tables only hold what is still relevant.
+# Same columns as the live tables, without foreign keys, so archived rows never block deletes.
+def archive_table(source, name):
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in source.columns]
+    return Table(name, db.metadata, *columns, Column('archived_at', db.DateTime, nullable=False, default=datetime.utcnow))
+
+events_archive = archive_table(Event.__table__, 'events_archive')
+attendee_events_archive = archive_table(attendee_events, 'attendee_events_archive')
+attendee_favorites_archive = archive_table(attendee_favorites, 'attendee_favorites_archive')
+artist_events_archive = archive_table(artist_events, 'artist_events_archive')
+tour_events_archive = archive_table(tour_events, 'tour_events_archive')
+
+class ArchivedEvent(db.Model):
+    __table__ = events_archive
+
+    creator = db.relationship('User', primaryjoin=lambda: foreign(ArchivedEvent.created_by_id) == User.id, viewonly=True)
+    venue = db.relationship('Venue', primaryjoin=lambda: foreign(ArchivedEvent.venue_id) == Venue.id, viewonly=True)
+    attendees = db.relationship(
+        'Attendee', secondary=attendee_events_archive, viewonly=True,
+        primaryjoin=lambda: ArchivedEvent.id == foreign(attendee_events_archive.c.event_id),
+        secondaryjoin=lambda: Attendee.id == foreign(attendee_events_archive.c.attendee_id),
+    )
+    artists = db.relationship(
+        'Artist', secondary=artist_events_archive, viewonly=True,
+        primaryjoin=lambda: ArchivedEvent.id == foreign(artist_events_archive.c.event_id),
+        secondaryjoin=lambda: Artist.id == foreign(artist_events_archive.c.artist_id),
+    )
+
+    def to_dict(self):
+        return {**Event.to_dict(self), 'archived': True}
+
+def wants_archived():
+    """List and search endpoints only read the live events table unless asked otherwise."""
+    return request.args.get('include_archived', '').lower() == 'true'
+
+
 #---------------------------------ATTENDEES----------------------------#
 
 
@@ -524,12 +989,14 @@ class Attendee(db.Model, SerializerMixin):
     preferred_event_type = db.Column(db.String(100), nullable=True)
     favorite_event_types = db.Column(db.Text, nullable=True)
     social_media = db.Column(db.JSON, nullable=True)  # Change to JSON type
-    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    creator = db.relationship('User', backref='attendees_created')
-    favorite_artists = db.relationship('Artist', secondary='artist_favorites', back_populates='favorited_by')
-    attended_events = db.relationship('Event', secondary='attendee_events', back_populates='attendees')
-    favorite_events = db.relationship('Event', secondary='attendee_favorites', back_populates='favorited_by', lazy='dynamic')
-    venues = db.relationship('AttendeeVenue', back_populates='attendee', cascade='all, delete-orphan')
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+    creator = db.relationship('User', backref=db.backref('attendees_created', passive_deletes=True))
+    favorite_artists = db.relationship('Artist', secondary='artist_favorites', back_populates='favorited_by', passive_deletes=True)
+    attended_events = db.relationship('Event', secondary='attendee_events', back_populates='attendees', passive_deletes=True)
+    favorite_events = db.relationship('Event', secondary='attendee_favorites', back_populates='favorited_by', lazy='dynamic', passive_deletes=True)
+    venues = db.relationship('AttendeeVenue', back_populates='attendee', cascade='all, delete-orphan', passive_deletes=True)
     venue_list = association_proxy('venues', 'venue')
 
     def to_dict(self):
@@ -557,7 +1024,7 @@ class Attendee(db.Model, SerializerMixin):
             ]
         }
 # POST: Create new attendee with favorite events
-@app.post("/api/attendees")
+@api.post("/api/attendees")
 def create_attendee():
     data = request.get_json()
     user_id = session.get('user_id')
@@ -607,7 +1074,7 @@ def create_attendee():
     except Exception as exception:
         return jsonify({"error": str(exception)}), 400
 # GET: Retrieve all attendees
-@app.get("/api/attendees")
+@api.get("/api/attendees")
 def get_all_attendees():
     try:
         attendees = Attendee.query.all()
@@ -621,7 +1088,7 @@ def get_all_attendees():
 
 # PATCH: Update an attendee by ID
 # PATCH: Update an attendee by ID
-@app.patch("/api/attendees/<int:id>")
+@api.patch("/api/attendees/<int:id>")
 def update_attendee(id):
     user_id = session.get('user_id')
 
@@ -633,6 +1100,9 @@ def update_attendee(id):
     # Check if the user is an admin or the creator of the attendee
     if not (is_admin_user() or attendee.created_by_id == user_id):
         return jsonify({"error": "Unauthorized access"}), 403
+    failed = check_if_match(attendee)
+    if failed:
+        return failed
 
     # Proceed with the update if authorized
     data = request.json
@@ -669,15 +1139,18 @@ def update_attendee(id):
                 else:
                     return jsonify({"error": f"Venue with id {venue_id} not found"}), 404
 
+        bump_version(attendee)
         db.session.commit()
-        return jsonify(attendee.to_dict()), 200
+        return with_etag(attendee)
 
+    except StaleDataError:
+        return edit_conflict()
     except Exception as exception:
         db.session.rollback()
         return jsonify({"error": str(exception)}), 400
 
 # DELETE: Remove an attendee by ID
-@app.delete('/api/attendees/<int:id>')
+@api.delete('/api/attendees/<int:id>')
 def delete_attendee(id):
     user_id = session.get('user_id')
     attendee = Attendee.query.get(id)
@@ -690,15 +1163,20 @@ def delete_attendee(id):
 
     # Proceed with deletion if authorized
     try:
-        AttendeeVenue.query.filter_by(attendee_id=id).delete()  # Delete associated venues
+        rated_venue_ids = db.session.execute(
+            select(AttendeeVenue.venue_id).where(AttendeeVenue.attendee_id == id)
+        ).scalars().all()
+        # Ratings and event/favorite links go with the attendee by ON DELETE CASCADE
         db.session.delete(attendee)
+        db.session.flush()
+        refresh_venue_ratings(db.session, rated_venue_ids)
         db.session.commit()
         return jsonify({}), 204
     except Exception as exception:
         db.session.rollback()  # Rollback in case of error
         return jsonify({"error": str(exception)}), 400
     
-@app.get("/api/attendees/search")
+@api.get("/api/attendees/search")
 def search_attendees_by_name():
     attendee_name = request.args.get('name')
     if attendee_name:
@@ -715,7 +1193,7 @@ def search_attendees_by_name():
         return jsonify([attendee.to_dict() for attendee in attendees]), 200
 
     return jsonify({"error": "Attendee name not provided"}), 400
-@app.get("/api/event-types")
+@api.get("/api/event-types")
 def get_event_types():
     event_types = [
         "Drag Shows",
@@ -757,13 +1235,15 @@ class Artist(db.Model, SerializerMixin):
     age = db.Column(db.Integer, nullable=True)
     background = db.Column(db.Text, nullable=True)
     songs = db.Column(db.Text, nullable=True)  # Store song names or video URLs+
-    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
  
 
     # Link to events
-    events = db.relationship('Event', secondary='artist_events', back_populates='artists')
+    events = db.relationship('Event', secondary='artist_events', back_populates='artists', passive_deletes=True)
 
-    favorited_by = db.relationship('Attendee', secondary='artist_favorites', back_populates='favorite_artists')
+    favorited_by = db.relationship('Attendee', secondary='artist_favorites', back_populates='favorite_artists', passive_deletes=True)
     creator = db.relationship('User', back_populates='artists')
 
     def to_dict(self):
@@ -779,21 +1259,21 @@ class Artist(db.Model, SerializerMixin):
 
         }
 
-@app.get("/api/artists")
+@api.get("/api/artists")
 def get_all_artists():
     
     artists = Artist.query.all()
     return jsonify([artist.to_dict() for artist in artists]), 200
 
-@app.get("/api/attendees/<int:id>")
+@api.get("/api/attendees/<int:id>")
 def get_attendee_by_id(id):
     attendee = Attendee.query.get(id)  # Use get() for single ID lookup
     if attendee:
-        return jsonify(attendee.to_dict()), 200
+        return with_etag(attendee)
     else:
         return jsonify({"error": "Attendee ID not found"}), 404
 
-@app.post("/api/artists")
+@api.post("/api/artists")
 def create_artist():
     data = request.get_json()
     user_id = session.get('user_id')  # Retrieve user_id from session
@@ -829,7 +1309,7 @@ def create_artist():
         return jsonify(new_artist.to_dict()), 201
     except Exception as exception:
         return jsonify({"error": str(exception)}), 400
-@app.patch("/api/artists/<int:id>")
+@api.patch("/api/artists/<int:id>")
 def update_artist(id):
     
     data = request.json
@@ -840,6 +1320,9 @@ def update_artist(id):
     if not (is_admin_user(user_id) or artist.created_by_id == user_id):
         return jsonify({"error": "Unauthorized access"}), 403
     if artist:
+        failed = check_if_match(artist)
+        if failed:
+            return failed
         try:
             # Log the incoming data for debugging
             print("Incoming data for artist update:", data)
@@ -854,13 +1337,16 @@ def update_artist(id):
                             artist.events.append(event)  # Re-link events
                 else:
                     # Ensure we only set valid attributes
-                    if hasattr(artist, key):
+                    if hasattr(artist, key) and key != 'version_id':
                         setattr(artist, key, data[key])  # Update artist fields
                     else:
                         print(f"Warning: {key} is not a valid attribute of Artist")
 
+            bump_version(artist)
             db.session.commit()
-            return jsonify(artist.to_dict()), 200
+            return with_etag(artist)
+        except StaleDataError:
+            return edit_conflict()
         except Exception as e:
             print("Error updating artist:", e)  # Log the error for debugging
             return jsonify({"error": str(e)}), 400
@@ -868,7 +1354,7 @@ def update_artist(id):
         return jsonify({"error": "Artist ID not found"}), 404
 
 
-@app.delete("/api/artists/<int:id>")
+@api.delete("/api/artists/<int:id>")
 def delete_artist(id):
 
     # Retrieve the artist
@@ -892,7 +1378,7 @@ def delete_artist(id):
         return jsonify({"error": str(exception)}), 400
 
 
-@app.get("/api/artists/search")
+@api.get("/api/artists/search")
 def search_artists_by_name():
     artist_name = request.args.get('name')
     if artist_name:
@@ -910,11 +1396,11 @@ def search_artists_by_name():
             return jsonify({"error": "No artists found with that name"}), 404
     return jsonify({"error": "Artist name not provided"}), 400
 
-@app.get("/api/artists/<int:id>")
+@api.get("/api/artists/<int:id>")
 def get_artist_by_id(id):
     artist = Artist.query.get(id)
     if artist:
-        return jsonify(artist.to_dict()), 200
+        return with_etag(artist)
     else:
         return jsonify({"error": "Artist ID not found"}), 404
 
@@ -926,11 +1412,13 @@ class Tour(db.Model, SerializerMixin):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     description = db.Column(db.Text, nullable=True)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # Track the creator by user ID
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))  # Track the creator by user ID
     social_media_handles = db.Column(db.String(255), nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
     creator = db.relationship("User", back_populates="tours")  # Establish relationship with User
 
-    events = relationship("Event", secondary=tour_events, back_populates='tours')
+    events = relationship("Event", secondary=tour_events, back_populates='tours', passive_deletes=True, order_by='Event.date')
 
     def to_dict(self):
 
@@ -948,18 +1436,29 @@ class Tour(db.Model, SerializerMixin):
             'events': [{'name': event.name} for event in self.events] if self.events else [],
         }
 
-@app.post("/api/tours")
+@api.post("/api/tours")
 def create_tour():
     data = request.get_json()
     user_id = session.get('user_id')  # Retrieve user ID from session
 
 
     try:
-        
+        start_date = datetime.strptime(data['start_date'], '%m/%d/%Y').date()
+        end_date = datetime.strptime(data['end_date'], '%m/%d/%Y').date()
+        if end_date < start_date:
+            return jsonify({"error": "end_date must not be before start_date."}), 400
+
+        # Every event has to fall within the tour; checked for the whole list in one query
+        import itinerary
+        if data.get('event_ids'):
+            outside = itinerary.events_outside(start_date, end_date, event_ids=data['event_ids'])
+            if outside:
+                return itinerary.outside_error(start_date, end_date, outside)
+
         new_tour = Tour(
             name=data['name'],
-            start_date=datetime.strptime(data['start_date'], '%m/%d/%Y'),  # Adjusted to parse YYYY-MM-DD
-            end_date=datetime.strptime(data['end_date'], '%m/%d/%Y'),
+            start_date=start_date,
+            end_date=end_date,
             description=data['description'],
             social_media_handles=data.get('social_media_handles'),  # Optional
             created_by_id=user_id  # Track the creator
@@ -979,7 +1478,7 @@ def create_tour():
         return jsonify({"error": str(exception)}), 400
 
 
-@app.get("/api/tours")
+@api.get("/api/tours")
 def get_all_tours():
     try:
         tours = Tour.query.all()
@@ -987,7 +1486,7 @@ def get_all_tours():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.patch("/api/tours/<int:id>")
+@api.patch("/api/tours/<int:id>")
 def update_tour(id):
     user_id = session.get('user_id')
     tour = Tour.query.get(id)
@@ -995,10 +1494,28 @@ def update_tour(id):
         return jsonify({"error": "Tour ID not found"}), 404
     if not (is_admin_user() or tour.created_by_id == user_id):
         return jsonify({"error": "Unauthorized access"}), 403
+    failed = check_if_match(tour)
+    if failed:
+        return failed
     data = request.get_json()
     tour = Tour.query.get_or_404(id)  # Automatically raises a 404 if not found
     
     try:
+        # Check the new dates and event list together before changing anything
+        start_date = datetime.strptime(data['start_date'], '%m/%d/%Y').date() if 'start_date' in data else tour.start_date
+        end_date = datetime.strptime(data['end_date'], '%m/%d/%Y').date() if 'end_date' in data else tour.end_date
+        if end_date < start_date:
+            return jsonify({"error": "end_date must not be before start_date."}), 400
+        import itinerary
+        if 'event_ids' in data:
+            outside = itinerary.events_outside(start_date, end_date, event_ids=data['event_ids'] or [])
+        elif 'start_date' in data or 'end_date' in data:
+            outside = itinerary.events_outside(start_date, end_date, tour_id=tour.id)
+        else:
+            outside = []
+        if outside:
+            return itinerary.outside_error(start_date, end_date, outside)
+
         # Update tour details
         for key in ['name', 'description', 'social_media_handles']:
             if key in data:
@@ -1006,9 +1523,9 @@ def update_tour(id):
 
         # Update dates if provided
         if 'start_date' in data:
-            tour.start_date = datetime.strptime(data['start_date'], '%m/%d/%Y')  # Correct format
+            tour.start_date = start_date
         if 'end_date' in data:
-            tour.end_date = datetime.strptime(data['end_date'], '%m/%d/%Y')  # Correct format
+            tour.end_date = end_date
 
 
         # Update created_by_id or created_by_artist_id
@@ -1023,15 +1540,18 @@ def update_tour(id):
             tour.events.clear()  # Clear existing associations
             tour.events.extend(events)  # Add new associations
 
+        bump_version(tour)
         db.session.commit()
-        return jsonify(tour.to_dict()), 200
+        return with_etag(tour)
+    except StaleDataError:
+        return edit_conflict()
     except Exception as exception:
         db.session.rollback()
         error_message = f"Error updating tour: {str(exception)}"
         print(error_message)  # Log the error
         return jsonify({"error": error_message}), 400
 
-@app.delete("/api/tours/<int:id>")
+@api.delete("/api/tours/<int:id>")
 def delete_tour(id):
     user_id = session.get('user_id')
     tour = Tour.query.get(id)
@@ -1047,15 +1567,15 @@ def delete_tour(id):
     except Exception as exception:
         return jsonify({"error": str(exception)}), 400
 
-@app.get("/api/tours/<int:id>")
+@api.get("/api/tours/<int:id>")
 def get_tour(id):
     tour = Tour.query.get(id)
     if tour:
-        return jsonify(tour.to_dict()), 200
+        return with_etag(tour)
     else:
         return jsonify({"error": "Tour not found"}), 404
     
-@app.get("/api/tours/search")
+@api.get("/api/tours/search")
 def search_tours_by_name():
     tour_name = request.args.get('name')
     if tour_name:
@@ -1067,9 +1587,6 @@ def search_tours_by_name():
         
         return jsonify([tour.to_dict() for tour in tours]), 200
     return jsonify({"error": "Tour name not provided"}), 400
-if __name__ == '__main__':
-    app.run(port=5001, debug=True)
-
 #-------------------------------#User--------------------#
 class User(db.Model):
     __tablename__ = "users"
@@ -1078,10 +1595,11 @@ class User(db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     user_type = db.Column(db.String(50), nullable=False)  # 'artist', 'attendee', etc.
     profile_completed = db.Column(db.Boolean, default=False)  # New field
-    venues = db.relationship('Venue', back_populates='creator')
-    artists = db.relationship('Artist', back_populates='creator')
-    events = db.relationship('Event', back_populates='creator')  # Link to Event model
-    tours = db.relationship("Tour", back_populates="creator")
+    # A user's venues, artists and events go with the account; their tours and attendees stay, unowned
+    venues = db.relationship('Venue', back_populates='creator', cascade='all', passive_deletes=True)
+    artists = db.relationship('Artist', back_populates='creator', cascade='all', passive_deletes=True)
+    events = db.relationship('Event', back_populates='creator', cascade='all', passive_deletes=True)  # Link to Event model
+    tours = db.relationship("Tour", back_populates="creator", passive_deletes=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Creation time
     last_login = db.Column(db.DateTime)  # Updated on each login
     @property
@@ -1135,7 +1653,7 @@ def validate_password(password):
         abort(400, description="Password must contain at least one special character (!@#$%^&*(),.?\":{}|<>).")
 
     
-@app.post('/api/signup')
+@api.post('/api/signup')
 def signup():
     data = request.get_json()
     username = data.get('username')
@@ -1175,7 +1693,7 @@ def signup():
     return jsonify(new_user.to_dict()), 201
 
 
-@app.post('/api/signin')
+@api.post('/api/signin')
 def signin():
     data = request.get_json()
     username = data.get('username')
@@ -1208,13 +1726,13 @@ def signin():
         return jsonify({'error': 'Invalid username or password.'}), 401
 
 
-@app.post('/api/signout')
+@api.post('/api/signout')
 def signout():
     session.pop('user_id', None)
     session.pop('user_type', None)
     return jsonify({'message': 'Signed out successfully.'}), 200
 
-@app.patch('/api/complete-profile/<int:user_id>')
+@api.patch('/api/complete-profile/<int:user_id>')
 def complete_profile(user_id):
     user = User.query.get(user_id)
     if user:
@@ -1225,22 +1743,22 @@ def complete_profile(user_id):
         return jsonify({"error": "User not found"}), 404
 
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({"error": error.description}), 400
 
-@app.errorhandler(401)
+@api.app_errorhandler(401)
 def unauthorized(error):
     return jsonify({"error": error.description}), 401
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({"error": error.description}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({"error": "An unexpected error occurred."}), 500
-@app.get('/api/admin-only')
+@api.get('/api/admin-only')
 def admin_only():
     user = User.query.get(session.get('user_id'))
     if user and user.is_admin:
@@ -1264,7 +1782,7 @@ def is_admin_user(id = ''):
     else:
         return False
 
-@app.delete('/api/users/<int:user_id>')
+@api.delete('/api/users/<int:user_id>')
 def delete_user(user_id):
     # Check if the current user is an admin
     # if not is_admin_user():
@@ -1280,14 +1798,8 @@ def delete_user(user_id):
         return jsonify({'error': 'You cannot delete your own account'}), 400
 
     try:
-
-        for artist in user_to_delete.artists:  # Assuming a one-to-many relationship
-            db.session.delete(artist)
-        for venue in user_to_delete.venues:  # Assuming a one-to-many relationship
-            db.session.delete(venue)
-        for event in user_to_delete.events:  # Assuming a one-to-many relationship
-            db.session.delete(event)
-        # Delete the user
+        # Their artists, venues and events follow by ON DELETE CASCADE; their tours and
+        # attendees are kept with created_by_id set to NULL
         db.session.delete(user_to_delete)
         db.session.commit()
         return jsonify({'message': 'User deleted successfully'}), 200
@@ -1295,7 +1807,7 @@ def delete_user(user_id):
         db.session.rollback()
         return jsonify({'error': f"Error deleting user: {str(e)}"}), 500
 
-@app.get('/api/all-users')
+@api.get('/api/all-users')
 def get_all_users():
     user_id = request.args.get('user_id')
     # Check if the current user is an admin
@@ -1317,22 +1829,26 @@ def get_all_users():
     if status is not None:
         query = query.filter_by(profile_completed=(status.lower() == 'active'))
 
-    # Apply pagination
-    paginated_users = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Apply pagination; the total comes from the per-filter counters unless an exact count is asked for
+    import user_counts
+    paginated_users = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    exact_total = request.args.get('exact_total', 'false').lower() == 'true'
+    total, total_source = user_counts.user_total(query, role or None, status, exact=exact_total)
 
     # Serialize results and add pagination metadata
     users_data = [user.to_dict() for user in paginated_users.items]
     response = {
         'users': users_data,
-        'total': paginated_users.total,
+        'total': total,
+        'total_source': total_source,
         'page': paginated_users.page,
-        'pages': paginated_users.pages,
+        'pages': math.ceil(total / paginated_users.per_page) if total else 0,
         'per_page': paginated_users.per_page
     }
 
     return jsonify(response), 200
 
-@app.get('/api/whoami')
+@api.get('/api/whoami')
 def who_am_i():
     user_id = session.get('user_id')
     # if not user_id:
@@ -1342,7 +1858,7 @@ def who_am_i():
     return jsonify({'id': user.id, 'username': user.username, 'user_type': user.user_type})
 
 
-@app.patch('/api/users/<int:user_id>/role')
+@api.patch('/api/users/<int:user_id>/role')
 def update_user_role(user_id):
     print('USER ID IS:', user_id)
     # Check if the current user is an admin
@@ -1370,7 +1886,7 @@ def update_user_role(user_id):
 
     return jsonify({'message': 'User role updated successfully.', 'user': user.to_dict()}), 200
 
-@app.get('/api/admin/metrics')
+@api.get('/api/admin/metrics')
 def get_admin_metrics():
     # Ensure the current user is an admin
 
@@ -1410,7 +1926,7 @@ def get_admin_metrics():
 
 
 
-@app.get('/api/admin/dashboard')
+@api.get('/api/admin/dashboard')
 def get_admin_dashboard():
     # Ensure the current user is an admin
     # if not is_admin_user():
@@ -1449,7 +1965,7 @@ def get_admin_dashboard():
 
     return jsonify(response), 200
 
-@app.get('/api/search-users')
+@api.get('/api/search-users')
 def search_users():
     username = request.args.get('username')
     if not username:
@@ -1472,4 +1988,282 @@ def search_users():
 
     users_response = [user.to_dict() for user in users_data]
 
-    return jsonify({'users': users_response}), 200
\ No newline at end of file
+    return jsonify({'users': users_response}), 200
+
+#-------------------------------#App Factory--------------------#
+def create_app(config=None):
+    """
+    Builds and configures a Flask app.
+    Extensions are bound here rather than at import time, so a gunicorn master can
+    preload this module once and fork workers that share its memory copy-on-write.
+    """
+    started = time.perf_counter()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv('DATABASE_URL') or 'sqlite:///local_database.db'
+    # app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///main.db'
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.secret_key = os.getenv('SECRET_KEY', 'default_secret_key')
+    # Reject PATCHes that don't say which version they edit (see check_if_match)
+    app.config['REQUIRE_IF_MATCH'] = os.getenv('REQUIRE_IF_MATCH', 'false').lower() == 'true'
+    if config:
+        app.config.update(config)
+    # Pretty-print JSON only while debugging; in production every byte is paid for on the wire
+    app.json.compact = not app.debug
+
+    # Initialize the extensions with the app
+    db.init_app(app)
+    # Before anything connects: SQLite pragmas (foreign keys, WAL, ...) apply per connection
+    import sqlite_profile
+    sqlite_profile.init_app(app)
+    migrate.init_app(app, db)
+    bcrypt.init_app(app)
+    cors.init_app(app, supports_credentials=True)
+
+    app.register_blueprint(api)
+    app.cli.add_command(refresh_venue_ratings_command)
+    app.cli.add_command(backfill_event_schedule_command)
+    app.cli.add_command(sync_schema_command)
+
+    import throttling
+    throttling.init_app(app)
+
+    import compression
+    compression.init_app(app)
+
+    import geo
+    geo.init_app(app)
+
+    import archive
+    archive.init_app(app)
+
+    import event_cards
+    event_cards.init_app(app)
+
+    import idempotency
+    idempotency.init_app(app)
+
+    import batch
+    batch.init_app(app)
+
+    import outbox
+    outbox.init_app(app)
+
+    import autocomplete
+    autocomplete.init_app(app)
+
+    import analytics
+    analytics.init_app(app)
+
+    import similar
+    similar.init_app(app)
+
+    import checkins
+    checkins.init_app(app)
+
+    import changes
+    changes.init_app(app)
+
+    import user_counts
+    user_counts.init_app(app)
+
+    import audit
+    audit.init_app(app)
+
+    import itinerary
+    itinerary.init_app(app)
+
+    import dedup
+    dedup.init_app(app)
+
+    # Resolve every relationship now instead of on the first request in each worker
+    configure_mappers()
+
+    # A forked worker (gunicorn --preload) must not reuse connections opened in the master
+    os.register_at_fork(after_in_child=lambda: dispose_engines(app))
+
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    app.logger.info("App created in %.1f ms", app.config['STARTUP_SECONDS'] * 1000)
+    return app
+
+
+def sync_schema():
+    """
+    Brings an existing database up to the current models: creates missing tables, adds
+    missing columns and indexes to existing ones, rebuilds foreign keys whose ON DELETE
+    action differs from the models' (see sync_foreign_keys), and fills an empty event_cards
+    table. Never drops data. Returns a list of what was changed.
+    """
+    changes = []
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    db.create_all()
+    changes += [f"table {name}" for name in db.metadata.tables if name not in existing_tables]
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=connection.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                connection.execute(db.text(ddl))
+                changes.append(f"column {table.name}.{column.name}")
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    changes.append(f"index {index.name}")
+    changes += sync_foreign_keys()
+
+    # Read models start out empty on a database that already has the rows they mirror
+    if not cards_built():
+        import event_cards
+        changes.append(f"event cards ({event_cards.rebuild_all()})")
+    return changes
+
+
+def _foreign_keys_outdated(inspector, table):
+    reflected = {
+        (tuple(fk['constrained_columns']), fk['referred_table']): (fk.get('options') or {}).get('ondelete')
+        for fk in inspector.get_foreign_keys(table.name)
+    }
+    for constraint in table.foreign_key_constraints:
+        key = (tuple(column.name for column in constraint.columns), constraint.referred_table.name)
+        if key not in reflected or (reflected[key] or '').upper() != (constraint.ondelete or '').upper():
+            return True
+    return False
+
+
+def _rebuild_sqlite_table(connection, table):
+    # SQLite can't alter a constraint: build the table afresh, copy the rows, swap it in
+    existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+    shared = ', '.join(column.name for column in table.columns if column.name in existing)
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect)).strip()
+    connection.execute(db.text(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}__new ', 1)))
+    connection.execute(db.text(f'INSERT INTO {table.name}__new ({shared}) SELECT {shared} FROM {table.name}'))
+    # Triggers go with the old table; put them back on the new one
+    triggers = connection.execute(
+        db.text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :name"), {'name': table.name}
+    ).scalars().all()
+    connection.execute(db.text(f'DROP TABLE {table.name}'))
+    connection.execute(db.text(f'ALTER TABLE {table.name}__new RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(connection)
+    for trigger in triggers:
+        connection.execute(db.text(trigger))
+
+
+def _outdated_tables(inspector):
+    existing_tables = set(inspector.get_table_names())
+    return [
+        table for table in db.metadata.sorted_tables
+        if table.name in existing_tables and _foreign_keys_outdated(inspector, table)
+    ]
+
+
+def _missing_autoincrement(connection):
+    """SQLite tables the models declare AUTOINCREMENT but which were created without it."""
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not table.dialect_options['sqlite'].get('autoincrement'):
+            continue
+        ddl = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+        ).scalar()
+        if ddl and 'AUTOINCREMENT' not in ddl.upper():
+            missing.append(table)
+    return missing
+
+
+def _reserve_archived_event_ids(connection):
+    # Ids that only live on in events_archive must not be handed out again either
+    archived = connection.exec_driver_sql("SELECT max(id) FROM events_archive").scalar()
+    if archived is None:
+        return
+    sequence = connection.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'events'").scalar()
+    if sequence is None:
+        connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('events', ?)", (archived,))
+    elif sequence < archived:
+        connection.exec_driver_sql("UPDATE sqlite_sequence SET seq = ? WHERE name = 'events'", (archived,))
+
+
+def sync_foreign_keys():
+    """
+    Recreates foreign keys that are missing or have a different ON DELETE action than the
+    models declare. On SQLite that means rebuilding the table (columns the models no longer
+    have are not carried over), which is also how tables get the AUTOINCREMENT the models
+    declare. Returns a list of what was changed.
+    """
+    changes = []
+    with db.engine.connect() as connection:
+        if connection.dialect.name != 'sqlite':
+            with connection.begin():
+                inspector = db.inspect(connection)
+                for table in _outdated_tables(inspector):
+                    for fk in inspector.get_foreign_keys(table.name):
+                        if fk['name']:
+                            connection.execute(db.text(f'ALTER TABLE {table.name} DROP CONSTRAINT {fk["name"]}'))
+                    for constraint in table.foreign_key_constraints:
+                        connection.execute(AddConstraint(constraint))
+                    changes.append(f"foreign keys {table.name}")
+            return changes
+
+        # SQLite: foreign keys have to be off (outside any transaction) while tables are
+        # swapped, and the swap needs an explicit transaction because pysqlite would
+        # otherwise commit each DDL statement on its own. Legacy ALTER TABLE lets the rename
+        # through while other tables' triggers still name the table just dropped.
+        connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        try:
+            connection.exec_driver_sql("BEGIN")
+            try:
+                outdated = _outdated_tables(db.inspect(connection))
+                for table in outdated:
+                    _rebuild_sqlite_table(connection, table)
+                    changes.append(f"foreign keys {table.name}")
+                for table in _missing_autoincrement(connection):
+                    if table not in outdated:
+                        _rebuild_sqlite_table(connection, table)
+                    changes.append(f"autoincrement {table.name}")
+                _reserve_archived_event_ids(connection)
+                orphans = connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+                if orphans:
+                    raise RuntimeError(f"Rows reference missing parents (first: {tuple(orphans[0])}); fix them and rerun.")
+            except Exception:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+            connection.exec_driver_sql("COMMIT")
+        finally:
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+    return changes
+
+@click.command('sync-schema')
+def sync_schema_command():
+    """Add missing tables, columns and indexes to an existing database."""
+    changes = sync_schema()
+    click.echo("\n".join(changes) if changes else "Schema is up to date.")
+
+
+def dispose_engines(app):
+    """
+    Drops pooled connections inherited from a parent process.
+    Call in each worker right after fork so no socket is shared between processes.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+if __name__ == '__main__':
+    # Build through the importable module so feature modules share its db and models
+    import app
+    app.create_app().run(port=5001, debug=True)
@@ -0,0 +1,110 @@
+# archive.py
+# Moves past events, and their association rows, out of the hot tables into *_archive tables.
+#
+#   flask archive-events [--horizon-days 90] [--batch-size 500]     (e.g. nightly from cron)
+#   flask archive-events --interval 3600                             (as its own process)
+#
+# --interval (default ARCHIVE_INTERVAL_SECONDS, 0 = run once) keeps the command running and
+# archiving every so many seconds; run it under the same supervisor as the web server, not
+# inside it. Each batch is its own transaction, so a run can be interrupted at any point
+# and resumed later. Every archived event is logged as a change-feed delete, which is how
+# the web workers' similar-events indexes and itinerary caches learn about it (within
+# SIMILAR_SYNC_SECONDS and ITINERARY_SYNC_SECONDS).
+import os
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, insert, literal, select
+
+from app import (
+    db, Event, attendee_events, attendee_favorites, artist_events, tour_events,
+    events_archive, attendee_events_archive, attendee_favorites_archive,
+    artist_events_archive, tour_events_archive,
+)
+import changes
+import event_cards
+import geo
+
+# (live table, archive table) pairs keyed on event_id; events itself is handled separately
+ASSOCIATIONS = (
+    (attendee_events, attendee_events_archive),
+    (attendee_favorites, attendee_favorites_archive),
+    (artist_events, artist_events_archive),
+    (tour_events, tour_events_archive),
+)
+
+
+def _copy(connection, source, target, where, archived_at):
+    columns = [c.name for c in source.columns]
+    connection.execute(
+        insert(target).from_select(
+            columns + ['archived_at'],
+            select(*[source.c[name] for name in columns], literal(archived_at)).where(where),
+        )
+    )
+
+
+def archive_events(horizon_days=None, batch_size=None):
+    """
+    Moves events dated before now - horizon_days into the archive, batch_size events per
+    transaction. Returns the number of events archived.
+    """
+    horizon_days = horizon_days if horizon_days is not None else current_app.config['ARCHIVE_HORIZON_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    events = Event.__table__
+    moved = 0
+
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                select(events.c.id).where(events.c.date < cutoff).order_by(events.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            archived_at = datetime.utcnow()
+
+            # Copy the children first, then the events, then delete in the reverse order
+            for live, archived in ASSOCIATIONS:
+                _copy(connection, live, archived, live.c.event_id.in_(ids), archived_at)
+            _copy(connection, events, events_archive, events.c.id.in_(ids), archived_at)
+            for live, _ in ASSOCIATIONS:
+                connection.execute(delete(live).where(live.c.event_id.in_(ids)))
+            connection.execute(delete(events).where(events.c.id.in_(ids)))
+            geo.forget_events(connection, ids)
+            event_cards.drop_cards(connection, ids)
+            changes.record_changes(connection, [('events', {'id': event_id}, 'delete', {'archived': True}) for event_id in ids])
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+@click.command('archive-events')
+@click.option('--horizon-days', type=int, default=None, help="Archive events older than this many days.")
+@click.option('--batch-size', type=int, default=None, help="Events moved per transaction.")
+@click.option('--interval', type=int, default=None,
+              help="Keep running, archiving every this many seconds (default ARCHIVE_INTERVAL_SECONDS; 0 runs once).")
+def archive_events_command(horizon_days, batch_size, interval):
+    """Move past events into the archive tables."""
+    interval = interval if interval is not None else current_app.config['ARCHIVE_INTERVAL_SECONDS']
+    while True:
+        try:
+            click.echo(f"Archived {archive_events(horizon_days, batch_size)} events.")
+        except Exception:
+            if not interval:
+                raise
+            # A long-running archiver outlives one bad run; the next one retries the batch
+            current_app.logger.exception("Event archival failed")
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_HORIZON_DAYS', int(os.getenv('ARCHIVE_HORIZON_DAYS', '90')))
+    app.config.setdefault('ARCHIVE_BATCH_SIZE', int(os.getenv('ARCHIVE_BATCH_SIZE', '500')))
+    app.config.setdefault('ARCHIVE_INTERVAL_SECONDS', int(os.getenv('ARCHIVE_INTERVAL_SECONDS', '0')))
+    app.cli.add_command(archive_events_command)
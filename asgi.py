@@ -0,0 +1,271 @@
+# asgi.py
+# Optional ASGI serving mode: `uvicorn asgi:app --workers 2`
+#   or `gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app`
+#
+# The read-heavy GET routes (lists, searches and detail pages) are served here on an
+# AsyncSession (aiosqlite / asyncpg), so a request waiting on the database no longer
+# holds a whole worker. Everything else, including every write, falls through to the
+# regular Flask app. The handlers return the same payloads as the Flask views.
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import compression
+import sqlite_profile
+from app import (
+    create_app, db, ArchivedEvent, Artist, Attendee, Event, EventCard, Tour, User, Venue,
+)
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+def async_url(url):
+    """Same database as the Flask app, through its async driver."""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend!r} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+with flask_app.app_context():
+    async_engine = create_async_engine(async_url(db.engine.url))
+sqlite_profile.configure_engine(async_engine.sync_engine, flask_app)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+os.register_at_fork(after_in_child=lambda: async_engine.sync_engine.dispose(close=False))
+
+
+#-------------------------------#Read handlers--------------------#
+# Each runs inside AsyncSession.run_sync, so the existing to_dict() methods (and their
+# lazy loads) work unchanged while every database round trip is awaited underneath.
+def wants_archived(args):
+    return args.get('include_archived', '').lower() == 'true'
+
+
+def list_events(s, args):
+    cards = s.scalars(select(EventCard.payload).order_by(EventCard.event_id)).all()
+    if wants_archived(args):
+        cards += [event.to_dict() for event in s.scalars(select(ArchivedEvent)).all()]
+    return 200, cards
+
+
+def list_venues(s, args):
+    return 200, [venue.to_dict() for venue in s.scalars(select(Venue)).all()]
+
+
+def list_attendees(s, args):
+    return 200, [attendee.to_dict() for attendee in s.scalars(select(Attendee)).all()]
+
+
+def list_artists(s, args):
+    return 200, [artist.to_dict() for artist in s.scalars(select(Artist)).all()]
+
+
+def list_tours(s, args):
+    return 200, [tour.to_dict() for tour in s.scalars(select(Tour)).all()]
+
+
+def search_events(s, args):
+    term = args.get('searchTerm')
+    if not term:
+        return 400, {"error": "Search term not provided"}
+    pattern = f'%{term.strip().lower()}%'
+    events = s.scalars(select(EventCard.payload).join(Event, Event.id == EventCard.event_id).where(
+        Event.name.ilike(pattern) | Event.location.ilike(pattern) | Event.event_type.ilike(pattern)
+    ).order_by(EventCard.event_id)).all()
+    if wants_archived(args):
+        events += [event.to_dict() for event in s.scalars(select(ArchivedEvent).where(
+            ArchivedEvent.name.ilike(pattern) | ArchivedEvent.location.ilike(pattern)
+            | ArchivedEvent.event_type.ilike(pattern)
+        )).all()]
+    if not events:
+        return 404, {"error": "No events found with that search term"}
+    return 200, events
+
+
+def search_venues(s, args):
+    name = args.get('name')
+    if not name:
+        return 400, {"error": "Venue name not provided"}
+    venues = s.scalars(select(Venue).where(Venue.name.ilike(f'%{name.strip().lower()}%'))).all()
+    if not venues:
+        return 404, {"error": "No venues found with that name"}
+    return 200, [venue.to_dict() for venue in venues]
+
+
+def search_attendees(s, args):
+    name = args.get('name')
+    if not name:
+        return 400, {"error": "Attendee name not provided"}
+    pattern = f'%{name.strip().lower()}%'
+    attendees = s.scalars(select(Attendee).where(
+        Attendee.first_name.ilike(pattern) | Attendee.last_name.ilike(pattern)
+    )).all()
+    return 200, [attendee.to_dict() for attendee in attendees]
+
+
+def search_artists(s, args):
+    name = args.get('name')
+    if not name:
+        return 400, {"error": "Artist name not provided"}
+    artists = s.scalars(select(Artist).where(Artist.name.ilike(f'%{name.strip().lower()}%'))).all()
+    if not artists:
+        return 404, {"error": "No artists found with that name"}
+    return 200, [artist.to_dict() for artist in artists]
+
+
+def search_tours(s, args):
+    name = args.get('name')
+    if not name:
+        return 400, {"error": "Tour name not provided"}
+    tours = s.scalars(select(Tour).where(Tour.name.ilike(f'%{name.strip().lower()}%'))).all()
+    return 200, [tour.to_dict() for tour in tours]
+
+
+def search_users(s, args):
+    username = args.get('username')
+    if not username:
+        return 400, {"error": "Username not provided"}
+    users = s.scalars(select(User).where(User.username.ilike(f'%{username.strip().lower()}%'))).all()
+    if not users:
+        return 404, {"error": "No users found"}
+    return 200, {'users': [user.to_dict() for user in users]}
+
+
+def detail(model, not_found):
+    def handler(s, args, id):
+        instance = s.get(model, id)
+        if instance is None:
+            return 404, {"error": not_found}
+        # Same ETag as the Flask view, for If-Match on a later PATCH
+        return 200, instance.to_dict(), [(b'etag', f'"{instance.version_id}"'.encode('ascii'))]
+    return handler
+
+
+# (path pattern, handler, Flask endpoint name used for throttling config)
+ROUTES = [
+    (re.compile(r'^/api/events$'), list_events, 'api.get_events'),
+    (re.compile(r'^/api/venues$'), list_venues, 'api.index'),
+    (re.compile(r'^/api/attendees$'), list_attendees, 'api.get_all_attendees'),
+    (re.compile(r'^/api/artists$'), list_artists, 'api.get_all_artists'),
+    (re.compile(r'^/api/tours$'), list_tours, 'api.get_all_tours'),
+    (re.compile(r'^/api/events/search$'), search_events, 'api.search_events_by_name'),
+    (re.compile(r'^/api/venues/search$'), search_venues, 'api.search_venues_by_name'),
+    (re.compile(r'^/api/attendees/search$'), search_attendees, 'api.search_attendees_by_name'),
+    (re.compile(r'^/api/artists/search$'), search_artists, 'api.search_artists_by_name'),
+    (re.compile(r'^/api/tours/search$'), search_tours, 'api.search_tours_by_name'),
+    (re.compile(r'^/api/search-users$'), search_users, 'api.search_users'),
+    (re.compile(r'^/api/events/(\d+)$'), detail(Event, "Event ID not found"), 'api.get_event_by_id'),
+    (re.compile(r'^/api/venues/(\d+)$'), detail(Venue, "Venue ID not Found"), 'api.get_venue_by_id'),
+    (re.compile(r'^/api/attendees/(\d+)$'), detail(Attendee, "Attendee ID not found"), 'api.get_attendee_by_id'),
+    (re.compile(r'^/api/artists/(\d+)$'), detail(Artist, "Artist ID not found"), 'api.get_artist_by_id'),
+    (re.compile(r'^/api/tours/(\d+)$'), detail(Tour, "Tour not found"), 'api.get_tour'),
+]
+
+
+#-------------------------------#ASGI plumbing--------------------#
+def match(path):
+    for pattern, handler, endpoint in ROUTES:
+        found = pattern.match(path)
+        if found:
+            return handler, endpoint, [int(group) for group in found.groups()]
+    return None
+
+
+def cors_headers(headers):
+    # Mirrors flask-cors with supports_credentials=True: echo the caller's origin
+    origin = headers.get('origin')
+    if not origin:
+        return []
+    return [
+        (b'access-control-allow-origin', origin.encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+        (b'vary', b'Origin'),
+    ]
+
+
+async def respond(send, status, payload, headers, request_headers):
+    separators = (',', ':') if flask_app.json.compact else None
+    body = flask_app.json.dumps(payload, separators=separators).encode('utf-8') if payload is not None else b''
+    headers = [(b'content-type', b'application/json')] + headers + cors_headers(request_headers)
+
+    cache = flask_app.extensions.get('compression')
+    config = flask_app.config
+    if cache is not None and len(body) >= config['COMPRESS_MIN_SIZE']:
+        headers.append((b'vary', b'Accept-Encoding'))
+        encoding = compression.choose_encoding(request_headers.get('accept-encoding'))
+        if encoding:
+            body = compression.compressed_body(cache, body, encoding, config)
+            headers.append((b'content-encoding', encoding.encode('ascii')))
+
+    headers.append((b'content-length', str(len(body)).encode('ascii')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def serve(scope, receive, send, handler, endpoint, path_args):
+    request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    args = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+    # Same limits as the Flask app; without the Flask session, clients are keyed by address
+    limits = flask_app.extensions.get('throttling')
+    held = []
+    if limits is not None:
+        limit = flask_app.config['RATELIMIT_ROUTES'].get(endpoint)
+        if limit:
+            client = (scope.get('client') or ('unknown',))[0]
+            allowed, retry_after = limits['store'].take(f"{endpoint}:ip:{client}", *limit, time.time())
+            if not allowed:
+                retry = str(max(1, round(retry_after))).encode('ascii')
+                return await respond(send, 429, {"error": "Too many requests. Please slow down."},
+                                     [(b'retry-after', retry)], request_headers)
+        held = limits['gate'].enter(endpoint)
+        if held is None:
+            return await respond(send, 503, {"error": "Server is busy. Please try again shortly."},
+                                 [(b'retry-after', b'1')], request_headers)
+
+    try:
+        async with AsyncSessionLocal() as session:
+            status, payload, *extra = await session.run_sync(handler, args, *path_args)
+    except Exception:
+        flask_app.logger.exception("Async handler failed for %s", scope['path'])
+        status, payload, extra = 500, {"error": "An unexpected error occurred."}, []
+    finally:
+        for sem in held:
+            sem.release()
+
+    if scope['method'] == 'HEAD':
+        payload = None
+    await respond(send, status, payload, extra[0] if extra else [], request_headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        found = match(scope['path'])
+        if found:
+            return await serve(scope, receive, send, *found)
+    return await wsgi_app(scope, receive, send)
@@ -0,0 +1,387 @@
+# audit.py
+# Who changed what: an append-only audit_log of every committed insert, update and delete.
+#
+#   GET /api/admin/audit?entity=venues&id=3[&before=<entry id>&limit=50]     (admins)
+#   -> {"entries": [{"id": 812, "entity": "venues", "entity_id": "3", "action": "update",
+#                    "changes": {"name": ["Roxy", "The Roxy"]}, "user_id": 1,
+#                    "request": "PATCH /api/venues/3", "created_at": "..."}, ...],
+#       "next": 790}
+#
+# changes maps each column to [before, after] (before is null for inserts, after for
+# deletes), and each many-to-many collection that changed to {"added": [ids], "removed": [ids]}.
+# The diffs come from the unit of work itself: the session's attribute history and pending
+# deletes, captured during flush and merged per row over all the flushes of a transaction.
+# Password hashes show only that they changed; AUDIT_IGNORED_COLUMNS (last_login and the
+# version counters) are left out.
+#
+# Rows that ON DELETE CASCADE removes along with a deleted row are read just before the
+# flush and get delete entries of their own: a venue's events and ratings; a user's venues,
+# artists and events (including the events and ratings at their venues); an attendee's
+# ratings. Many-to-many rows that go with a deleted row (lineups, attendance, favorites)
+# are not listed separately. Writes that bypass the ORM are not audited: the ratings
+# upserts and venue rating totals, check-ins, archiving, and the rows an attendee merge
+# moves to the attendee kept.
+#
+# After a commit its entries go to an in-memory queue in this worker; a background thread
+# writes them in multi-row INSERTs every AUDIT_FLUSH_MS (default 500), or as soon as
+# AUDIT_BATCH_ROWS (500) are waiting, so requests never wait on the audit table. The queue
+# holds at most AUDIT_QUEUE_SIZE (10000) entries; past that a commit writes its own entries
+# before returning rather than drop them. What is still queued when the worker exits is
+# written then. Triggers reject UPDATE and DELETE on audit_log.
+#
+# Lookups by entity and id (newest first, paged with `before`) use the composite index
+# on (entity, entity_id, id).
+import atexit
+import os
+import threading
+from datetime import datetime
+
+from flask import Blueprint, current_app, has_request_context, jsonify, request
+from flask import session as user_session
+from sqlalchemy import DDL, event, inspect, insert, select
+
+from app import db, cascaded_rows, is_admin_user, plain_json
+
+audit_api = Blueprint('audit', __name__)
+
+DEFAULT_EXCLUDED_TABLES = (
+    'audit_log', 'change_log', 'event_cards', 'idempotency_keys', 'notification_outbox', 'user_counts',
+)
+DEFAULT_IGNORED_COLUMNS = ('last_login', 'version_id')
+SECRET_COLUMNS = {'password_hash'}
+REDACTED = '[redacted]'
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class AuditEntry(db.Model):
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_entity', 'entity', 'entity_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.String(100), nullable=False)
+    action = db.Column(db.String(10), nullable=False)
+    changes = db.Column(db.JSON, nullable=False)
+    user_id = db.Column(db.Integer)        # no foreign key: entries outlive the users they name
+    request = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entity': self.entity,
+            'entity_id': self.entity_id,
+            'action': self.action,
+            'changes': self.changes,
+            'user_id': self.user_id,
+            'request': self.request,
+            'created_at': self.created_at,
+        }
+
+
+APPEND_ONLY_TRIGGERS = {
+    'sqlite': (
+        "CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log "
+        "BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END",
+        "CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log "
+        "BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END",
+    ),
+    'postgresql': (
+        """CREATE OR REPLACE FUNCTION audit_log_append_only() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'audit_log is append-only';
+        END $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS audit_log_append_only ON audit_log",
+        "CREATE TRIGGER audit_log_append_only BEFORE UPDATE OR DELETE ON audit_log "
+        "FOR EACH STATEMENT EXECUTE FUNCTION audit_log_append_only()",
+    ),
+}
+
+for dialect, statements in APPEND_ONLY_TRIGGERS.items():
+    for statement in statements:
+        event.listen(AuditEntry.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect))
+
+
+#-------------------------------#Capture--------------------#
+def _table(obj):
+    return inspect(obj).mapper.local_table.name
+
+
+def _entity_id(obj):
+    mapper = inspect(obj).mapper
+    return ','.join(str(getattr(obj, mapper.get_property_by_column(column).key)) for column in mapper.primary_key)
+
+
+def _audited(obj):
+    return _table(obj) not in current_app.config['AUDIT_EXCLUDED_TABLES']
+
+
+def _column_attrs(obj):
+    ignored = current_app.config['AUDIT_IGNORED_COLUMNS']
+    return [attr for attr in inspect(obj).mapper.column_attrs if attr.columns[0].name not in ignored]
+
+
+def _value(attr, value):
+    return REDACTED if attr.columns[0].name in SECRET_COLUMNS else plain_json(value)
+
+
+def _pending(session):
+    return session.info.setdefault('audit', {})
+
+
+def _key(obj):
+    return _table(obj), _entity_id(obj)
+
+
+def _record(session, key, action, changes):
+    """Merges one flush's changes to a (table, entity id) row into what the transaction has changed so far."""
+    if not changes and action == 'update':
+        return
+    pending = _pending(session)
+    entry = pending.get(key)
+    if entry is None:
+        pending[key] = {'action': action, 'changes': changes}
+        return
+    if action == 'delete' and entry['action'] == 'insert':
+        del pending[key]          # created and removed in the same transaction
+        return
+    if action == 'delete':
+        entry['action'] = 'delete'
+    merged = entry['changes']
+    for name, change in changes.items():
+        earlier = merged.get(name)
+        if earlier is None:
+            merged[name] = change
+        elif isinstance(change, dict):
+            for side in ('added', 'removed'):
+                earlier[side] = earlier.get(side, []) + change.get(side, [])
+        else:
+            merged[name] = [earlier[0], change[1]]
+
+
+def _column_changes(session, obj):
+    """{column: [before, after]} for the columns changed on a persistent object."""
+    state = inspect(obj)
+    changed = [attr for attr in _column_attrs(obj) if state.attrs[attr.key].history.has_changes()]
+    if not changed:
+        return {}
+    before = {}
+    unloaded = []
+    for attr in changed:
+        history = state.attrs[attr.key].history
+        if history.deleted:
+            before[attr.key] = history.deleted[0]
+        else:
+            unloaded.append(attr)
+    if unloaded:
+        # Changed without having been loaded; the row still holds the old values
+        mapper = state.mapper
+        row = session.execute(
+            select(*[attr.columns[0] for attr in unloaded])
+            .where(*[column == value for column, value in zip(mapper.primary_key, state.identity)])
+        ).one()
+        before.update(zip([attr.key for attr in unloaded], row))
+    return {
+        attr.columns[0].name: [_value(attr, before[attr.key]), _value(attr, getattr(obj, attr.key))]
+        for attr in changed
+    }
+
+
+def _collection_changes(obj):
+    """{relationship: {"added": [ids], "removed": [ids]}} for changed many-to-many collections."""
+    state = inspect(obj)
+    changes = {}
+    for prop in state.mapper.relationships:
+        if prop.secondary is None or prop.viewonly:
+            continue
+        history = state.attrs[prop.key].history
+        if not history.has_changes():
+            continue
+        changes[prop.key] = {
+            'added': [_entity_id(related) for related in history.added if related is not None],
+            'removed': [_entity_id(related) for related in history.deleted if related is not None],
+        }
+    return changes
+
+
+def _record_cascaded(session, flush_context):
+    """Delete entries for the rows the database deletes along with this flush's deletes."""
+    for model, rows in cascaded_rows(session, flush_context).items():
+        if not _audited(model):
+            continue
+        mapper = inspect(model)
+        attrs = _column_attrs(model)
+        for row in rows:
+            key = (_table(model), ','.join(str(row._mapping[column]) for column in mapper.primary_key))
+            _record(session, key, 'delete', {
+                attr.columns[0].name: [_value(attr, row._mapping[attr.columns[0]]), None] for attr in attrs
+            })
+
+
+def _before_flush(session, flush_context, instances):
+    # Old values and deleted rows have to be read while the database still holds them
+    with session.no_autoflush:
+        for obj in session.dirty:
+            if _audited(obj) and session.is_modified(obj, include_collections=False):
+                _record(session, _key(obj), 'update', _column_changes(session, obj))
+        for obj in session.deleted:
+            if _audited(obj):
+                _record(session, _key(obj), 'delete', {
+                    attr.columns[0].name: [_value(attr, getattr(obj, attr.key)), None] for attr in _column_attrs(obj)
+                })
+        _record_cascaded(session, flush_context)
+
+
+def _after_flush(session, flush_context):
+    # Inserts once keys and defaults are assigned; collections once the related rows have ids
+    for obj in session.new:
+        if _audited(obj):
+            _record(session, _key(obj), 'insert', {
+                attr.columns[0].name: [None, _value(attr, getattr(obj, attr.key))] for attr in _column_attrs(obj)
+            })
+            _record(session, _key(obj), 'update', _collection_changes(obj))
+    for obj in session.dirty:
+        if _audited(obj):
+            _record(session, _key(obj), 'update', _collection_changes(obj))
+
+
+def _after_commit(session):
+    pending = session.info.pop('audit', None)
+    if not pending:
+        return
+    user_id, origin = None, None
+    if has_request_context():
+        user_id = user_session.get('user_id')
+        origin = f"{request.method} {request.path}"[:200]
+    queue = current_app.extensions.get('audit')
+    if queue is None:
+        return
+    now = datetime.utcnow()
+    queue.add([
+        {
+            'entity': entity, 'entity_id': entity_id, 'action': entry['action'], 'changes': entry['changes'],
+            'user_id': user_id, 'request': origin, 'created_at': now,
+        }
+        for (entity, entity_id), entry in pending.items()
+    ])
+
+
+def _forget(session, *args):
+    session.info.pop('audit', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+#-------------------------------#Writer--------------------#
+class AuditQueue:
+    """
+    Committed entries waiting to be written by this worker. Like checkins.CheckinBuffer, the
+    writer thread is started by the first entry in each process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.entries = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer_pid = None
+
+    def add(self, entries):
+        with self._lock:
+            fits = len(self.entries) + len(entries) <= self.app.config['AUDIT_QUEUE_SIZE']
+            if fits:
+                self.entries.extend(entries)
+                due = len(self.entries) >= self.app.config['AUDIT_BATCH_ROWS']
+                self._start_writer()
+        if not fits:
+            # Slower, but nothing is lost while the writer catches up
+            self.app.logger.warning("Audit queue full; writing %d entries in the request", len(entries))
+            write_entries(entries)
+        elif due:
+            self._wake.set()
+
+    def _start_writer(self):
+        if self._writer_pid == os.getpid():
+            return
+        self._writer_pid = os.getpid()
+        threading.Thread(target=self._run, name='audit-writer', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        interval = self.app.config['AUDIT_FLUSH_MS'] / 1000
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Audit flush failed")
+
+    def flush(self):
+        """Writes everything queued so far. Returns the number of entries written."""
+        with self._lock:
+            batch, self.entries = self.entries, []
+        if not batch:
+            return 0
+        try:
+            with self.app.app_context():
+                write_entries(batch)
+        except Exception:
+            # Back to the front of the queue, oldest first, as far as they fit
+            with self._lock:
+                room = max(0, self.app.config['AUDIT_QUEUE_SIZE'] - len(self.entries))
+                self.entries[:0] = batch[:room]
+                if len(batch) > room:
+                    self.app.logger.error("Audit queue full; lost %d entries", len(batch) - room)
+            raise
+        return len(batch)
+
+
+def write_entries(entries):
+    with db.engine.begin() as connection:
+        connection.execute(insert(AuditEntry.__table__), entries)
+
+
+#-------------------------------#Routes--------------------#
+@audit_api.get('/api/admin/audit')
+def get_audit_log():
+    if not is_admin_user():
+        return jsonify({'error': 'Unauthorized access'}), 403
+    entity = request.args.get('entity')
+    entity_id = request.args.get('id')
+    if entity_id is not None and not entity:
+        return jsonify({"error": "id needs an entity, e.g. entity=venues&id=3"}), 400
+    before = request.args.get('before', type=int)
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+
+    # Include this worker's own recent changes
+    current_app.extensions['audit'].flush()
+
+    query = select(AuditEntry)
+    if entity:
+        query = query.where(AuditEntry.entity == entity)
+    if entity_id is not None:
+        query = query.where(AuditEntry.entity_id == entity_id)
+    if before is not None:
+        query = query.where(AuditEntry.id < before)
+    entries = db.session.execute(query.order_by(AuditEntry.id.desc()).limit(limit)).scalars().all()
+    return jsonify({
+        'entries': [entry.to_dict() for entry in entries],
+        'next': entries[-1].id if len(entries) == limit else None,
+    }), 200
+
+
+def init_app(app):
+    app.config.setdefault('AUDIT_EXCLUDED_TABLES', DEFAULT_EXCLUDED_TABLES)
+    app.config.setdefault('AUDIT_IGNORED_COLUMNS', DEFAULT_IGNORED_COLUMNS)
+    app.config.setdefault('AUDIT_FLUSH_MS', int(os.getenv('AUDIT_FLUSH_MS', '500')))
+    app.config.setdefault('AUDIT_BATCH_ROWS', int(os.getenv('AUDIT_BATCH_ROWS', '500')))
+    app.config.setdefault('AUDIT_QUEUE_SIZE', int(os.getenv('AUDIT_QUEUE_SIZE', '10000')))
+    app.extensions['audit'] = AuditQueue(app)
+    app.register_blueprint(audit_api)
@@ -0,0 +1,329 @@
+# autocomplete.py
+# Typeahead over venue, event, artist and tour names, served from memory.
+#
+#   GET /api/autocomplete?q=ro&types=venue,artist&limit=10
+#   -> [{"type": "venue", "id": 1, "name": "Roxy"}, {"type": "artist", "id": 7, "name": "The Rolling Stones"}, ...]
+#
+# Each type keeps a sorted list of (key, id) pairs, where a key is the normalized name
+# (case, accents and punctuation folded) and every later word of it, so "sto" finds
+# "The Rolling Stones". A lookup is a bisect to the first key >= q and a walk while keys
+# still start with q; whole-name matches rank ahead of later-word matches.
+#
+# The index is built when the app is created (in the gunicorn master with preload_app, so
+# workers share it, frozen out of the GC by when_ready) and patched after every commit that
+# adds, renames or deletes one of those records, including rows removed by ON DELETE
+# CASCADE. Changes committed by other processes (other workers, `flask archive-events`)
+# show up when the index is rebuilt in the background, AUTOCOMPLETE_REFRESH_SECONDS after
+# the last build. On a database without tables yet, the first lookup builds it.
+#
+# GET /api/autocomplete/stats (admins) reports entry counts and approximate memory use.
+#
+# Configuration (optional):
+#   AUTOCOMPLETE_LIMIT              default number of matches (default 10, at most 50)
+#   AUTOCOMPLETE_REFRESH_SECONDS    rebuild interval, 0 for never (default 300)
+import math
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import event, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, cascaded_rows, is_admin_user, Artist, Event, Tour, Venue
+
+autocomplete_api = Blueprint('autocomplete', __name__)
+
+MODELS = {
+    'venue': Venue,
+    'event': Event,
+    'artist': Artist,
+    'tour': Tour,
+}
+TYPE_OF = {model: kind for kind, model in MODELS.items()}
+MAX_LIMIT = 50
+
+
+def normalize(text):
+    """Lowercase, accent-free, with runs of anything but letters and digits collapsed to one space."""
+    text = unicodedata.normalize('NFKD', text or '').casefold()
+    folded = ''.join(ch if ch.isalnum() else ' ' for ch in text if not unicodedata.combining(ch))
+    return ' '.join(folded.split())
+
+
+def keys_for(name):
+    """The whole normalized name, then the suffix starting at each later word."""
+    key = normalize(name)
+    if not key:
+        return None, []
+    words = [index + 1 for index, ch in enumerate(key) if ch == ' ']
+    return key, [key[start:] for start in words]
+
+
+#-------------------------------#Index--------------------#
+class PrefixIndex:
+    """
+    Names of one type. `starts` and `words` are sorted lists of (key, id) tuples. Not
+    thread-safe: an insert or delete shifts entries under a reader's walk, so Autocomplete
+    holds its lock around searches as well as patches.
+    """
+
+    def __init__(self, rows=()):
+        self.names = {}
+        starts, words = [], []
+        for id_, name in rows:
+            key, suffixes = keys_for(name)
+            if key is None:
+                continue
+            self.names[id_] = name
+            starts.append((key, id_))
+            words.extend((suffix, id_) for suffix in suffixes)
+        starts.sort()
+        words.sort()
+        self.starts, self.words = starts, words
+
+    def add(self, id_, name):
+        self.remove(id_)
+        key, suffixes = keys_for(name)
+        if key is None:
+            return
+        self.names[id_] = name
+        insort(self.starts, (key, id_))
+        for suffix in suffixes:
+            insort(self.words, (suffix, id_))
+
+    def remove(self, id_):
+        name = self.names.pop(id_, None)
+        if name is None:
+            return
+        key, suffixes = keys_for(name)
+        for entries, entry_key in [(self.starts, key)] + [(self.words, suffix) for suffix in suffixes]:
+            position = bisect_left(entries, (entry_key, id_))
+            if position < len(entries) and entries[position] == (entry_key, id_):
+                del entries[position]
+
+    def search(self, prefix, limit):
+        """Up to `limit` (rank, key, id) matches: whole-name matches first, each group alphabetical."""
+        found, seen = [], set()
+        for rank, entries in enumerate((self.starts, self.words)):
+            position = bisect_left(entries, (prefix,))
+            while position < len(entries):
+                key, id_ = entries[position]
+                if not key.startswith(prefix):
+                    break
+                if id_ not in seen and id_ in self.names:
+                    seen.add(id_)
+                    found.append((rank, key, id_))
+                    if len(found) == limit:
+                        return found
+                position += 1
+        return found
+
+    def memory_bytes(self):
+        """Approximate size of the lists, tuples, keys and names held."""
+        size = sys.getsizeof(self.names) + sys.getsizeof(self.starts) + sys.getsizeof(self.words)
+        for entries in (self.starts, self.words):
+            size += sum(sys.getsizeof(entry) + sys.getsizeof(entry[0]) for entry in entries)
+        size += sum(sys.getsizeof(name) for name in self.names.values())
+        return size
+
+
+class Autocomplete:
+    """The per-app set of PrefixIndex objects, with build bookkeeping."""
+
+    def __init__(self, app):
+        self.app = app
+        self.indexes = None
+        self.built_at = None
+        self.build_seconds = None
+        self._lock = threading.Lock()         # serializes searches, patches and index swaps
+        self._building = threading.Lock()     # one rebuild at a time
+        self._missed = None                   # patches applied while a rebuild was reading
+
+    def build(self, max_age=None):
+        """
+        Reads every name with one query per type and swaps the new indexes in. With
+        max_age, does nothing if another thread has rebuilt within that many seconds.
+        """
+        with self._building:
+            if max_age is not None and self.built_at is not None and time.monotonic() - self.built_at < max_age:
+                return
+            with self._lock:
+                self._missed = []
+            try:
+                started = time.perf_counter()
+                with self.app.app_context():
+                    indexes = {
+                        kind: PrefixIndex(db.session.execute(select(model.id, model.name)).all())
+                        for kind, model in MODELS.items()
+                    }
+                with self._lock:
+                    # Patches committed after the rows above were read would otherwise be lost
+                    for kind, id_, name in self._missed:
+                        _patch(indexes[kind], id_, name)
+                    self.indexes = indexes
+                    self.built_at = time.monotonic()
+                    self.build_seconds = time.perf_counter() - started
+            finally:
+                with self._lock:
+                    self._missed = None
+        self.app.logger.info("Autocomplete index built in %.1f ms: %s", self.build_seconds * 1000, self.describe())
+
+    def ensure_current(self):
+        if self.indexes is None:
+            # Concurrent first lookups wait for one build instead of each running their own
+            self.build(max_age=math.inf)
+            return
+        refresh = self.app.config['AUTOCOMPLETE_REFRESH_SECONDS']
+        if refresh and time.monotonic() - self.built_at > refresh and not self._building.locked():
+            threading.Thread(target=self._rebuild_quietly, args=(refresh,), name='autocomplete-rebuild', daemon=True).start()
+
+    def _rebuild_quietly(self, max_age):
+        try:
+            self.build(max_age)
+        except Exception:
+            self.app.logger.exception("Autocomplete rebuild failed")
+            self.built_at = time.monotonic()  # don't retry on every request
+
+    def apply(self, changes):
+        """Patches the indexes with {(kind, id): name, or None when deleted}."""
+        with self._lock:
+            if self._missed is not None:
+                self._missed.extend((kind, id_, name) for (kind, id_), name in changes.items())
+            if self.indexes is None:
+                return
+            for (kind, id_), name in changes.items():
+                _patch(self.indexes[kind], id_, name)
+
+    def search(self, prefix, kinds, limit):
+        matches = []
+        with self._lock:
+            for kind in kinds:
+                index = self.indexes[kind]
+                matches.extend((rank, key, kind, id_, index.names.get(id_)) for rank, key, id_ in index.search(prefix, limit))
+        matches.sort(key=lambda match: match[:2])
+        return [
+            {'type': kind, 'id': id_, 'name': name}
+            for _, _, kind, id_, name in matches[:limit] if name is not None
+        ]
+
+    def stats(self):
+        with self._lock:
+            types = {
+                kind: {
+                    'records': len(index.names),
+                    'entries': len(index.starts) + len(index.words),
+                    'bytes': index.memory_bytes(),
+                }
+                for kind, index in (self.indexes or {}).items()
+            }
+        return {
+            'types': types,
+            'total_bytes': sum(entry['bytes'] for entry in types.values()),
+            'build_ms': round(self.build_seconds * 1000, 1) if self.build_seconds is not None else None,
+            'age_seconds': round(time.monotonic() - self.built_at) if self.built_at is not None else None,
+        }
+
+    def describe(self):
+        stats = self.stats()
+        records = sum(entry['records'] for entry in stats['types'].values())
+        entries = sum(entry['entries'] for entry in stats['types'].values())
+        return f"{records} names, {entries} entries, {stats['total_bytes'] / 1024:.0f} KiB"
+
+
+def _patch(index, id_, name):
+    if name is None:
+        index.remove(id_)
+    else:
+        index.add(id_, name)
+
+
+#-------------------------------#Change tracking--------------------#
+def _pending(session):
+    return session.info.setdefault('autocomplete', {})
+
+
+def _before_flush(session, flush_context, instances):
+    # Cascaded rows have to be looked up while they still exist
+    for model, rows in cascaded_rows(session, flush_context).items():
+        kind = TYPE_OF.get(model)
+        if kind:
+            _pending(session).update(dict.fromkeys((kind, row.id) for row in rows))
+
+
+def _after_flush(session, flush_context):
+    pending = None
+    for obj in session.new:
+        kind = TYPE_OF.get(type(obj))
+        if kind:
+            pending = _pending(session)
+            pending[kind, obj.id] = obj.name
+    for obj in session.dirty:
+        kind = TYPE_OF.get(type(obj))
+        if kind and inspect(obj).attrs.name.history.has_changes():
+            pending = _pending(session)
+            pending[kind, obj.id] = obj.name
+    for obj in session.deleted:
+        kind = TYPE_OF.get(type(obj))
+        if kind:
+            pending = _pending(session)
+            pending[kind, obj.id] = None
+
+
+def _after_commit(session):
+    pending = session.info.pop('autocomplete', None)
+    if not pending:
+        return
+    index = current_app.extensions.get('autocomplete')
+    if index is not None:
+        index.apply(pending)
+
+
+def _forget(session, *args):
+    session.info.pop('autocomplete', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+#-------------------------------#Routes--------------------#
+@autocomplete_api.get('/api/autocomplete')
+def autocomplete():
+    prefix = normalize(request.args.get('q'))
+    if not prefix:
+        return jsonify({"error": "Search term not provided"}), 400
+    kinds = [kind.strip() for kind in request.args.get('types', ','.join(MODELS)).split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in MODELS]
+    if unknown or not kinds:
+        return jsonify({"error": f"types must be a comma-separated list of {', '.join(MODELS)}"}), 400
+    limit = request.args.get('limit', current_app.config['AUTOCOMPLETE_LIMIT'], type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    index = current_app.extensions['autocomplete']
+    index.ensure_current()
+    return jsonify(index.search(prefix, kinds, limit)), 200
+
+
+@autocomplete_api.get('/api/autocomplete/stats')
+def autocomplete_stats():
+    if not is_admin_user():
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return jsonify(current_app.extensions['autocomplete'].stats()), 200
+
+
+def init_app(app):
+    app.config.setdefault('AUTOCOMPLETE_LIMIT', 10)
+    app.config.setdefault('AUTOCOMPLETE_REFRESH_SECONDS', 300)
+    app.register_blueprint(autocomplete_api)
+
+    index = app.extensions['autocomplete'] = Autocomplete(app)
+    try:
+        index.build()
+    except SQLAlchemyError:
+        # No tables yet (a fresh database); the first lookup builds it
+        app.logger.info("Autocomplete index deferred until first use")
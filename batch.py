@@ -0,0 +1,136 @@
+# batch.py
+# POST /api/batch: several API calls in one round trip.
+#
+#   POST /api/batch
+#   {"requests": [
+#       {"method": "GET", "path": "/api/whoami"},
+#       {"method": "GET", "path": "/api/attendees/1/ratings"},
+#       {"method": "PATCH", "path": "/api/venues/3", "body": {...}, "headers": {"If-Match": "\"4\""}}
+#   ]}
+#
+# answers 200 with one {"status", "headers", "body"} entry per sub-request, in order.
+# Sub-requests run one after another through the normal URL map, hooks and views, inside
+# this request's app context: they share its database session, so a row one of them loaded
+# (the signed-in user, say) is served to the next from the session's identity map instead of
+# being queried again. They carry the caller's cookies, so they run as the caller; session
+# changes they make (signing in or out) are not sent back. A sub-request that fails (any
+# status from 400 up) or leaves changes uncommitted is rolled back before the next one runs.
+# A sub-request's Accept-Encoding and hop-by-hop headers (Connection, Transfer-Encoding,
+# Proxy-*, ...) are ignored.
+#
+# Configuration (optional):
+#   BATCH_MAX_REQUESTS   sub-requests allowed per batch (default 20)
+import json
+
+from flask import Blueprint, current_app, g, jsonify, request
+from werkzeug.test import EnvironBuilder
+
+from app import db
+
+batch_api = Blueprint('batch', __name__)
+
+METHODS = ('GET', 'POST', 'PATCH', 'PUT', 'DELETE')
+# Sub-response headers worth passing back to the client
+FORWARDED_HEADERS = ('ETag', 'Location', 'Retry-After', 'Idempotent-Replayed')
+# Sub-request headers dropped: bodies come back as JSON inside the batch (compressed with it,
+# if at all), and hop-by-hop headers describe the outer connection, not the sub-request
+DROPPED_HEADERS = frozenset((
+    'accept-encoding', 'connection', 'keep-alive', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+))
+
+
+def _invalid(item):
+    if not isinstance(item, dict):
+        return "must be an object"
+    if item.get('method', 'GET').upper() not in METHODS:
+        return f"method must be one of {', '.join(METHODS)}"
+    path = item.get('path')
+    if not isinstance(path, str) or not path.startswith('/api/'):
+        return "path must start with /api/"
+    if path.split('?', 1)[0].rstrip('/') == '/api/batch':
+        return "batches cannot be nested"
+    if not isinstance(item.get('headers', {}), dict):
+        return "headers must be an object"
+    return None
+
+
+def _uncommitted(session):
+    return bool(session.new or session.dirty or session.deleted)
+
+
+def _dispatch(app, item):
+    path, _, query = item['path'].partition('?')
+    # The caller's identity and address; compression and the like apply to the batch as a whole
+    headers = {'Cookie': request.headers.get('Cookie', '')}
+    headers.update({
+        str(name): str(value) for name, value in item.get('headers', {}).items()
+        if str(name).lower() not in DROPPED_HEADERS and not str(name).lower().startswith('proxy-')
+    })
+    builder = EnvironBuilder(
+        path=path,
+        query_string=query,
+        method=item.get('method', 'GET').upper(),
+        headers=headers,
+        json=item['body'] if 'body' in item else None,
+        environ_base={'REMOTE_ADDR': request.remote_addr},
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    # Pushing a request context for the same app reuses the current app context, and so
+    # db.session. `g` belongs to that context too, so give each sub-request a clean one
+    # and put the batch request's back afterwards (hooks keep per-request state there).
+    namespace = vars(g._get_current_object())
+    outer = dict(namespace)
+    namespace.clear()
+    try:
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception:
+                app.logger.exception("Batched %s %s failed", environ['REQUEST_METHOD'], item['path'])
+                db.session.rollback()
+                return {'status': 500, 'headers': {}, 'body': {"error": "An unexpected error occurred."}}
+            # Views that turn a failed flush into a 4xx don't always roll back; don't let the
+            # next sub-request inherit a dead transaction or another one's uncommitted rows
+            if response.status_code >= 400 or not db.session.is_active or _uncommitted(db.session):
+                db.session.rollback()
+    finally:
+        namespace.clear()
+        namespace.update(outer)
+
+    data = response.get_data()
+    if response.is_json:
+        body = json.loads(data) if data else None
+    else:
+        body = response.get_data(as_text=True) or None
+    return {
+        'status': response.status_code,
+        'headers': {name: response.headers[name] for name in FORWARDED_HEADERS if name in response.headers},
+        'body': body,
+    }
+
+
+@batch_api.post('/api/batch')
+def run_batch():
+    data = request.get_json(silent=True)
+    items = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of requests."}), 400
+    limit = current_app.config['BATCH_MAX_REQUESTS']
+    if len(items) > limit:
+        return jsonify({"error": f"At most {limit} requests per batch."}), 400
+    for index, item in enumerate(items):
+        problem = _invalid(item)
+        if problem:
+            return jsonify({"error": f"Request {index}: {problem}."}), 400
+
+    app = current_app._get_current_object()
+    return jsonify([_dispatch(app, item) for item in items]), 200
+
+
+def init_app(app):
+    app.config.setdefault('BATCH_MAX_REQUESTS', 20)
+    app.register_blueprint(batch_api)
@@ -0,0 +1,59 @@
+# benchmarks/async_capacity.py
+# Concurrent-request capacity of one process: sync gunicorn worker vs. the ASGI mode.
+#
+#   python benchmarks/async_capacity.py --levels 1,8,32,64 --duration 10
+#   python benchmarks/async_capacity.py --database-url postgresql://localhost/prism_bench
+#
+# Both servers run a single worker against the same seeded database and get the same
+# read-only traffic (loadtest.py's 'reads' mix). The gain is largest where queries
+# actually wait on the network, i.e. PostgreSQL; SQLite mostly shows the overhead.
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import MIXES, report, run_level, seed, start_server, stop_server
+
+SERVERS = (
+    ('sync', 'wsgi:app', 'sync'),
+    ('asgi', 'asgi:app', 'uvicorn.workers.UvicornWorker'),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs. async requests/second per process")
+    parser.add_argument('--database-url', help="defaults to a throwaway SQLite file")
+    parser.add_argument('--threads', type=int, default=1, help="threads for the sync worker")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--levels', default='1,8,32,64')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'async_capacity.db')
+    counts = {'venues': 200, 'events': 2000, 'attendees': 2000, 'users': 10}
+    print(f"Seeding {database_url} ...")
+    seed(database_url, **counts)
+
+    levels = [int(level) for level in args.levels.split(',')]
+    throughput = {}
+    for name, app_target, worker_class in SERVERS:
+        server = start_server(database_url, app_target, 1, args.threads if name == 'sync' else 1,
+                              worker_class, args.port)
+        try:
+            print(f"\n##### {name}: {app_target} ({worker_class}) #####")
+            for level in levels:
+                results, elapsed = run_level('127.0.0.1', args.port, level, args.duration, counts, MIXES['reads'])
+                throughput[name, level] = report(level, results, elapsed, MIXES['reads'])
+        finally:
+            stop_server(server)
+
+    print(f"\n{'clients':>8}{'sync req/s':>12}{'asgi req/s':>12}{'gain':>8}")
+    for level in levels:
+        sync_rps, async_rps = throughput['sync', level], throughput['asgi', level]
+        print(f"{level:>8}{sync_rps:>12.1f}{async_rps:>12.1f}{async_rps / sync_rps if sync_rps else 0:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/autocomplete.py
+# In-process lookup latency and memory of the autocomplete prefix index (autocomplete.py).
+#   python benchmarks/autocomplete.py [names per type]
+#
+# Builds one PrefixIndex per type from random multi-word names, then times lookups for
+# prefixes of 1 to 4 characters (shorter prefixes match more names, so they are the worst
+# case for the walk). No database or server involved; for the HTTP view of the same route
+# run loadtest.py --mix typeahead.
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autocomplete import MODELS, PrefixIndex, normalize
+
+LOOKUPS = 20000
+
+
+def random_name(rng):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(rng.randint(1, 4))]
+    return ' '.join(word.capitalize() for word in words)
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def main(names_per_type=50000):
+    rng = random.Random(42)
+    indexes, total_bytes = {}, 0
+    started = time.perf_counter()
+    for kind in MODELS:
+        indexes[kind] = PrefixIndex((id_, random_name(rng)) for id_ in range(1, names_per_type + 1))
+        total_bytes += indexes[kind].memory_bytes()
+    build_s = time.perf_counter() - started
+    print(f"{len(MODELS)} x {names_per_type} names: built in {build_s * 1000:.0f} ms, "
+          f"{total_bytes / 1024 / 1024:.1f} MiB")
+
+    print(f"{'prefix len':<12}{'p50 us':>9}{'p99 us':>9}{'max us':>9}")
+    for length in range(1, 5):
+        timings = []
+        for _ in range(LOOKUPS):
+            prefix = normalize(''.join(rng.choices(string.ascii_lowercase, k=length)))
+            started = time.perf_counter()
+            for index in indexes.values():
+                index.search(prefix, 10)
+            timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        print(f"{length:<12}{percentile(timings, 50):>9.1f}{percentile(timings, 99):>9.1f}{timings[-1]:>9.1f}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
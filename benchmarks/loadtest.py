@@ -0,0 +1,283 @@
+# benchmarks/loadtest.py
+# Concurrent load test against a real gunicorn server.
+#
+# Seeds a database, starts `gunicorn -c gunicorn.conf.py wsgi:app` on it, then replays a
+# mix of signin / list / search / detail / rate_venue traffic at increasing concurrency
+# and prints throughput, tail latency and error rates per route for each level.
+#
+#   python benchmarks/loadtest.py --workers 2 --threads 4 --levels 1,8,32 --duration 10
+#   python benchmarks/loadtest.py --database-url postgresql://localhost/prism_bench
+#
+# Only the standard library is used on the client side.
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'Loadtest1!'
+SEARCH_TERMS = ['rock', 'jazz', 'karaoke', 'comedy', 'open', 'night', 'drag', 'city']
+
+# route name -> relative weight in the traffic mix
+MIXES = {
+    'default': {
+        'signin': 5,
+        'list_events': 10,
+        'list_venues': 10,
+        'search_events': 15,
+        'search_venues': 5,
+        'event_detail': 20,
+        'venue_detail': 15,
+        'rate_venue': 20,
+    },
+    # Only the routes the ASGI mode (asgi.py) serves asynchronously
+    'reads': {
+        'list_events': 10,
+        'list_venues': 10,
+        'search_events': 15,
+        'search_venues': 5,
+        'event_detail': 35,
+        'venue_detail': 25,
+    },
+    # Write-heavy, for lock contention between workers (see sqlite_concurrency.py)
+    'writes': {
+        'rate_venue': 70,
+        'event_detail': 20,
+        'venue_detail': 10,
+    },
+    # Keystroke-level typeahead next to the ILIKE search endpoints it replaces
+    'typeahead': {
+        'autocomplete': 70,
+        'search_events': 15,
+        'search_venues': 15,
+    },
+}
+
+
+def seed(database_url, venues, events, attendees, users):
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app, db, bcrypt, User, Venue, Event, Attendee
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+        db.session.add_all([
+            User(username=f'user{i}', password_hash=password_hash, user_type='attendee', profile_completed=True)
+            for i in range(users)
+        ])
+        db.session.add_all([
+            Venue(name=f'{random.choice(SEARCH_TERMS).title()} Hall {i}', organizer='Bench', email=f'venue{i}@example.com',
+                  earnings='0', description='Seeded by loadtest')
+            for i in range(venues)
+        ])
+        db.session.flush()
+        today = datetime.utcnow()
+        db.session.add_all([
+            Event(name=f'{random.choice(SEARCH_TERMS).title()} Night {i}', date=today + timedelta(days=i % 365),
+                  time='20:00', location=f'City {i % 50}', description='Seeded by loadtest',
+                  venue_id=random.randint(1, venues), event_type=random.choice(['Karaoke', 'Comedy Nights', 'DJ Sets']))
+            for i in range(events)
+        ])
+        db.session.add_all([
+            Attendee(first_name=f'First{i}', last_name=f'Last{i}', email=f'attendee{i}@example.com')
+            for i in range(attendees)
+        ])
+        db.session.commit()
+
+
+class Client:
+    """One virtual user: its own connection and session cookie."""
+
+    def __init__(self, host, port, counts):
+        self.host, self.port = host, port
+        self.counts = counts
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # Server dropped the connection; start a fresh one for the next request
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+    def run(self, route):
+        c = self.counts
+        if route == 'signin':
+            return self.request('POST', '/api/signin', {'username': f"user{random.randrange(c['users'])}", 'password': PASSWORD})
+        if route == 'list_events':
+            return self.request('GET', '/api/events')
+        if route == 'list_venues':
+            return self.request('GET', '/api/venues')
+        if route == 'search_events':
+            return self.request('GET', f'/api/events/search?searchTerm={random.choice(SEARCH_TERMS)}')
+        if route == 'search_venues':
+            return self.request('GET', f'/api/venues/search?name={random.choice(SEARCH_TERMS)}')
+        if route == 'autocomplete':
+            term = random.choice(SEARCH_TERMS)
+            return self.request('GET', f'/api/autocomplete?q={term[:random.randint(1, len(term))]}')
+        if route == 'event_detail':
+            return self.request('GET', f"/api/events/{random.randint(1, c['events'])}")
+        if route == 'venue_detail':
+            return self.request('GET', f"/api/venues/{random.randint(1, c['venues'])}")
+        if route == 'rate_venue':
+            return self.request('POST', f"/api/venues/{random.randint(1, c['venues'])}/rate",
+                                {'attendee_id': random.randint(1, c['attendees']), 'rating': random.randint(1, 5)})
+        raise ValueError(route)
+
+
+def run_level(host, port, concurrency, duration, counts, mix):
+    routes, weights = zip(*mix.items())
+    results = defaultdict(list)   # route -> [(latency_s, status or None)]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        client = Client(host, port, counts)
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            route = random.choices(routes, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = client.run(route)
+            except Exception:
+                status = None
+            local[route].append((time.perf_counter() - started, status))
+        client.conn.close()
+        with lock:
+            for route, samples in local.items():
+                results[route].extend(samples)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def report(concurrency, results, elapsed, mix):
+    print(f"\n=== concurrency {concurrency} ({elapsed:.1f}s) ===")
+    print(f"{'route':<15}{'reqs':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err %':>8}{'shed %':>8}")
+    total = 0
+    for route in mix:
+        samples = results.get(route, [])
+        if not samples:
+            continue
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        errors = sum(1 for _, status in samples if status is None or (status >= 500 and status != 503))
+        shed = sum(1 for _, status in samples if status in (429, 503))
+        total += len(samples)
+        print(f"{route:<15}{len(samples):>7}{len(samples) / elapsed:>9.1f}"
+              f"{statistics.median(latencies):>9.1f}{percentile(latencies, 95):>9.1f}{percentile(latencies, 99):>9.1f}"
+              f"{100 * errors / len(samples):>8.1f}{100 * shed / len(samples):>8.1f}")
+    print(f"{'total':<15}{total:>7}{total / elapsed:>9.1f}")
+    return total / elapsed
+
+
+def wait_for_server(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/api/event-types')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def start_server(database_url, app_target, workers, threads, worker_class, port, keep_limits=False):
+    env = dict(os.environ, DATABASE_URL=database_url, WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), GUNICORN_BIND=f'127.0.0.1:{port}')
+    if not keep_limits:
+        env['RATELIMIT_ENABLED'] = 'false'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--worker-class', worker_class, app_target],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server('127.0.0.1', port)
+    except Exception:
+        stop_server(server)
+        raise
+    return server
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test against gunicorn")
+    parser.add_argument('--database-url', help="defaults to a throwaway SQLite file")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--app', default='wsgi:app', help="use asgi:app with -k uvicorn.workers.UvicornWorker")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--levels', default='1,4,16,64', help="comma-separated client concurrency levels")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per level")
+    parser.add_argument('--venues', type=int, default=200)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--attendees', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--keep-limits', action='store_true', help="leave rate limiting / load shedding on")
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+    counts = {'venues': args.venues, 'events': args.events, 'attendees': args.attendees, 'users': args.users}
+    print(f"Seeding {database_url} ...")
+    seed(database_url, **counts)
+
+    mix = MIXES[args.mix]
+    server = start_server(database_url, args.app, args.workers, args.threads, args.worker_class, args.port,
+                          args.keep_limits)
+    try:
+        print(f"gunicorn {args.app}: {args.workers} workers x {args.threads} threads ({args.worker_class})")
+        for level in (int(level) for level in args.levels.split(',')):
+            results, elapsed = run_level('127.0.0.1', args.port, level, args.duration, counts, mix)
+            report(level, results, elapsed, mix)
+    finally:
+        stop_server(server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# benchmarks/sqlite_concurrency.py
+# SQLite under concurrent writes from several gunicorn workers: stock settings vs. the
+# sqlite_profile.py tuning (WAL, synchronous=NORMAL, busy_timeout, ...).
+#
+#   python benchmarks/sqlite_concurrency.py --workers 4 --levels 4,16,32 --duration 10
+#
+# Each profile gets a fresh database file (journal_mode is stored in the file) and the
+# write-heavy 'writes' mix from loadtest.py. Failed requests are mostly "database is
+# locked" errors surfacing as 4xx/5xx responses from the write routes.
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import MIXES, report, run_level, seed, start_server, stop_server
+
+PROFILES = (
+    ('stock', 'false'),
+    ('tuned', 'true'),
+)
+
+
+def failures(results):
+    samples = [status for route_samples in results.values() for _, status in route_samples]
+    failed = sum(1 for status in samples if status is None or status >= 400)
+    return failed, len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite write concurrency: stock vs. tuned pragmas")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--levels', default='4,16,32')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    counts = {'venues': 200, 'events': 2000, 'attendees': 2000, 'users': 10}
+    levels = [int(level) for level in args.levels.split(',')]
+    mix = MIXES['writes']
+    summary = {}
+    for name, tuning in PROFILES:
+        os.environ['SQLITE_TUNING'] = tuning
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), f'sqlite_{name}.db')
+        print(f"\n##### {name} (SQLITE_TUNING={tuning}): seeding {database_url} ...")
+        seed(database_url, **counts)
+        server = start_server(database_url, 'wsgi:app', args.workers, args.threads, 'sync', args.port)
+        try:
+            for level in levels:
+                results, elapsed = run_level('127.0.0.1', args.port, level, args.duration, counts, mix)
+                rps = report(level, results, elapsed, mix)
+                summary[name, level] = (rps, *failures(results))
+        finally:
+            stop_server(server)
+
+    print(f"\n{'clients':>8}" + ''.join(f"{name + ' req/s':>14}{name + ' fail %':>14}" for name, _ in PROFILES))
+    for level in levels:
+        row = f"{level:>8}"
+        for name, _ in PROFILES:
+            rps, failed, total = summary[name, level]
+            row += f"{rps:>14.1f}{100 * failed / total if total else 0:>14.1f}"
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
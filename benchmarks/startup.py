@@ -0,0 +1,38 @@
+# benchmarks/startup.py
+# Measures cold-start time: a fresh interpreter importing app.py and calling create_app().
+#   python benchmarks/startup.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app()
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+"""
+
+
+def main(runs=10):
+    env = dict(os.environ, DATABASE_URL=os.getenv('DATABASE_URL', 'sqlite:///:memory:'))
+    imports, factories = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        import_s, factory_s = map(float, out.split()[-2:])
+        imports.append(import_s * 1000)
+        factories.append(factory_s * 1000)
+
+    print(f"runs: {runs}")
+    print(f"import app:   median {statistics.median(imports):7.1f} ms  max {max(imports):7.1f} ms")
+    print(f"create_app(): median {statistics.median(factories):7.1f} ms  max {max(factories):7.1f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,402 @@
+# changes.py
+# A change feed, so dashboards can follow new and edited records instead of re-polling lists.
+#
+#   GET /api/changes                       -> {"changes": [], "next": 1234}   (where the log is now)
+#   GET /api/changes?since=1234[&wait=15]  -> {"changes": [...], "next": 1240}
+#   GET /api/changes?since=1234  with Accept: text/event-stream   (SSE; Last-Event-ID resumes)
+#
+# Each change is a compact delta:
+#   {"seq": 1235, "entity": "venues", "key": {"id": 3}, "op": "update", "data": {"name": "Roxy"}}
+#   {"seq": 1236, "entity": "attendee_events", "key": {"attendee_id": 1, "event_id": 9}, "op": "insert"}
+# op is insert (data has every column), update (data has the changed columns), delete, or
+# upsert (written by a set-based path that doesn't know which; data has the new values).
+# Rows that ON DELETE CASCADE removes along with a deleted row get delete records too (a
+# venue's events and ratings; a user's venues, artists and events; an attendee's ratings),
+# read just before the flush. The many-to-many rows of a deleted row are implied by its
+# delete. Archived events are deletes with data {"archived": true}.
+#
+# Every flush turns the ORM's inserts, updates and deletes, and the association rows its
+# collections add or remove, into change_log rows written just before the transaction
+# commits, so seq order is commit order (PostgreSQL takes a transaction-level advisory lock
+# for that; SQLite serializes writers anyway). Set-based writers call record_changes()
+# themselves. after_commit then wakes this worker's long-polls at once; requests waiting in
+# other workers notice within CHANGES_POLL_SECONDS.
+#
+# A waiting request holds a worker thread. The bundled gunicorn config runs gthread
+# workers with GUNICORN_THREADS (default 8) threads each, and at most CHANGES_MAX_WAITERS
+# (default half the threads) requests per worker wait at once; beyond that a long-poll
+# answers at once and a stream sends what is there and ends, so followers never take every
+# thread. A long-poll and an SSE response both end within 20 seconds by default, under the
+# worker timeout (GUNICORN_TIMEOUT, default 30) that kills a plain sync worker busy that
+# long; an SSE client then reconnects (the stream asks for a 1 s retry, 5 s when it was
+# turned away) and resumes from Last-Event-ID.
+#
+# Configuration (optional):
+#   CHANGES_EXCLUDED_TABLES    tables left out of the log (internal tables, and users)
+#   CHANGES_RETENTION_HOURS    how long changes are kept (default 24); older `since` gets 410
+#   CHANGES_MAX_WAIT           longest long-poll, seconds (default 20)
+#   CHANGES_POLL_SECONDS       how often a waiting request re-reads the log (default 1)
+#   CHANGES_STREAM_SECONDS     how long one SSE response stays open (default 20)
+#   CHANGES_MAX_WAITERS        requests per worker that may wait at once (0 = no limit)
+#
+#   flask prune-changes        deletes changes past the retention period
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask import Response, current_app, Blueprint, jsonify, request, stream_with_context
+from sqlalchemy import delete, event, func, inspect, insert, select, text
+from sqlalchemy.orm import Session, scoped_session
+
+from app import db, cascaded_rows, plain_json
+
+changes_api = Blueprint('changes', __name__)
+
+DEFAULT_EXCLUDED_TABLES = (
+    'audit_log', 'change_log', 'event_cards', 'idempotency_keys', 'notification_outbox', 'user_counts', 'users',
+)
+# Never logged, whatever the table settings
+SECRET_COLUMNS = {'password_hash'}
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+# Milliseconds an SSE client waits before reconnecting after a stream ends, and after one
+# that found every waiting slot taken
+STREAM_RETRY_MS = 1000
+STREAM_BUSY_RETRY_MS = 5000
+# Arbitrary key for pg_advisory_xact_lock, shared by every writer of change_log
+ADVISORY_LOCK_KEY = 0x6368616e6765
+
+
+class Change(db.Model):
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}   # never reuse a seq, even after pruning
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.JSON, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+def _as_dict(row):
+    change = {'seq': row.id, 'entity': row.entity, 'key': row.key, 'op': row.op}
+    if row.data:
+        change['data'] = row.data
+    return change
+
+
+#-------------------------------#Recording--------------------#
+def record_changes(executor, records):
+    """
+    Logs (entity, key, op, data) records. With a Session they are written when it commits;
+    with a Connection, at once, inside that connection's transaction.
+    """
+    excluded = current_app.config['CHANGES_EXCLUDED_TABLES']
+    records = [record for record in records if record[0] not in excluded]
+    if not records:
+        return
+    if isinstance(executor, (Session, scoped_session)):
+        executor.info.setdefault('changes', []).extend(records)
+    else:
+        _write(executor, records)
+
+
+def _write(executor, records):
+    bind = executor.get_bind() if hasattr(executor, 'get_bind') else executor
+    if bind.dialect.name == 'postgresql':
+        executor.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': ADVISORY_LOCK_KEY})
+    now = datetime.utcnow()
+    executor.execute(insert(Change.__table__), [
+        {'entity': entity, 'key': plain_json(key), 'op': op, 'data': plain_json(data) if data else None, 'created_at': now}
+        for entity, key, op, data in records
+    ])
+
+
+def _columns(obj, changed_only):
+    state = inspect(obj)
+    values = {}
+    for attr in state.mapper.column_attrs:
+        column = attr.columns[0]
+        if column.name in SECRET_COLUMNS:
+            continue
+        if changed_only and not state.attrs[attr.key].history.has_changes():
+            continue
+        values[column.name] = getattr(obj, attr.key)
+    return values
+
+
+def _key(obj):
+    mapper = inspect(obj).mapper
+    return {column.name: getattr(obj, mapper.get_property_by_column(column).key) for column in mapper.primary_key}
+
+
+def _association_records(obj):
+    """insert/delete records for rows of association tables this object's collections changed."""
+    state = inspect(obj)
+    records = []
+    for prop in state.mapper.relationships:
+        if prop.secondary is None or prop.viewonly:
+            continue
+        history = state.attrs[prop.key].history
+        if not history.has_changes():
+            continue
+        parent = {
+            secondary_column.name: getattr(obj, state.mapper.get_property_by_column(local_column).key)
+            for local_column, secondary_column in prop.synchronize_pairs
+        }
+        for op, related_objects in (('insert', history.added), ('delete', history.deleted)):
+            for related in related_objects:
+                if related is None:
+                    continue
+                related_mapper = inspect(related).mapper
+                key = dict(parent, **{
+                    secondary_column.name: getattr(related, related_mapper.get_property_by_column(remote_column).key)
+                    for remote_column, secondary_column in prop.secondary_synchronize_pairs
+                })
+                records.append((prop.secondary.name, key, op, None))
+    return records
+
+
+def _before_flush(session, flush_context, instances):
+    # Rows the database deletes along with a parent have to be read while they still exist
+    records = []
+    for model, rows in cascaded_rows(session, flush_context).items():
+        table = inspect(model).local_table
+        names = [column.name for column in table.primary_key.columns]
+        records += [(table.name, {name: getattr(row, name) for name in names}, 'delete', None) for row in rows]
+    record_changes(session, records)
+
+
+def _after_flush(session, flush_context):
+    records = []
+    for obj in session.new:
+        records.append((inspect(obj).mapper.local_table.name, _key(obj), 'insert', _columns(obj, changed_only=False)))
+        records += _association_records(obj)
+    for obj in session.dirty:
+        changed = _columns(obj, changed_only=True)
+        if changed:
+            records.append((inspect(obj).mapper.local_table.name, _key(obj), 'update', changed))
+        records += _association_records(obj)
+    for obj in session.deleted:
+        records.append((inspect(obj).mapper.local_table.name, _key(obj), 'delete', None))
+
+    # Both sides of a many-to-many report the same row when both collections are loaded
+    seen, unique = set(), []
+    for record in records:
+        identity = (record[0], tuple(sorted(record[1].items())), record[2])
+        if identity not in seen:
+            seen.add(identity)
+            unique.append(record)
+    record_changes(session, unique)
+
+
+def _before_commit(session):
+    session.flush()
+    records = session.info.pop('changes', None)
+    if records:
+        _write(session, records)
+        session.info['changes_written'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('changes_written', None):
+        feed = current_app.extensions.get('changes')
+        if feed is not None:
+            feed.notify()
+
+
+def _forget(session, *args):
+    session.info.pop('changes', None)
+    session.info.pop('changes_written', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'before_commit', _before_commit)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+#-------------------------------#Reading--------------------#
+class ChangeFeed:
+    """
+    Wakes this worker's waiting requests when one of its own commits logged changes, and
+    caps how many requests may wait at once.
+    """
+
+    def __init__(self, max_waiters):
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._waiters = threading.BoundedSemaphore(max_waiters) if max_waiters else None
+
+    @contextmanager
+    def waiting(self):
+        """True inside the block when this request may wait; False when max_waiters already do."""
+        if self._waiters is None:
+            yield True
+            return
+        allowed = self._waiters.acquire(blocking=False)
+        try:
+            yield allowed
+        finally:
+            if allowed:
+                self._waiters.release()
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Blocks until a commit after `generation`, or timeout. Returns the current generation."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation != generation, timeout)
+            return self._generation
+
+    @property
+    def generation(self):
+        return self._generation
+
+
+def read_changes(since, limit):
+    table = Change.__table__
+    # On a connection of its own: every read sees the latest commits, and the request's
+    # session (a batch sub-request's, say) is left as it was
+    with db.engine.connect() as connection:
+        return [
+            _as_dict(row) for row in
+            connection.execute(select(table).where(table.c.id > since).order_by(table.c.id).limit(limit))
+        ]
+
+
+def _head():
+    with db.engine.connect() as connection:
+        return connection.execute(select(func.coalesce(func.max(Change.id), 0))).scalar()
+
+
+def _expired(since):
+    """True when changes right after `since` have already been pruned."""
+    with db.engine.connect() as connection:
+        oldest = connection.execute(select(func.min(Change.id))).scalar()
+    return oldest is not None and since < oldest - 1
+
+
+def deleted_since(entity, since):
+    """
+    (keys of `entity` rows deleted after change `since`, the newest change seq), read on a
+    connection of its own so it can run from any request. The keys are None when `since` is
+    None or changes after it have been pruned: the caller has to start over from the seq.
+    """
+    table = Change.__table__
+    with db.engine.connect() as connection:
+        head = connection.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+        oldest = connection.execute(select(func.min(table.c.id))).scalar()
+        if since is None or (oldest is not None and since < oldest - 1):
+            return None, head
+        keys = connection.execute(
+            select(table.c.key).where(
+                table.c.id > since, table.c.id <= head, table.c.entity == entity, table.c.op == 'delete',
+            )
+        ).scalars().all()
+    return keys, head
+
+
+def _cutoff():
+    return datetime.utcnow() - timedelta(hours=current_app.config['CHANGES_RETENTION_HOURS'])
+
+
+def wait_for_changes(since, limit, timeout):
+    """Changes after `since`, waiting up to `timeout` seconds for the first one."""
+    feed = current_app.extensions['changes']
+    poll = current_app.config['CHANGES_POLL_SECONDS']
+    deadline = time.monotonic() + timeout
+    while True:
+        generation = feed.generation
+        changes = read_changes(since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        feed.wait(generation, min(poll, remaining))
+
+
+def prune_changes():
+    """Deletes changes older than the retention period. Returns the number deleted."""
+    table = Change.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(delete(table).where(table.c.created_at < _cutoff())).rowcount
+
+
+@changes_api.get('/api/changes')
+def get_changes():
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    since = request.headers.get('Last-Event-ID', request.args.get('since'))
+    if since is None:
+        return jsonify({'changes': [], 'next': _head()}), 200
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"error": "since must be a change sequence number."}), 400
+    if _expired(since):
+        return jsonify({"error": "Changes since then are no longer kept; reload and restart from 'next'.",
+                        'next': _head()}), 410
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return _stream(since, limit)
+
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), current_app.config['CHANGES_MAX_WAIT']))
+    with current_app.extensions['changes'].waiting() as allowed:
+        # With every waiting slot taken, answer at once; the client simply polls again
+        changes = wait_for_changes(since, limit, wait if allowed else 0)
+    return jsonify({'changes': changes, 'next': changes[-1]['seq'] if changes else since}), 200
+
+
+def _stream(since, limit):
+    config = current_app.config
+    feed = current_app.extensions['changes']
+
+    def events():
+        nonlocal since
+        with feed.waiting() as allowed:
+            # Without a waiting slot the stream sends what is there and ends; the client
+            # reconnects after the longer busy retry
+            deadline = time.monotonic() + (config['CHANGES_STREAM_SECONDS'] if allowed else 0)
+            yield f"retry: {STREAM_RETRY_MS if allowed else STREAM_BUSY_RETRY_MS}\n\n"
+            while True:
+                remaining = max(0.0, deadline - time.monotonic())
+                changes = wait_for_changes(since, limit, min(config['CHANGES_MAX_WAIT'], remaining))
+                if changes:
+                    for change in changes:
+                        yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change, separators=(',', ':'))}\n\n"
+                    since = changes[-1]['seq']
+                elif remaining:
+                    yield ": keep-alive\n\n"
+                if time.monotonic() >= deadline:
+                    return
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@click.command('prune-changes')
+def prune_changes_command():
+    """Delete change-log entries past the retention period."""
+    click.echo(f"Deleted {prune_changes()} changes.")
+
+
+def init_app(app):
+    app.config.setdefault('CHANGES_EXCLUDED_TABLES', DEFAULT_EXCLUDED_TABLES)
+    app.config.setdefault('CHANGES_RETENTION_HOURS', 24)
+    app.config.setdefault('CHANGES_MAX_WAIT', 20)
+    app.config.setdefault('CHANGES_POLL_SECONDS', 1)
+    app.config.setdefault('CHANGES_STREAM_SECONDS', 20)
+    # Half of the default gunicorn threads, so followers never take a whole worker
+    app.config.setdefault('CHANGES_MAX_WAITERS', max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2))
+    app.extensions['changes'] = ChangeFeed(app.config['CHANGES_MAX_WAITERS'])
+    app.register_blueprint(changes_api)
+    app.cli.add_command(prune_changes_command)
@@ -0,0 +1,308 @@
+# checkins.py
+# Door check-ins: attendance rows written in batches, and live counts kept by the database.
+#
+#   POST /api/events/<id>/checkins   {"attendee_id": 5} or {"attendee_ids": [5, 6, ...]}
+#   -> 202 {"accepted": 2, "pending": 37}
+#   GET  /api/events/<id>/checkins   -> {"event_id": 1, "attendance": 812, "pending": 3}
+#
+# A POST only adds (attendee, event) pairs to a bounded in-memory buffer in this worker.
+# A background thread writes the buffer to attendee_events with multi-row
+# INSERT ... ON CONFLICT DO NOTHING every CHECKIN_FLUSH_MS, or as soon as CHECKIN_FLUSH_ROWS
+# pairs are waiting, so a repeated scan is a no-op and thousands of scans cost a handful of
+# statements. Pairs naming an attendee or event that doesn't exist are dropped at flush
+# time. The same transaction records the new rows in the change log. When the buffer holds
+# CHECKIN_QUEUE_SIZE pairs, further POSTs get 503 with Retry-After until it drains. What is
+# still buffered when the worker exits is flushed.
+#
+# A check-in only lengthens the attendee list on its event's card (see event_cards.py), so
+# cards aren't re-rendered: the new attendees are appended to the stored card, at most once
+# per CHECKIN_CARD_SECONDS (default 5) per event. A busy door makes one small card update
+# every few seconds rather than a full render of every attendee on every flush; in between,
+# listings show up to that many seconds' worth of check-ins less than the live count.
+#
+# events.attendee_count is maintained by triggers on attendee_events (row triggers on
+# SQLite, one statement-level trigger per INSERT/DELETE on PostgreSQL), so it follows
+# check-ins, ORM edits, cascades and archiving alike and is read with a primary-key
+# lookup instead of a COUNT. After upgrading an existing database run
+#
+#   flask sync-schema && flask recount-attendance
+#
+# to add the column, install the triggers and fill in the current counts.
+import atexit
+import math
+import os
+import threading
+import time
+
+import click
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import DDL, event, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db, Attendee, Event, attendee_events
+import changes
+import event_cards
+
+checkins_api = Blueprint('checkins', __name__)
+
+INSERT_CHUNK_SIZE = 500
+MAX_BATCH = 1000
+
+SQLITE_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS attendee_events_count_insert AFTER INSERT ON attendee_events "
+    "BEGIN UPDATE events SET attendee_count = attendee_count + 1 WHERE id = NEW.event_id; END",
+    "CREATE TRIGGER IF NOT EXISTS attendee_events_count_delete AFTER DELETE ON attendee_events "
+    "BEGIN UPDATE events SET attendee_count = attendee_count - 1 WHERE id = OLD.event_id; END",
+)
+# One UPDATE per statement and event, however many rows the statement touched
+POSTGRES_TRIGGERS = (
+    """CREATE OR REPLACE FUNCTION attendee_events_count() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE events SET attendee_count = attendee_count + changed.n
+            FROM (SELECT event_id, count(*) AS n FROM changed_rows GROUP BY event_id) AS changed
+            WHERE events.id = changed.event_id;
+        ELSE
+            UPDATE events SET attendee_count = attendee_count - changed.n
+            FROM (SELECT event_id, count(*) AS n FROM changed_rows GROUP BY event_id) AS changed
+            WHERE events.id = changed.event_id;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS attendee_events_count_insert ON attendee_events",
+    "CREATE TRIGGER attendee_events_count_insert AFTER INSERT ON attendee_events "
+    "REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION attendee_events_count()",
+    "DROP TRIGGER IF EXISTS attendee_events_count_delete ON attendee_events",
+    "CREATE TRIGGER attendee_events_count_delete AFTER DELETE ON attendee_events "
+    "REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION attendee_events_count()",
+)
+
+# Engines (by URL) on which the triggers are known to exist in this process
+_triggers_ready = set()
+
+for statement in SQLITE_TRIGGERS:
+    event.listen(attendee_events, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_TRIGGERS:
+    event.listen(attendee_events, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def ensure_triggers(connection):
+    key = str(connection.engine.url)
+    if key in _triggers_ready:
+        return
+    statements = {'sqlite': SQLITE_TRIGGERS, 'postgresql': POSTGRES_TRIGGERS}.get(connection.dialect.name, ())
+    for statement in statements:
+        connection.execute(text(statement))
+    _triggers_ready.add(key)
+
+
+def recount_attendance():
+    """Installs the triggers and recomputes every events.attendee_count. Returns the number of events."""
+    events = Event.__table__
+    with db.engine.begin() as connection:
+        ensure_triggers(connection)
+        attendance = (
+            select(func.count()).select_from(attendee_events)
+            .where(attendee_events.c.event_id == events.c.id).scalar_subquery()
+        )
+        return connection.execute(update(events).values(attendee_count=attendance)).rowcount
+
+
+#-------------------------------#Buffer--------------------#
+class CheckinBuffer:
+    """
+    Pending attendee ids per event in one worker, as sets, so repeated scans between
+    flushes collapse. The flusher thread is started by the first check-in in each process,
+    so a gunicorn master that preloads the app never owns one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.pending = {}      # event id -> set of attendee ids
+        self.size = 0
+        self.stale_cards = {}  # event id -> attendee ids written but not on the event's card yet
+        self._card_times = {}  # event id -> when its card was last brought up to date (monotonic)
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher_pid = None
+
+    def add(self, event_id, attendee_ids):
+        """Buffers the check-ins. Returns False, buffering none, when they would overflow the queue."""
+        with self._lock:
+            waiting = self.pending.setdefault(event_id, set())
+            fresh = set(attendee_ids) - waiting
+            if self.size + len(fresh) > self.app.config['CHECKIN_QUEUE_SIZE']:
+                return False
+            waiting |= fresh
+            self.size += len(fresh)
+            due = self.size >= self.app.config['CHECKIN_FLUSH_ROWS']
+            self._start_flusher()
+        if due:
+            self._wake.set()
+        return True
+
+    def pending_for(self, event_id):
+        return len(self.pending.get(event_id, ()))
+
+    def _start_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name='checkin-flusher', daemon=True).start()
+        atexit.register(self.flush, final=True)
+
+    def _run(self):
+        interval = self.app.config['CHECKIN_FLUSH_MS'] / 1000
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Check-in flush failed")
+
+    def flush(self, final=False):
+        """
+        Writes everything buffered so far and brings the cards that are due up to date (all
+        of them when final). Returns the number of new attendance rows.
+        """
+        with self._flushing:
+            with self._lock:
+                batch, self.pending, self.size = self.pending, {}, 0
+            pairs = [(attendee_id, event_id) for event_id, attendee_ids in batch.items() for attendee_id in attendee_ids]
+            written = 0
+            if pairs:
+                try:
+                    with self.app.app_context():
+                        written, dropped, kept = write_checkins(pairs)
+                except Exception:
+                    # Put them back (as far as they fit) for the next attempt
+                    with self._lock:
+                        for attendee_id, event_id in pairs:
+                            if self.size >= self.app.config['CHECKIN_QUEUE_SIZE']:
+                                break
+                            waiting = self.pending.setdefault(event_id, set())
+                            if attendee_id not in waiting:
+                                waiting.add(attendee_id)
+                                self.size += 1
+                    raise
+                if dropped:
+                    self.app.logger.info("Dropped %d check-ins for unknown attendees or events", dropped)
+                for attendee_id, event_id in kept:
+                    self.stale_cards.setdefault(event_id, set()).add(attendee_id)
+            self._update_cards(final)
+            return written
+
+    def _update_cards(self, final):
+        now = time.monotonic()
+        every = self.app.config['CHECKIN_CARD_SECONDS']
+        due = {
+            event_id: attendee_ids for event_id, attendee_ids in self.stale_cards.items()
+            if final or now - self._card_times.get(event_id, -math.inf) >= every
+        }
+        if not due:
+            return
+        try:
+            with self.app.app_context(), db.engine.begin() as connection:
+                event_cards.add_attendees(connection, due)
+        except Exception:
+            # The attendance rows are in; the cards catch up on a later flush
+            self.app.logger.exception("Check-in card update failed")
+            return
+        for event_id in due:
+            del self.stale_cards[event_id]
+            self._card_times[event_id] = now
+        # A time further back than the interval says no more than a missing one
+        self._card_times = {event_id: at for event_id, at in self._card_times.items() if now - at < every}
+
+
+def write_checkins(pairs):
+    """
+    Inserts (attendee id, event id) pairs into attendee_events, skipping pairs already
+    there and pairs whose attendee or event doesn't exist. Returns (inserted, dropped, the
+    pairs kept).
+    """
+    attendee_ids = {attendee_id for attendee_id, _ in pairs}
+    event_ids = {event_id for _, event_id in pairs}
+    with db.engine.begin() as connection:
+        ensure_triggers(connection)
+        known_attendees = set(connection.execute(select(Attendee.id).where(Attendee.id.in_(attendee_ids))).scalars())
+        known_events = set(connection.execute(select(Event.id).where(Event.id.in_(event_ids))).scalars())
+        rows = [
+            {'attendee_id': attendee_id, 'event_id': event_id}
+            for attendee_id, event_id in sorted(pairs)
+            if attendee_id in known_attendees and event_id in known_events
+        ]
+        inserted = 0
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            inserted += _insert_ignoring_duplicates(connection, rows[start:start + INSERT_CHUNK_SIZE])
+        changes.record_changes(connection, [('attendee_events', row, 'upsert', None) for row in rows])
+    return inserted, len(pairs) - len(rows), [(row['attendee_id'], row['event_id']) for row in rows]
+
+
+def _insert_ignoring_duplicates(connection, rows):
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        return connection.execute(dialect_insert(attendee_events).values(rows).on_conflict_do_nothing()).rowcount
+    existing = set(connection.execute(
+        select(attendee_events.c.attendee_id, attendee_events.c.event_id)
+        .where(attendee_events.c.event_id.in_({row['event_id'] for row in rows}))
+    ).all())
+    rows = [row for row in rows if (row['attendee_id'], row['event_id']) not in existing]
+    if rows:
+        connection.execute(insert(attendee_events), rows)
+    return len(rows)
+
+
+#-------------------------------#Routes--------------------#
+def _attendee_ids(data):
+    if isinstance(data, dict):
+        data = [data['attendee_id']] if 'attendee_id' in data else data.get('attendee_ids')
+    if not isinstance(data, list) or not data or len(data) > MAX_BATCH:
+        return None
+    if not all(isinstance(item, int) and not isinstance(item, bool) and item > 0 for item in data):
+        return None
+    return data
+
+
+@checkins_api.post('/api/events/<int:id>/checkins')
+def check_in(id):
+    attendee_ids = _attendee_ids(request.get_json(silent=True))
+    if attendee_ids is None:
+        return jsonify({"error": f"Expected attendee_id or a list of 1-{MAX_BATCH} attendee_ids."}), 400
+    buffer = current_app.extensions['checkins']
+    if not buffer.add(id, attendee_ids):
+        response = jsonify({"error": "Too many check-ins waiting to be written; retry shortly."})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({'accepted': len(attendee_ids), 'pending': buffer.pending_for(id)}), 202
+
+
+@checkins_api.get('/api/events/<int:id>/checkins')
+def get_attendance(id):
+    attendance = db.session.execute(select(Event.attendee_count).where(Event.id == id)).scalar()
+    if attendance is None:
+        return jsonify({"error": "Event not found"}), 404
+    return jsonify({
+        'event_id': id,
+        'attendance': attendance,
+        'pending': current_app.extensions['checkins'].pending_for(id),
+    }), 200
+
+
+@click.command('recount-attendance')
+def recount_attendance_command():
+    """Install the attendance triggers and recompute events.attendee_count."""
+    click.echo(f"Recounted attendance for {recount_attendance()} events.")
+
+
+def init_app(app):
+    app.config.setdefault('CHECKIN_FLUSH_MS', int(os.getenv('CHECKIN_FLUSH_MS', '200')))
+    app.config.setdefault('CHECKIN_FLUSH_ROWS', int(os.getenv('CHECKIN_FLUSH_ROWS', '500')))
+    app.config.setdefault('CHECKIN_QUEUE_SIZE', int(os.getenv('CHECKIN_QUEUE_SIZE', '20000')))
+    app.config.setdefault('CHECKIN_CARD_SECONDS', float(os.getenv('CHECKIN_CARD_SECONDS', '5')))
+    app.extensions['checkins'] = CheckinBuffer(app)
+    app.register_blueprint(checkins_api)
+    app.cli.add_command(recount_attendance_command)
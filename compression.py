@@ -0,0 +1,140 @@
+# compression.py
+# gzip / brotli response compression negotiated through Accept-Encoding.
+#
+# Configuration (all optional):
+#   COMPRESS_ENABLED          False turns it off
+#   COMPRESS_MIN_SIZE         bodies smaller than this many bytes go out uncompressed (default 1024)
+#   COMPRESS_LEVEL            gzip level 1-9 (default 6)
+#   COMPRESS_BR_LEVEL         brotli quality 0-11 (default 5), used when the brotli package is installed
+#   COMPRESS_MIMETYPES        content types worth compressing
+#   COMPRESS_CACHE_ENTRIES    compressed bodies kept in memory, keyed by a digest of the body (default 256)
+#   COMPRESS_CACHE_MAX_BYTES  upper bound on the memory used by that cache (default 16 MB)
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+DEFAULT_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'text/csv', 'application/javascript')
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies, so an unchanged payload is only compressed once per worker."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def accepted_encodings(header):
+    """Parses Accept-Encoding into {coding: q}."""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get('*', 0)
+    best, best_q = None, 0
+    # Prefer brotli over gzip when the client ranks them equally
+    for coding in (('br', 'gzip') if brotli else ('gzip',)):
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['COMPRESS_BR_LEVEL'])
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+
+def compressed_body(cache, body, encoding, config):
+    """Compresses `body`, or returns the cached result for an identical earlier body."""
+    key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+    compressed = cache.get(key)
+    if compressed is None:
+        compressed = compress(body, encoding, config)
+        cache.put(key, compressed)
+    return compressed
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', os.getenv('COMPRESS_ENABLED', 'true').lower() != 'false')
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', '1024')))
+    app.config.setdefault('COMPRESS_LEVEL', int(os.getenv('COMPRESS_LEVEL', '6')))
+    app.config.setdefault('COMPRESS_BR_LEVEL', int(os.getenv('COMPRESS_BR_LEVEL', '5')))
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+    app.config.setdefault('COMPRESS_CACHE_ENTRIES', 256)
+    app.config.setdefault('COMPRESS_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+
+    if not app.config['COMPRESS_ENABLED']:
+        return
+
+    config = app.config
+    cache = CompressedBodyCache(config['COMPRESS_CACHE_ENTRIES'], config['COMPRESS_CACHE_MAX_BYTES'])
+    app.extensions['compression'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.set_data(compressed_body(cache, body, encoding, config))
+        response.headers['Content-Encoding'] = encoding
+        return response
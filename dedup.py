@@ -0,0 +1,263 @@
+# dedup.py
+# Finding and merging attendees entered more than once under different emails.
+#
+#   GET  /api/admin/attendees/duplicates[?threshold=0.6&limit=100]          (admins)
+#   -> {"pairs": [{"attendees": [{"id": 3, ...}, {"id": 41, ...}], "score": 0.86,
+#                  "reasons": ["phonetic", "email"]}, ...],
+#       "attendees": 5230, "comparisons": 8120, "skipped_blocks": 2}
+#   POST /api/admin/attendees/merge   {"keep": 3, "merge": [41, 97]}          (admins)
+#   -> {"attendee": {...}, "merged": [41, 97], "moved": {"attendee_events": 12, ...}}
+#
+# Candidates come from blocking rather than comparing every pair: each attendee gets a few
+# keys, and only attendees sharing a key are compared.
+#   phonetic   Soundex of the last name plus the first initial, and of the first name plus
+#              the last initial (so swapped first/last names meet)
+#   email      the email's local part without dots or a +tag ("j.smith+gigs" -> "jsmith")
+# Names are normalized first (case, accents, punctuation; see autocomplete.normalize). Blocks
+# larger than DEDUP_MAX_BLOCK (default 200) are too common to say anything and are skipped,
+# which keeps the work near-linear. A pair's score is the trigram similarity (Jaccard) of
+# the two full names, plus 0.2 when the email keys match, capped at 1; pairs scoring at
+# least DEDUP_THRESHOLD (default 0.6) are reported, best first.
+#
+# A merge moves every association row of the merged attendees to the one kept, in one
+# transaction and one INSERT ... SELECT plus one DELETE per table, skipping rows the kept
+# attendee already has: attendee_events, attendee_favorites, artist_favorites (keeping
+# the earliest created_at) and attendee_venue (the kept attendee's rating wins, otherwise
+# the highest of the others'). Venue rating totals, event cards and attendance counts follow,
+# and the merged attendees are deleted.
+from collections import defaultdict
+from itertools import combinations
+
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import delete, func, insert, literal, select
+
+from app import (
+    db, Attendee, AttendeeVenue, artist_favorites, attendee_events, attendee_favorites,
+    bump_version, is_admin_user, refresh_venue_ratings,
+)
+from autocomplete import normalize
+import changes
+import event_cards
+
+dedup_api = Blueprint('dedup', __name__)
+
+EMAIL_BONUS = 0.2
+MAX_LIMIT = 1000
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+
+#-------------------------------#Keys--------------------#
+def soundex(word):
+    """American Soundex ("Robert" and "Rupert" -> "r163"); '' for a word without letters."""
+    letters = [ch for ch in word if 'a' <= ch <= 'z']
+    if not letters:
+        return ''
+    code, last = letters[0], SOUNDEX_CODES.get(letters[0])
+    for ch in letters[1:]:
+        digit = SOUNDEX_CODES.get(ch)
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if ch not in 'hw':     # h and w don't separate letters with the same code
+            last = digit
+    return code.ljust(4, '0')
+
+
+def trigrams(name):
+    """Trigrams of each word, padded like pg_trgm so word starts and ends count."""
+    grams = set()
+    for word in name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def email_key(email):
+    local = (email or '').lower().split('@', 1)[0].split('+', 1)[0].replace('.', '')
+    return local if len(local) >= 3 else None
+
+
+def blocking_keys(first, last, email):
+    keys = []
+    first, last = normalize(first), normalize(last)
+    if first and last:
+        keys.append(('phonetic', soundex(last.replace(' ', '')) + first[0]))
+        keys.append(('phonetic', soundex(first.replace(' ', '')) + last[0]))
+    local = email_key(email)
+    if local:
+        keys.append(('email', local))
+    return keys
+
+
+#-------------------------------#Blocking index--------------------#
+class BlockingIndex:
+    """Attendees grouped by blocking key, with their name trigrams for scoring."""
+
+    def __init__(self, max_block):
+        self.max_block = max_block
+        self.blocks = defaultdict(list)     # (kind, key) -> attendee ids
+        self.grams = {}                     # attendee id -> trigram set of the full name
+        self.emails = {}                    # attendee id -> email key
+
+    def add(self, id_, first, last, email):
+        self.grams[id_] = trigrams(normalize(f"{first} {last}"))
+        self.emails[id_] = email_key(email)
+        for key in dict.fromkeys(blocking_keys(first, last, email)):
+            self.blocks[key].append(id_)
+
+    def candidates(self):
+        """({(id, id): set of reasons}, number of blocks skipped as too large)."""
+        pairs = defaultdict(set)
+        skipped = 0
+        for (kind, _), ids in self.blocks.items():
+            if len(ids) > self.max_block:
+                skipped += 1
+                continue
+            for pair in combinations(sorted(ids), 2):
+                pairs[pair].add(kind)
+        return pairs, skipped
+
+    def score(self, a, b):
+        grams_a, grams_b = self.grams[a], self.grams[b]
+        union = len(grams_a | grams_b)
+        similarity = len(grams_a & grams_b) / union if union else 0.0
+        if self.emails[a] and self.emails[a] == self.emails[b]:
+            similarity += EMAIL_BONUS
+        return min(similarity, 1.0)
+
+
+def _describe(row):
+    return {'id': row.id, 'first_name': row.first_name, 'last_name': row.last_name, 'email': row.email}
+
+
+def find_duplicates(threshold, limit):
+    rows = db.session.execute(select(Attendee.id, Attendee.first_name, Attendee.last_name, Attendee.email)).all()
+    index = BlockingIndex(current_app.config['DEDUP_MAX_BLOCK'])
+    for row in rows:
+        index.add(*row)
+    candidates, skipped = index.candidates()
+
+    scored = [(index.score(a, b), a, b, reasons) for (a, b), reasons in candidates.items()]
+    scored = sorted((match for match in scored if match[0] >= threshold), key=lambda match: (-match[0], match[1], match[2]))
+    scored = scored[:limit]
+
+    listed = {row.id: _describe(row) for row in rows}
+    return {
+        'pairs': [
+            {'attendees': [listed[a], listed[b]], 'score': round(score, 3), 'reasons': sorted(reasons)}
+            for score, a, b, reasons in scored
+        ],
+        'attendees': len(rows),
+        'comparisons': len(candidates),
+        'skipped_blocks': skipped,
+    }
+
+
+#-------------------------------#Merge--------------------#
+def _move(table, keep_id, merge_ids, key, extra=None):
+    """
+    Gives `keep_id` every `key` value the merged attendees have and it lacks, then deletes
+    the merged attendees' rows. `extra` maps further columns to an aggregate over the
+    merged rows. Returns the key values added.
+    """
+    theirs = table.c.attendee_id.in_(merge_ids)
+    mine = select(table.c[key]).where(table.c.attendee_id == keep_id, table.c[key].isnot(None))
+    missing = (theirs, table.c[key].isnot(None), table.c[key].notin_(mine))
+    added = db.session.execute(select(table.c[key]).where(*missing).distinct()).scalars().all()
+    if added:
+        extra = extra or {}
+        db.session.execute(insert(table).from_select(
+            ['attendee_id', key, *extra],
+            select(literal(keep_id), table.c[key], *extra.values()).where(*missing).group_by(table.c[key]),
+        ))
+    db.session.execute(delete(table).where(theirs))
+    return added
+
+
+def merge_attendees(keep, merge_ids):
+    """Folds the attendees `merge_ids` into `keep` and deletes them. The caller commits."""
+    ratings = AttendeeVenue.__table__
+    rated_venues = db.session.execute(
+        select(ratings.c.venue_id).where(ratings.c.attendee_id.in_(merge_ids)).distinct()
+    ).scalars().all()
+    attended_events = db.session.execute(
+        select(attendee_events.c.event_id).where(attendee_events.c.attendee_id.in_(merge_ids)).distinct()
+    ).scalars().all()
+
+    moved = {
+        'attendee_events': _move(attendee_events, keep.id, merge_ids, 'event_id'),
+        'attendee_favorites': _move(attendee_favorites, keep.id, merge_ids, 'event_id'),
+        'artist_favorites': _move(artist_favorites, keep.id, merge_ids, 'artist_id',
+                                  {'created_at': func.min(artist_favorites.c.created_at)}),
+        'attendee_venue': _move(ratings, keep.id, merge_ids, 'venue_id', {'rating': func.max(ratings.c.rating)}),
+    }
+    # Keep the rows that changed hands out of the session's stale collections
+    db.session.expire(keep)
+    refresh_venue_ratings(db.session, rated_venues)
+
+    changes.record_changes(db.session, [
+        (table, {'attendee_id': keep.id, key: value}, 'upsert', None)
+        for table, key in (('attendee_events', 'event_id'), ('attendee_favorites', 'event_id'),
+                           ('artist_favorites', 'artist_id'), ('attendee_venue', 'venue_id'))
+        for value in moved[table]
+    ])
+    for merged in db.session.execute(select(Attendee).where(Attendee.id.in_(merge_ids))).scalars():
+        db.session.delete(merged)
+    bump_version(keep)
+    db.session.flush()
+    # Cards of every event the merged attendees attended now list the kept attendee instead
+    event_cards.refresh_cards(db.session, attended_events)
+    return {table: len(values) for table, values in moved.items()}
+
+
+#-------------------------------#Routes--------------------#
+@dedup_api.before_request
+def require_admin():
+    if not is_admin_user():
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+
+@dedup_api.get('/api/admin/attendees/duplicates')
+def attendee_duplicates():
+    threshold = request.args.get('threshold', current_app.config['DEDUP_THRESHOLD'], type=float)
+    if not 0 < threshold <= 1:
+        return jsonify({"error": "threshold must be between 0 and 1."}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), MAX_LIMIT))
+    return jsonify(find_duplicates(threshold, limit)), 200
+
+
+@dedup_api.post('/api/admin/attendees/merge')
+def merge_attendees_route():
+    data = request.get_json(silent=True) or {}
+    keep_id, merge_ids = data.get('keep'), data.get('merge')
+    valid = (
+        isinstance(keep_id, int) and isinstance(merge_ids, list) and merge_ids
+        and all(isinstance(id_, int) for id_ in merge_ids) and keep_id not in merge_ids
+    )
+    if not valid:
+        return jsonify({"error": "Expected {\"keep\": id, \"merge\": [ids]} with keep not among merge."}), 400
+    merge_ids = sorted(set(merge_ids))
+
+    keep = db.session.get(Attendee, keep_id)
+    found = set(db.session.execute(select(Attendee.id).where(Attendee.id.in_(merge_ids))).scalars())
+    missing = [id_ for id_ in merge_ids if id_ not in found]
+    if keep is None or missing:
+        return jsonify({"error": "Attendee not found", "missing": ([] if keep else [keep_id]) + missing}), 404
+
+    try:
+        moved = merge_attendees(keep, merge_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify({'attendee': keep.to_dict(), 'merged': merge_ids, 'moved': moved}), 200
+
+
+def init_app(app):
+    app.config.setdefault('DEDUP_THRESHOLD', 0.6)
+    app.config.setdefault('DEDUP_MAX_BLOCK', 200)
+    app.register_blueprint(dedup_api)
@@ -0,0 +1,244 @@
+# event_cards.py
+# Keeps the event_cards read model (see EventCard in app.py) in step with the ORM.
+#
+# Every flush records which events' cards went stale: the events themselves, plus the
+# events showing a renamed venue, creator, artist or attendee, or whose artist/attendee
+# lists changed from the other side. Just before the transaction commits, those cards
+# are re-rendered from Event.to_dict() and upserted, so a card is never newer or older
+# than the rows it was built from. Set-based writes that bypass the ORM call
+# refresh_cards()/drop_cards() themselves.
+#
+#   flask rebuild-event-cards      rebuilds every card from scratch (recovery)
+import json
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import selectinload
+
+from app import (
+    db, cascaded_rows, Artist, Attendee, Event, EventCard, User, Venue, artist_events, attendee_events,
+)
+
+REBUILD_BATCH_SIZE = 500
+
+# Attributes each related model contributes to a card
+CARD_FIELDS = {
+    Venue: ('name',),
+    User: ('username',),
+    Artist: ('name',),
+    Attendee: ('first_name',),
+}
+
+
+def _pending(session):
+    return session.info.setdefault('event_cards', {'events': set(), 'ids': set(), 'deleted': set()})
+
+
+def _changed(obj, names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _collection_changes(obj, name):
+    history = inspect(obj).attrs[name].history
+    return {related.id for related in (*history.added, *history.deleted) if related.id is not None}
+
+
+def _related_event_ids(session, obj):
+    """Ids of the events whose cards show `obj`."""
+    if isinstance(obj, Venue):
+        query = select(Event.id).where(Event.venue_id == obj.id)
+    elif isinstance(obj, User):
+        query = select(Event.id).where(Event.created_by_id == obj.id)
+    elif isinstance(obj, Artist):
+        query = select(artist_events.c.event_id).where(artist_events.c.artist_id == obj.id)
+    elif isinstance(obj, Attendee):
+        query = select(attendee_events.c.event_id).where(attendee_events.c.attendee_id == obj.id)
+    else:
+        return []
+    return session.execute(query).scalars().all()
+
+
+def _lineup_event_ids(session, artist_ids):
+    """Ids of the events whose lineups lose these artists."""
+    if not artist_ids:
+        return []
+    return session.execute(
+        select(artist_events.c.event_id).where(artist_events.c.artist_id.in_(artist_ids))
+    ).scalars().all()
+
+
+def _before_flush(session, flush_context, instances):
+    pending = _pending(session)
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Event):
+                pending['events'].add(obj)
+            elif isinstance(obj, Artist):
+                pending['ids'] |= _collection_changes(obj, 'events')
+            elif isinstance(obj, Attendee):
+                pending['ids'] |= _collection_changes(obj, 'attended_events')
+
+        for obj in session.dirty:
+            if isinstance(obj, Event):
+                pending['events'].add(obj)
+                continue
+            fields = CARD_FIELDS.get(type(obj))
+            if fields and obj.id is not None and _changed(obj, fields):
+                pending['ids'].update(_related_event_ids(session, obj))
+            if isinstance(obj, Artist):
+                pending['ids'] |= _collection_changes(obj, 'events')
+            elif isinstance(obj, Attendee):
+                pending['ids'] |= _collection_changes(obj, 'attended_events')
+
+        # Events and artists ON DELETE CASCADE removes along with a venue or user count as
+        # deleted too; the events that showed a deleted artist or attendee get new cards
+        cascaded = cascaded_rows(session, flush_context)
+        pending['deleted'].update(row.id for row in cascaded.get(Event, ()))
+        deleted_artists = {row.id for row in cascaded.get(Artist, ())}
+        for obj in session.deleted:
+            if isinstance(obj, Event):
+                pending['deleted'].add(obj.id)
+            elif isinstance(obj, Artist):
+                deleted_artists.add(obj.id)
+            elif isinstance(obj, Attendee):
+                pending['ids'].update(_related_event_ids(session, obj))
+        pending['ids'].update(_lineup_event_ids(session, deleted_artists))
+
+
+def _before_commit(session):
+    # Flush first: before_commit fires ahead of the commit's own flush
+    session.flush()
+    pending = session.info.pop('event_cards', None)
+    if pending is None:
+        return
+    ids = {obj.id for obj in pending['events'] if obj.id is not None} | pending['ids']
+    drop_cards(session, pending['deleted'])
+    refresh_cards(session, ids - pending['deleted'])
+
+
+def _forget(session, *args):
+    session.info.pop('event_cards', None)
+
+
+def render(event_obj):
+    """An event's card: its to_dict() as plain JSON values, exactly as the API serializes it."""
+    return json.loads(current_app.json.dumps(event_obj.to_dict()))
+
+
+def _upsert(session, rows):
+    table = EventCard.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.event_id],
+            set_={
+                'payload': stmt.excluded.payload,
+                'updated_at': stmt.excluded.updated_at,
+                'version': table.c.version + 1,
+            },
+        )
+        session.execute(stmt)
+    else:
+        drop_cards(session, [row['event_id'] for row in rows])
+        session.execute(table.insert(), rows)
+
+
+def refresh_cards(session, event_ids):
+    """Re-renders the cards of the given events (events that no longer exist lose theirs)."""
+    event_ids = sorted(set(event_ids))
+    if not event_ids:
+        return
+    now = datetime.utcnow()
+    for start in range(0, len(event_ids), REBUILD_BATCH_SIZE):
+        chunk = event_ids[start:start + REBUILD_BATCH_SIZE]
+        events = session.execute(
+            select(Event).where(Event.id.in_(chunk)).options(
+                selectinload(Event.creator), selectinload(Event.venue),
+                selectinload(Event.attendees), selectinload(Event.artists),
+            # Collections already loaded in this session may predate database-side cascades
+            ).execution_options(populate_existing=True)
+        ).scalars().all()
+        found = {event_obj.id for event_obj in events}
+        drop_cards(session, set(chunk) - found)
+        if events:
+            _upsert(session, [
+                {'event_id': event_obj.id, 'payload': render(event_obj), 'version': 1, 'updated_at': now}
+                for event_obj in events
+            ])
+
+
+def add_attendees(executor, attendees_by_event):
+    """
+    Adds attendees to their events' cards without re-rendering them: each (event, attendee)
+    pair still in attendee_events that the card doesn't list yet is appended, and the card's
+    version bumped. Events without a card are left alone. For check-ins, whose only effect
+    on a card is a longer attendee list. Returns the number of cards changed.
+    """
+    table = EventCard.__table__
+    now = datetime.utcnow()
+    changed = 0
+    for event_id, attendee_ids in attendees_by_event.items():
+        card = executor.execute(
+            select(table.c.payload, table.c.version).where(table.c.event_id == event_id)
+        ).first()
+        if card is None:
+            continue
+        listed = {attendee['id'] for attendee in card.payload['attendees']}
+        wanted = sorted(set(attendee_ids) - listed)
+        added = []
+        for start in range(0, len(wanted), REBUILD_BATCH_SIZE):
+            added += executor.execute(
+                select(Attendee.id, Attendee.first_name)
+                .join(attendee_events, attendee_events.c.attendee_id == Attendee.id)
+                .where(attendee_events.c.event_id == event_id,
+                       Attendee.id.in_(wanted[start:start + REBUILD_BATCH_SIZE]))
+                .order_by(Attendee.id)
+            ).all()
+        if not added:
+            continue
+        payload = dict(card.payload, attendees=card.payload['attendees'] + [
+            {'id': attendee_id, 'first_name': first_name} for attendee_id, first_name in added
+        ])
+        # A card re-rendered since it was read already lists everyone committed before that
+        changed += executor.execute(
+            update(table).where(table.c.event_id == event_id, table.c.version == card.version)
+            .values(payload=payload, version=card.version + 1, updated_at=now)
+        ).rowcount
+    return changed
+
+
+def drop_cards(executor, event_ids):
+    event_ids = list(event_ids)
+    if event_ids:
+        executor.execute(delete(EventCard.__table__).where(EventCard.__table__.c.event_id.in_(event_ids)))
+
+
+def rebuild_all():
+    """Rebuilds every card from the events table. Returns the number of cards."""
+    db.session.execute(delete(EventCard.__table__))
+    event_ids = db.session.execute(select(Event.id)).scalars().all()
+    refresh_cards(db.session, event_ids)
+    db.session.info.pop('event_cards', None)
+    db.session.commit()
+    return len(event_ids)
+
+
+@click.command('rebuild-event-cards')
+def rebuild_event_cards_command():
+    """Rebuild the event_cards read model from scratch."""
+    click.echo(f"Rebuilt {rebuild_all()} event cards.")
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'before_commit', _before_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_event_cards_command)
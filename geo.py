@@ -0,0 +1,312 @@
+# geo.py
+# Proximity search for events.
+#
+# An event's position is its own latitude/longitude, or its venue's when it has none.
+# That position is indexed two ways:
+#   - events.geohash, a base32 geohash kept up to date on every insert/update (all backends)
+#   - event_geo, an SQLite R*Tree of the same points (SQLite only)
+# GET /api/events/nearby prefilters on a bounding box through whichever index the
+# backend has, then refines with an exact haversine distance and sorts by it.
+import math
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, jsonify, request
+from sqlalchemy import bindparam, event, inspect, select, text, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db, Event, Venue
+
+geo_api = Blueprint('geo', __name__)
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_RADIUS_KM = 500
+GEOHASH_PRECISION = 12
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+CREATE_RTREE = "CREATE VIRTUAL TABLE IF NOT EXISTS event_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+# Events are also deleted by ON DELETE CASCADE (with their venue or creator), which no mapper
+# event sees, so the database drops their points itself
+CREATE_RTREE_CLEANUP = (
+    "CREATE TRIGGER IF NOT EXISTS event_geo_cleanup AFTER DELETE ON events "
+    "BEGIN DELETE FROM event_geo WHERE id = OLD.id; END"
+)
+
+# Engines (by URL) on which event_geo is known to exist in this process
+_rtree_ready = set()
+
+
+#-------------------------------#Math--------------------#
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Returns (min_lat, max_lat, lon_ranges) enclosing the circle around a point. lon_ranges
+    is [(min_lon, max_lon)], or two such ranges when the box crosses the 180th meridian
+    (one ending at 180, one starting at -180).
+    """
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, lat - d_lat), min(90.0, lat + d_lat)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]  # the circle covers a pole
+    d_lon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(lat))))
+    west, east = lon - d_lon, lon + d_lon
+    if d_lon >= 180.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    if west < -180.0:
+        return min_lat, max_lat, [(west + 360.0, 180.0), (-180.0, east)]
+    if east > 180.0:
+        return min_lat, max_lat, [(west, 180.0), (-180.0, east - 360.0)]
+    return min_lat, max_lat, [(west, east)]
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bit, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch <<= 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[ch])
+            bit, ch = 0, 0
+    return ''.join(chars)
+
+
+def geohash_decode(geohash):
+    """Returns the centre (lat, lon) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def cell_size_deg(precision):
+    """(height, width) in degrees of a geohash cell at the given precision."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering_prefixes(lat, lon, radius_km):
+    """
+    Geohash prefixes whose cells together cover the circle: the cell containing the
+    point plus its eight neighbours, at the finest precision where a cell is still at
+    least as large as the radius. Neighbours past the 180th meridian wrap to the other side.
+    """
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    precision = 1
+    while precision < GEOHASH_PRECISION:
+        height, width = cell_size_deg(precision + 1)
+        if height < d_lat or width < d_lon:
+            break
+        precision += 1
+    height, width = cell_size_deg(precision)
+    prefixes = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            cell_lat = min(90.0, max(-90.0, lat + dy * height))
+            cell_lon = (lon + dx * width + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(cell_lat, cell_lon, precision))
+    return sorted(prefixes)
+
+
+#-------------------------------#Index maintenance--------------------#
+def _ensure_rtree(connection):
+    key = str(connection.engine.url)
+    if key not in _rtree_ready:
+        connection.execute(text(CREATE_RTREE))
+        connection.execute(text(CREATE_RTREE_CLEANUP))
+        _rtree_ready.add(key)
+
+
+def _write_position(connection, event_id, geohash):
+    """Stores an event's geohash and mirrors its point into the R*Tree on SQLite."""
+    connection.execute(update(Event.__table__).where(Event.__table__.c.id == event_id).values(geohash=geohash))
+    if connection.dialect.name != 'sqlite':
+        return
+    _ensure_rtree(connection)
+    if geohash is None:
+        connection.execute(text("DELETE FROM event_geo WHERE id = :id"), {'id': event_id})
+    else:
+        lat, lon = geohash_decode(geohash)
+        connection.execute(
+            text("INSERT OR REPLACE INTO event_geo (id, min_lat, max_lat, min_lon, max_lon) "
+                 "VALUES (:id, :lat, :lat, :lon, :lon)"),
+            {'id': event_id, 'lat': lat, 'lon': lon},
+        )
+
+
+def _event_geohash(connection, latitude, longitude, venue_id):
+    if latitude is None or longitude is None:
+        if venue_id is None:
+            return None
+        venues = Venue.__table__
+        row = connection.execute(
+            select(venues.c.latitude, venues.c.longitude).where(venues.c.id == venue_id)
+        ).first()
+        if row is None or row.latitude is None or row.longitude is None:
+            return None
+        latitude, longitude = row.latitude, row.longitude
+    return geohash_encode(latitude, longitude)
+
+
+@event.listens_for(Event, 'after_insert')
+@event.listens_for(Event, 'after_update')
+def _index_event(mapper, connection, target):
+    state = inspect(target)
+    if state.has_identity and not any(
+        state.attrs[name].history.has_changes() for name in ('latitude', 'longitude', 'venue_id')
+    ) and target.geohash is not None:
+        return
+    geohash = _event_geohash(connection, target.latitude, target.longitude, target.venue_id)
+    # Set the attribute without dirtying the object; the row is written just below
+    set_committed_value(target, 'geohash', geohash)
+    _write_position(connection, target.id, geohash)
+
+
+@event.listens_for(Venue, 'after_update')
+def _reindex_venue_events(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ('latitude', 'longitude')):
+        return
+    # Only events without their own coordinates follow the venue
+    events = Event.__table__
+    event_ids = connection.execute(
+        select(events.c.id).where(events.c.venue_id == target.id, events.c.latitude.is_(None))
+    ).scalars().all()
+    geohash = None
+    if target.latitude is not None and target.longitude is not None:
+        geohash = geohash_encode(target.latitude, target.longitude)
+    for event_id in event_ids:
+        _write_position(connection, event_id, geohash)
+
+
+def forget_events(connection, event_ids):
+    """Drops R*Tree entries for events removed with set-based statements (which skip mapper events)."""
+    if connection.dialect.name == 'sqlite' and event_ids:
+        _ensure_rtree(connection)
+        connection.execute(text("DELETE FROM event_geo WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+                           {'ids': list(event_ids)})
+
+
+def reindex_all():
+    """Recomputes every event's geohash and rebuilds the R*Tree. Returns the number indexed."""
+    events, venues = Event.__table__, Venue.__table__
+    indexed = 0
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            _ensure_rtree(connection)
+            connection.execute(text("DELETE FROM event_geo"))
+        rows = connection.execute(
+            select(events.c.id, events.c.latitude, events.c.longitude, venues.c.latitude, venues.c.longitude)
+            .select_from(events.outerjoin(venues, events.c.venue_id == venues.c.id))
+        ).all()
+        for event_id, lat, lon, venue_lat, venue_lon in rows:
+            if lat is None or lon is None:
+                lat, lon = venue_lat, venue_lon
+            geohash = geohash_encode(lat, lon) if lat is not None and lon is not None else None
+            _write_position(connection, event_id, geohash)
+            indexed += geohash is not None
+    return indexed
+
+
+#-------------------------------#Routes--------------------#
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+@geo_api.get('/api/events/nearby')
+def nearby_events():
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius = float(request.args.get('radius', 25))
+        date_from = _parse_day(request.args.get('from'))
+        date_to = _parse_day(request.args.get('to'))
+    except KeyError:
+        return jsonify({"error": "lat and lon are required."}), 400
+    except ValueError:
+        return jsonify({"error": "lat, lon and radius must be numbers and from/to YYYY-MM-DD dates."}), 400
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat/lon out of range."}), 400
+    if not (0 < radius <= MAX_RADIUS_KM):
+        return jsonify({"error": f"radius must be between 0 and {MAX_RADIUS_KM} km."}), 400
+
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, radius)
+    query = Event.query
+    if db.engine.dialect.name == 'sqlite':
+        if str(db.engine.url) not in _rtree_ready:
+            with db.engine.begin() as connection:
+                _ensure_rtree(connection)
+        # One longitude range, or two when the box straddles the 180th meridian
+        lon_overlaps = ' OR '.join(
+            f"(min_lon <= :max_lon_{i} AND max_lon >= :min_lon_{i})" for i in range(len(lon_ranges))
+        )
+        candidate_ids = select(text('id')).select_from(text('event_geo')).where(
+            text(f"min_lat <= :max_lat AND max_lat >= :min_lat AND ({lon_overlaps})")
+        )
+        params = {'min_lat': min_lat, 'max_lat': max_lat}
+        for i, (min_lon, max_lon) in enumerate(lon_ranges):
+            params.update({f'min_lon_{i}': min_lon, f'max_lon_{i}': max_lon})
+        query = query.filter(Event.id.in_(candidate_ids)).params(**params)
+    else:
+        prefixes = covering_prefixes(lat, lon, radius)
+        query = query.filter(db.or_(*[Event.geohash.like(prefix + '%') for prefix in prefixes]))
+
+    if date_from:
+        query = query.filter(Event.date >= date_from)
+    if date_to:
+        query = query.filter(Event.date < date_to + timedelta(days=1))
+
+    results = []
+    for candidate in query.all():
+        if candidate.geohash is None:
+            continue
+        event_lat, event_lon = geohash_decode(candidate.geohash)
+        if not (min_lat <= event_lat <= max_lat and any(west <= event_lon <= east for west, east in lon_ranges)):
+            continue
+        distance = haversine_km(lat, lon, event_lat, event_lon)
+        if distance <= radius:
+            results.append((distance, candidate))
+
+    results.sort(key=lambda pair: pair[0])
+    return jsonify([
+        {**candidate.to_dict(), 'distance_km': round(distance, 3)}
+        for distance, candidate in results
+    ]), 200
+
+
+@click.command('geo-reindex')
+def geo_reindex_command():
+    """Rebuild event geohashes and the SQLite R*Tree."""
+    click.echo(f"Indexed {reindex_all()} events.")
+
+
+def init_app(app):
+    app.register_blueprint(geo_api)
+    app.cli.add_command(geo_reindex_command)
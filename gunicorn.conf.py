@@ -0,0 +1,29 @@
+# gunicorn.conf.py
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:' + os.getenv('PORT', '5001'))
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Threaded workers, so long-polls and event streams (changes.py) wait on spare threads
+# instead of blocking a whole worker; -k on the command line still overrides this
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# A worker that stops answering the master this long is killed (a sync worker, as soon as
+# one request takes this long)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+
+# Import the app once in the master so workers boot by fork instead of re-importing
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the GC's generations, so collections in
+    # the workers don't touch (and copy) the pages shared with the master
+    gc.freeze()
+    # No threads are started here: a fork taken while one of them holds a lock leaves the
+    # worker waiting on it forever. Periodic jobs run as their own processes (flask
+    # archive-events --interval, flask sqlite-maintenance --interval, flask outbox-worker).
+
+
+# Pooled connections inherited from the master are dropped in each worker by the
+# os.register_at_fork hook installed in create_app(), for WSGI and ASGI entry points alike.
@@ -0,0 +1,188 @@
+# idempotency.py
+# Idempotency-Key support for POST endpoints that clients retry on timeouts.
+#
+# The first request with a given key claims it and runs normally; its response is then
+# stored. A retry with the same key (from the same account) gets that stored response
+# back, marked `Idempotent-Replayed: true`, without running the view again. A retry that
+# arrives while the first attempt is still running gets 409; reusing a key for a
+# different request body gets 422. Server errors (5xx) are not stored, so those can be
+# retried for real.
+#
+# Configuration (all optional):
+#   IDEMPOTENCY_ENABLED           False turns it off
+#   IDEMPOTENCY_ENDPOINTS         endpoints honouring the header (default: see IDEMPOTENT_ENDPOINTS)
+#   IDEMPOTENCY_TTL_SECONDS       how long a stored response can be replayed (default 24 hours)
+#   IDEMPOTENCY_LOCK_SECONDS      after this long an unfinished attempt is presumed dead
+#                                 and its key may be claimed again (default 60)
+#   IDEMPOTENCY_SWEEP_SECONDS     how often each worker deletes expired keys (default 300)
+#
+#   flask sweep-idempotency-keys  deletes expired keys on demand (e.g. from cron)
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, jsonify, request, session
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+IDEMPOTENT_ENDPOINTS = (
+    'api.create_event',
+    'api.create_attendee',
+    'api.create_artist',
+    'api.create_tour',
+    'api.rate_venue',
+)
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKey(db.Model):
+    """A claimed key. status_code stays NULL until the first attempt's response is stored."""
+    __tablename__ = 'idempotency_keys'
+    # sha256 of (account, key), so rows stay fixed-size whatever the clients send
+    key_hash = db.Column(db.LargeBinary(32), primary_key=True)
+    fingerprint = db.Column(db.LargeBinary(32), nullable=False)
+    status_code = db.Column(db.SmallInteger)
+    content_type = db.Column(db.String(100))
+    body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.digest()
+
+
+def _scope():
+    # Keys are per account; anonymous clients share one namespace (the fingerprint
+    # check still keeps one client's key from replaying another's different request)
+    return f"user:{session.get('user_id')}" if session.get('user_id') else 'anonymous'
+
+
+def _claim(key_hash, fingerprint, now):
+    """
+    Claims the key for this request. Returns None when the view should run, otherwise
+    the stored row (finished or still in progress).
+    """
+    config = current_app.config
+    keys = IdempotencyKey.__table__
+    values = {
+        'key_hash': key_hash, 'fingerprint': fingerprint, 'created_at': now,
+        'expires_at': now + timedelta(seconds=config['IDEMPOTENCY_TTL_SECONDS']),
+    }
+    with db.engine.begin() as connection:
+        try:
+            connection.execute(insert(keys).values(**values))
+            return None
+        except IntegrityError:
+            pass
+    with db.engine.begin() as connection:
+        row = connection.execute(select(keys).where(keys.c.key_hash == key_hash)).first()
+        if row is None:
+            return None  # swept in between; run without replay protection
+        stale = now - timedelta(seconds=config['IDEMPOTENCY_LOCK_SECONDS'])
+        abandoned = row.status_code is None and row.created_at < stale
+        if row.expires_at < now or abandoned:
+            # Take the key over, unless another retry got there first
+            taken = connection.execute(
+                update(keys).where(keys.c.key_hash == key_hash, keys.c.created_at == row.created_at)
+                .values(status_code=None, content_type=None, body=None, **values)
+            ).rowcount
+            return None if taken else row
+        return row
+
+
+def _release(key_hash):
+    with db.engine.begin() as connection:
+        connection.execute(delete(IdempotencyKey.__table__).where(IdempotencyKey.__table__.c.key_hash == key_hash))
+
+
+def sweep_expired(now=None):
+    """Deletes keys past their TTL. Returns the number deleted."""
+    keys = IdempotencyKey.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(delete(keys).where(keys.c.expires_at < (now or datetime.utcnow()))).rowcount
+
+
+@click.command('sweep-idempotency-keys')
+def sweep_idempotency_keys_command():
+    """Delete expired idempotency keys."""
+    click.echo(f"Deleted {sweep_expired()} expired idempotency keys.")
+
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_ENABLED', os.getenv('IDEMPOTENCY_ENABLED', 'true').lower() != 'false')
+    app.config.setdefault('IDEMPOTENCY_ENDPOINTS', IDEMPOTENT_ENDPOINTS)
+    app.config.setdefault('IDEMPOTENCY_TTL_SECONDS', int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600))))
+    app.config.setdefault('IDEMPOTENCY_LOCK_SECONDS', 60)
+    app.config.setdefault('IDEMPOTENCY_SWEEP_SECONDS', 300)
+    app.cli.add_command(sweep_idempotency_keys_command)
+
+    if not app.config['IDEMPOTENCY_ENABLED']:
+        return
+
+    endpoints = frozenset(app.config['IDEMPOTENCY_ENDPOINTS'])
+    last_sweep = [time.monotonic()]
+
+    @app.before_request
+    def replay_idempotent():
+        key = request.headers.get('Idempotency-Key')
+        if key is None or request.method != 'POST' or request.endpoint not in endpoints:
+            return None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters."}), 400
+
+        now = datetime.utcnow()
+        if time.monotonic() - last_sweep[0] > app.config['IDEMPOTENCY_SWEEP_SECONDS']:
+            last_sweep[0] = time.monotonic()
+            sweep_expired(now)
+
+        key_hash = _digest(_scope(), key)
+        fingerprint = _digest(request.method, request.path, request.get_data())
+        row = _claim(key_hash, fingerprint, now)
+        if row is None:
+            g.idempotency_key = key_hash
+            return None
+        if row.fingerprint != fingerprint:
+            return jsonify({"error": "Idempotency-Key was already used for a different request."}), 422
+        if row.status_code is None:
+            response = jsonify({"error": "A request with this Idempotency-Key is still in progress."})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+
+        response = current_app.response_class(row.body, status=row.status_code, content_type=row.content_type)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    # Registered after compression, so this sees (and stores) the uncompressed body
+    @app.after_request
+    def store_idempotent(response):
+        key_hash = g.pop('idempotency_key', None)
+        if key_hash is None:
+            return response
+        if response.status_code >= 500:
+            _release(key_hash)
+            return response
+        keys = IdempotencyKey.__table__
+        with db.engine.begin() as connection:
+            connection.execute(update(keys).where(keys.c.key_hash == key_hash).values(
+                status_code=response.status_code,
+                content_type=response.content_type,
+                body=response.get_data(),
+            ))
+        return response
+
+    @app.teardown_request
+    def release_idempotent(exception=None):
+        # Only still set when the view raised before after_request ran
+        key_hash = g.pop('idempotency_key', None)
+        if key_hash is not None:
+            _release(key_hash)
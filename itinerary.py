@@ -0,0 +1,297 @@
+# itinerary.py
+# A tour's events as a dated itinerary, with stats derived from it.
+#
+#   GET /api/tours/<id>/itinerary
+#   -> {"tour": {"id": 1, "name": "...", "start_date": "06/01/2030", "end_date": "06/30/2030"},
+#       "events": [{"id": 4, "name": "...", "date": "...", "time": "20:00", "location": "Austin",
+#                   "event_type": "Rock", "venue": {"id": 2, "name": "..."},
+#                   "artists": [{"id": 7, "name": "..."}]}, ...],
+#       "stats": {"event_count": 12, "city_count": 9, "cities": [...], "first_date": "06/02/2030",
+#                 "last_date": "06/28/2030", "span_days": 27,
+#                 "gaps": [{"from": "06/05/2030", "to": "06/09/2030", "days_off": 3}, ...],
+#                 "longest_gap_days": 3, "outside_tour": [15]}}
+#
+# Events come sorted by date and time from one query: tours left-joined to tour_events,
+# events, venues and the lineup. Cities are events' locations, case and spacing folded.
+# gaps are the runs of days without a show between two show days; outside_tour lists
+# events dated outside the tour's start and end dates.
+#
+# Itineraries are cached per worker and dropped after any commit that changes the tour,
+# its event list, or one of its events (or a venue or artist they show); other workers'
+# changes show up within ITINERARY_CACHE_SECONDS (default 300). Events deleted elsewhere
+# (by another worker, or by `flask archive-events`) empty the cache sooner: requests read
+# the event deletes in the change log at most every ITINERARY_SYNC_SECONDS (default 5).
+#
+# Tour create/edit calls events_outside() to reject, in a single query, event lists or new
+# start/end dates that would leave events outside the tour.
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import event, inspect, select
+
+from app import db, Artist, Event, Tour, User, Venue, artist_events, tour_events
+import changes
+
+itinerary_api = Blueprint('itinerary', __name__)
+
+CACHE_MAX_ENTRIES = 1024
+DATE_FORMAT = '%m/%d/%Y'
+# Event attributes an itinerary shows or is derived from
+TRACKED_FIELDS = ('name', 'date', 'time', 'location', 'event_type', 'venue_id', 'artists', 'tours')
+
+
+class ItineraryCache:
+    """Itineraries by tour id, each kept for ttl seconds; least recently stored evicted first."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.generation = 0       # bumped by every invalidation
+        self.change_seq = None    # change log position deletes have been read up to
+        self.synced_at = -math.inf
+
+    def get(self, tour_id):
+        with self._lock:
+            hit = self._entries.get(tour_id)
+        return hit[1] if hit is not None and hit[0] > time.monotonic() else None
+
+    def put(self, tour_id, itinerary, ttl, generation):
+        """Stores an itinerary built at `generation`, unless a commit has invalidated since."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[tour_id] = (time.monotonic() + ttl, itinerary)
+            self._entries.move_to_end(tour_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tour_ids):
+        with self._lock:
+            self.generation += 1
+            for tour_id in tour_ids:
+                self._entries.pop(tour_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def sync(self, interval):
+        """
+        Clears the cache when the change log shows events deleted since the last look; their
+        tour links are gone with them, so there is no telling which tours they were on.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not interval or now - self.synced_at < interval:
+                return
+            self.synced_at = now
+            since = self.change_seq
+        keys, change_seq = changes.deleted_since('events', since)
+        if keys or (keys is None and since is not None):
+            self.clear()
+        with self._lock:
+            self.change_seq = max(change_seq, self.change_seq or 0)
+
+
+#-------------------------------#Itinerary--------------------#
+def _city(location):
+    return ' '.join((location or '').split()).casefold()
+
+
+def itinerary_stats(tour_start, tour_end, events):
+    """Stats for events already sorted by date."""
+    days = sorted({event['date'].date() for event in events})
+    cities = {}
+    for event in events:
+        cities.setdefault(_city(event['location']), ' '.join(event['location'].split()))
+    cities.pop('', None)
+    gaps = [
+        {'from': earlier.strftime(DATE_FORMAT), 'to': later.strftime(DATE_FORMAT), 'days_off': (later - earlier).days - 1}
+        for earlier, later in zip(days, days[1:]) if (later - earlier).days > 1
+    ]
+    return {
+        'event_count': len(events),
+        'city_count': len(cities),
+        'cities': sorted(cities.values()),
+        'first_date': days[0].strftime(DATE_FORMAT) if days else None,
+        'last_date': days[-1].strftime(DATE_FORMAT) if days else None,
+        'span_days': (days[-1] - days[0]).days + 1 if days else 0,
+        'gaps': gaps,
+        'longest_gap_days': max((gap['days_off'] for gap in gaps), default=0),
+        'outside_tour': [
+            event['id'] for event in events if not tour_start <= event['date'].date() <= tour_end
+        ],
+    }
+
+
+def build_itinerary(tour_id):
+    """The tour's itinerary from one joined query, or None if there is no such tour."""
+    rows = db.session.execute(
+        select(
+            Tour.id, Tour.name, Tour.start_date, Tour.end_date,
+            Event.id, Event.name, Event.date, Event.time, Event.location, Event.event_type,
+            Venue.id, Venue.name, Artist.id, Artist.name,
+        )
+        .select_from(Tour)
+        .outerjoin(tour_events, tour_events.c.tour_id == Tour.id)
+        .outerjoin(Event, Event.id == tour_events.c.event_id)
+        .outerjoin(Venue, Venue.id == Event.venue_id)
+        .outerjoin(artist_events, artist_events.c.event_id == Event.id)
+        .outerjoin(Artist, Artist.id == artist_events.c.artist_id)
+        .where(Tour.id == tour_id)
+        .order_by(Event.date, Event.time, Event.id, Artist.name)
+    ).all()
+    if not rows:
+        return None
+
+    _, name, start_date, end_date = rows[0][:4]
+    events = OrderedDict()
+    for row in rows:
+        event_id = row[4]
+        if event_id is None:
+            continue
+        listed = events.get(event_id)
+        if listed is None:
+            listed = events[event_id] = {
+                'id': event_id, 'name': row[5], 'date': row[6], 'time': row[7],
+                'location': row[8], 'event_type': row[9],
+                'venue': {'id': row[10], 'name': row[11]} if row[10] is not None else None,
+                'artists': [],
+            }
+        if row[12] is not None:
+            listed['artists'].append({'id': row[12], 'name': row[13]})
+    events = list(events.values())
+    return {
+        'tour': {
+            'id': tour_id, 'name': name,
+            'start_date': start_date.strftime(DATE_FORMAT), 'end_date': end_date.strftime(DATE_FORMAT),
+        },
+        'events': events,
+        'stats': itinerary_stats(start_date, end_date, events),
+    }
+
+
+def events_outside(start_date, end_date, event_ids=None, tour_id=None):
+    """
+    [(id, name, date)] of the events dated outside the dates start_date..end_date, among
+    `event_ids`, or else among the events of tour `tour_id`. One query either way.
+    """
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+    query = select(Event.id, Event.name, Event.date).where((Event.date < start) | (Event.date >= end))
+    if event_ids is not None:
+        query = query.where(Event.id.in_(event_ids))
+    else:
+        query = query.where(Event.id.in_(select(tour_events.c.event_id).where(tour_events.c.tour_id == tour_id)))
+    return db.session.execute(query.order_by(Event.date)).all()
+
+
+def outside_error(start_date, end_date, outside):
+    """The 400 response for events that don't fit the tour's dates."""
+    return jsonify({
+        "error": f"Events must fall between the tour's start and end dates "
+                 f"({start_date.strftime(DATE_FORMAT)} - {end_date.strftime(DATE_FORMAT)}).",
+        "events_outside_tour": [
+            {'id': id_, 'name': name, 'date': date.strftime(DATE_FORMAT)} for id_, name, date in outside
+        ],
+    }), 400
+
+
+#-------------------------------#Invalidation--------------------#
+def _pending(session):
+    return session.info.setdefault('itinerary', set())
+
+
+def _tours_of(session, event_id):
+    return session.execute(select(tour_events.c.tour_id).where(tour_events.c.event_id == event_id)).scalars().all()
+
+
+def _history_ids(obj, name):
+    history = inspect(obj).attrs[name].history
+    return {related.id for related in (*history.added, *history.deleted) if related.id is not None}
+
+
+def _changed(obj, names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _before_flush(session, flush_context, instances):
+    # Tour memberships have to be read while the association rows still exist
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Event):
+                _pending(session).update(_history_ids(obj, 'tours'))
+            elif isinstance(obj, Artist) and _history_ids(obj, 'events'):
+                session.info['itinerary_all'] = True
+        for obj in session.dirty:
+            # Other models (AttendeeVenue, say) may not even have an id
+            if not isinstance(obj, (Tour, Event, Venue, Artist)) or obj.id is None:
+                continue
+            if isinstance(obj, Tour) and session.is_modified(obj):
+                _pending(session).add(obj.id)
+            elif isinstance(obj, Event) and _changed(obj, TRACKED_FIELDS):
+                _pending(session).update(_tours_of(session, obj.id))
+                _pending(session).update(_history_ids(obj, 'tours'))
+            elif isinstance(obj, (Venue, Artist)) and _changed(obj, ('name',)):
+                session.info['itinerary_all'] = True
+            elif isinstance(obj, Artist) and _history_ids(obj, 'events'):
+                session.info['itinerary_all'] = True
+        for obj in session.deleted:
+            if isinstance(obj, Tour):
+                _pending(session).add(obj.id)
+            elif isinstance(obj, Event):
+                _pending(session).update(_tours_of(session, obj.id))
+            elif isinstance(obj, (Venue, Artist, User)):
+                # Their events (or lineup rows) go with them by ON DELETE CASCADE
+                session.info['itinerary_all'] = True
+
+
+def _after_commit(session):
+    clear_all = session.info.pop('itinerary_all', None)
+    tour_ids = session.info.pop('itinerary', None)
+    cache = current_app.extensions.get('itinerary') if clear_all or tour_ids else None
+    if cache is None:
+        return
+    if clear_all:
+        cache.clear()
+    else:
+        cache.invalidate(tour_ids)
+
+
+def _forget(session, *args):
+    session.info.pop('itinerary', None)
+    session.info.pop('itinerary_all', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+#-------------------------------#Routes--------------------#
+@itinerary_api.get('/api/tours/<int:id>/itinerary')
+def get_itinerary(id):
+    cache = current_app.extensions['itinerary']
+    cache.sync(current_app.config['ITINERARY_SYNC_SECONDS'])
+    itinerary = cache.get(id)
+    if itinerary is None:
+        generation = cache.generation
+        itinerary = build_itinerary(id)
+        if itinerary is None:
+            return jsonify({"error": "Tour not found"}), 404
+        cache.put(id, itinerary, current_app.config['ITINERARY_CACHE_SECONDS'], generation)
+    return jsonify(itinerary), 200
+
+
+def init_app(app):
+    app.config.setdefault('ITINERARY_CACHE_SECONDS', 300)
+    app.config.setdefault('ITINERARY_SYNC_SECONDS', 5)
+    app.extensions['itinerary'] = ItineraryCache()
+    app.register_blueprint(itinerary_api)
@@ -0,0 +1,278 @@
+# outbox.py
+# Tells attendees when a show they attend or favorited is rescheduled or cancelled.
+#
+# Nothing is sent inline. When a flush changes an event's date or time, or deletes an event
+# (directly, or with its venue or creator), one notification_outbox row per recipient is
+# written by a single INSERT ... SELECT inside the same transaction, so notifications exist
+# exactly when the change commits. A worker then drains the outbox in batches:
+#   - rows are grouped per attendee, so each attendee gets one delivery per batch
+#   - several pending changes to the same event coalesce into the latest one, and the
+#     older rows are marked coalesced once that delivery succeeds
+#   - a failed delivery is retried with exponential backoff, up to OUTBOX_MAX_ATTEMPTS; all
+#     of the attendee's rows in it are retried together, so they coalesce again
+#
+#   flask outbox-worker [--once] [--batch-size 500] [--interval 5]
+#
+# runs as its own process, next to the web server; --interval defaults to
+# OUTBOX_INTERVAL_SECONDS (5).
+#
+# Deliveries go to a sink chosen by OUTBOX_SINK:
+#   'log'                   the app logger (default)
+#   'file:/path/out.jsonl'  one JSON line per delivery, for testing
+#   'package.module:Class'  any class taking the app and providing send(delivery)
+import importlib
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import event, inspect, insert, literal, select, union, update
+
+from app import db, cascaded_rows, Event, attendee_events, attendee_favorites
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = 'notification_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    attendee_id = db.Column(db.Integer, nullable=False)
+    event_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)        # 'rescheduled' or 'cancelled'
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sent, coalesced, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_notification_outbox_pending', 'status', 'available_at'),
+    )
+
+
+#-------------------------------#Capture--------------------#
+def _fmt(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def enqueue(session, kind, changes):
+    """
+    Writes one outbox row per (recipient, event) for `changes`, {event_id: payload}.
+    Recipients are the event's attendees and the attendees who favorited it.
+    """
+    outbox = OutboxMessage.__table__
+    now = datetime.utcnow()
+    for event_id, payload in changes.items():
+        recipients = union(
+            select(attendee_events.c.attendee_id).where(attendee_events.c.event_id == event_id),
+            select(attendee_favorites.c.attendee_id).where(attendee_favorites.c.event_id == event_id),
+        ).subquery()
+        session.execute(insert(outbox).from_select(
+            ['attendee_id', 'event_id', 'kind', 'payload', 'status', 'attempts', 'created_at', 'available_at'],
+            select(
+                recipients.c.attendee_id, literal(event_id), literal(kind), literal(payload, type_=db.JSON),
+                literal('pending'), literal(0), literal(now), literal(now),
+            ),
+        ))
+
+
+def _before_flush(session, flush_context, instances):
+    rescheduled, cancelled = {}, {}
+    with session.no_autoflush:
+        for obj in session.dirty:
+            if not isinstance(obj, Event):
+                continue
+            state = inspect(obj)
+            date, time_ = state.attrs.date.history, state.attrs.time.history
+            if not (date.has_changes() or time_.has_changes()):
+                continue
+            rescheduled[obj.id] = {
+                'event_id': obj.id, 'event_name': obj.name,
+                'date': _fmt(obj.date), 'time': obj.time,
+                'previous_date': _fmt(date.deleted[0]) if date.deleted else _fmt(obj.date),
+                'previous_time': time_.deleted[0] if time_.deleted else obj.time,
+            }
+
+        # Deleted events, and those ON DELETE CASCADE takes with a deleted venue or user
+        events = [obj for obj in session.deleted if isinstance(obj, Event)]
+        events += cascaded_rows(session, flush_context).get(Event, [])
+        cancelled = {
+            row.id: {'event_id': row.id, 'event_name': row.name, 'date': _fmt(row.date), 'time': row.time}
+            for row in events
+        }
+
+        if rescheduled:
+            enqueue(session, 'rescheduled', {k: v for k, v in rescheduled.items() if k not in cancelled})
+        if cancelled:
+            enqueue(session, 'cancelled', cancelled)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+
+
+#-------------------------------#Sinks--------------------#
+class LogSink:
+    def __init__(self, app):
+        self.logger = app.logger
+
+    def send(self, delivery):
+        self.logger.info("Notify attendee %s: %s", delivery['attendee_id'], json.dumps(delivery['notifications']))
+
+
+class FileSink:
+    """Appends one JSON line per delivery."""
+
+    def __init__(self, app, path):
+        self.path = path
+
+    def send(self, delivery):
+        with open(self.path, 'a', encoding='utf-8') as out:
+            out.write(json.dumps(delivery) + '\n')
+
+
+def make_sink(app, spec):
+    if spec == 'log':
+        return LogSink(app)
+    if spec.startswith('file:'):
+        return FileSink(app, spec[len('file:'):])
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)(app)
+
+
+#-------------------------------#Worker--------------------#
+def _retry_at(now, attempts):
+    return now + timedelta(seconds=current_app.config['OUTBOX_RETRY_SECONDS'] * 2 ** (attempts - 1))
+
+
+def deliver_batch(sink, batch_size=None):
+    """
+    Delivers up to batch_size due outbox rows. Returns counts:
+    {'rows', 'attendees', 'sent', 'coalesced', 'retrying', 'failed'}.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['OUTBOX_BATCH_SIZE']
+    outbox = OutboxMessage.__table__
+    now = datetime.utcnow()
+    stats = dict.fromkeys(('rows', 'attendees', 'sent', 'coalesced', 'retrying', 'failed'), 0)
+
+    with db.engine.begin() as connection:
+        # SKIP LOCKED lets several workers share a PostgreSQL outbox; SQLite ignores it
+        rows = connection.execute(
+            select(outbox).where(outbox.c.status == 'pending', outbox.c.available_at <= now)
+            .order_by(outbox.c.id).limit(batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            return stats
+        stats['rows'] = len(rows)
+
+        # Per attendee, keep only the latest change to each event
+        latest, earliest = defaultdict(dict), defaultdict(dict)
+        superseded = defaultdict(list)
+        for row in rows:
+            previous = latest[row.attendee_id].get(row.event_id)
+            if previous is not None:
+                superseded[row.attendee_id].append(previous)
+            latest[row.attendee_id][row.event_id] = row
+            earliest[row.attendee_id].setdefault(row.event_id, row)
+        stats['attendees'] = len(latest)
+
+        sent, coalesced, retry, failed = [], [], [], []
+        for attendee_id, by_event in latest.items():
+            messages = sorted(by_event.values(), key=lambda row: row.id)
+            notifications = []
+            for row in messages:
+                notification = {'kind': row.kind, **row.payload}
+                first = earliest[attendee_id][row.event_id]
+                if row.kind == 'rescheduled' and first.kind == 'rescheduled':
+                    # Coalesced reschedules read "moved from <where it was first> to <where it is now>"
+                    notification.update(previous_date=first.payload['previous_date'],
+                                        previous_time=first.payload['previous_time'])
+                notifications.append(notification)
+            delivery = {'attendee_id': attendee_id, 'notifications': notifications}
+            try:
+                sink.send(delivery)
+                sent += [row.id for row in messages]
+                coalesced += [row.id for row in superseded[attendee_id]]
+            except Exception as exception:
+                current_app.logger.warning("Notification to attendee %s failed: %s", attendee_id, exception)
+                # Superseded rows wait with the rest, on one schedule, so nothing stale goes out alone
+                group = messages + superseded[attendee_id]
+                attempts = max(row.attempts for row in group) + 1
+                (failed if attempts >= config['OUTBOX_MAX_ATTEMPTS'] else retry).append(
+                    ([row.id for row in group], attempts, str(exception))
+                )
+
+        if coalesced:
+            connection.execute(update(outbox).where(outbox.c.id.in_(coalesced)).values(status='coalesced', processed_at=now))
+        if sent:
+            connection.execute(update(outbox).where(outbox.c.id.in_(sent)).values(status='sent', processed_at=now))
+        for ids, attempts, error in retry:
+            connection.execute(update(outbox).where(outbox.c.id.in_(ids)).values(
+                attempts=attempts, last_error=error, available_at=_retry_at(now, attempts),
+            ))
+        for ids, attempts, error in failed:
+            connection.execute(update(outbox).where(outbox.c.id.in_(ids)).values(
+                status='failed', attempts=attempts, last_error=error, processed_at=now,
+            ))
+
+    stats.update(sent=len(sent), coalesced=len(coalesced),
+                 retrying=sum(len(ids) for ids, _, _ in retry), failed=sum(len(ids) for ids, _, _ in failed))
+    return stats
+
+
+def drain(sink, batch_size=None):
+    """Delivers batches until nothing is due. Returns the summed counts and the seconds taken."""
+    started = time.perf_counter()
+    totals = defaultdict(int)
+    while True:
+        stats = deliver_batch(sink, batch_size)
+        for key, value in stats.items():
+            totals[key] += value
+        if stats['rows'] < (batch_size or current_app.config['OUTBOX_BATCH_SIZE']):
+            break
+    return dict(totals), time.perf_counter() - started
+
+
+def describe(totals, elapsed):
+    rate = totals.get('rows', 0) / elapsed if elapsed else 0
+    return (f"{totals.get('rows', 0)} notifications ({rate:.0f}/s): {totals.get('sent', 0)} sent to "
+            f"{totals.get('attendees', 0)} attendees, {totals.get('coalesced', 0)} coalesced, "
+            f"{totals.get('retrying', 0)} retrying, {totals.get('failed', 0)} failed in {elapsed:.2f}s")
+
+
+@click.command('outbox-worker')
+@click.option('--once', is_flag=True, help="Drain what is due and exit.")
+@click.option('--batch-size', type=int, default=None, help="Outbox rows per batch.")
+@click.option('--interval', type=float, default=None, help="Seconds between polls (default OUTBOX_INTERVAL_SECONDS).")
+def outbox_worker_command(once, batch_size, interval):
+    """Deliver pending attendee notifications."""
+    interval = interval if interval is not None else current_app.config['OUTBOX_INTERVAL_SECONDS']
+    sink = make_sink(current_app, current_app.config['OUTBOX_SINK'])
+    while True:
+        try:
+            totals, elapsed = drain(sink, batch_size)
+        except Exception:
+            if once:
+                raise
+            # Rows of a failed batch stay pending; the next poll picks them up again
+            current_app.logger.exception("Outbox delivery failed")
+            totals, elapsed = {}, 0
+        if totals.get('rows') or once:
+            click.echo(describe(totals, elapsed))
+        if once:
+            return
+        time.sleep(interval)
+
+
+def init_app(app):
+    app.config.setdefault('OUTBOX_SINK', os.getenv('OUTBOX_SINK', 'log'))
+    app.config.setdefault('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    app.config.setdefault('OUTBOX_MAX_ATTEMPTS', 8)
+    app.config.setdefault('OUTBOX_RETRY_SECONDS', 30)
+    app.config.setdefault('OUTBOX_INTERVAL_SECONDS', float(os.getenv('OUTBOX_INTERVAL_SECONDS', '5')))
+    app.cli.add_command(outbox_worker_command)
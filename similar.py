@@ -0,0 +1,344 @@
+# similar.py
+# "You might also like": events similar to a given one, answered from memory.
+#
+#   GET /api/events/<id>/similar?k=5
+#   -> [{"id": 9, "name": "...", "date": "...", "event_type": "Jazz", "score": 0.61}, ...]
+#
+# Every live event is a sparse vector of three blocks, each L2-normalized and weighted by
+# SIMILAR_WEIGHTS before the whole vector is normalized again:
+#   text      TF-IDF of the description (sublinear tf, smoothed idf, stop words dropped)
+#   type      one-hot event_type
+#   artists   one-hot artist ids of the lineup
+# An inverted index (feature -> {event id: weight}) gives the cosine similarity of one
+# event to all others by walking only the postings of its own features; the top k come
+# from a heap. No query touches the database.
+#
+# The vectors are built in one pass when the app is created (two queries: events and
+# lineups) and re-computed after each commit that creates, edits or deletes an event or
+# changes a lineup. Document frequencies are updated as events change, but other events
+# keep the idf they were weighted with until the full rebuild every
+# SIMILAR_REBUILD_SECONDS (default 3600), which also picks up other processes' changes.
+# Events deleted elsewhere (by another worker, or by `flask archive-events`) are dropped
+# sooner: lookups read the event deletes in the change log at most every
+# SIMILAR_SYNC_SECONDS (default 5).
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import event, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, cascaded_rows, Artist, Event, artist_events
+import changes
+
+similar_api = Blueprint('similar', __name__)
+
+DEFAULT_WEIGHTS = {'text': 1.0, 'type': 0.5, 'artists': 0.8}
+MAX_K = 50
+# Fields whose change alters an event's vector or how it is listed
+TRACKED_FIELDS = ('name', 'date', 'description', 'event_type')
+STOP_WORDS = frozenset("""
+    a an and are as at be by for from has have in is it its of on or our that the this to
+    was were will with you your we us all any come join night event events show
+""".split())
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall((text or '').lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+#-------------------------------#Index--------------------#
+class SimilarityIndex:
+    """Per-event sparse vectors plus the inverted index over their features."""
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.terms = {}                      # event id -> Counter of description terms
+        self.features = {}                   # event id -> (event_type, frozenset of artist ids)
+        self.listing = {}                    # event id -> fields returned to clients
+        self.df = Counter()                  # term -> number of events using it
+        self.vectors = {}                    # event id -> {feature: weight}
+        self.postings = defaultdict(dict)    # feature -> {event id: weight}
+
+    @classmethod
+    def build(cls, weights, rows, lineups):
+        index = cls(weights)
+        for row in rows:
+            index._store(row, lineups.get(row.id, ()))
+        for event_id in index.terms:
+            index._index(event_id)
+        return index
+
+    def _store(self, row, artist_ids):
+        terms = Counter(tokenize(row.description))
+        self.terms[row.id] = terms
+        self.df.update(terms.keys())
+        self.features[row.id] = (row.event_type, frozenset(artist_ids))
+        self.listing[row.id] = {
+            'id': row.id, 'name': row.name, 'date': row.date, 'event_type': row.event_type,
+        }
+
+    def _vector(self, event_id):
+        total = len(self.terms) or 1
+        text = {
+            ('term', term): (1 + math.log(count)) * (math.log((1 + total) / (1 + self.df[term])) + 1)
+            for term, count in self.terms[event_id].items()
+        }
+        event_type, artist_ids = self.features[event_id]
+        blocks = (
+            ('text', text),
+            ('type', {('type', event_type): 1.0} if event_type else {}),
+            ('artists', {('artist', artist_id): 1.0 for artist_id in artist_ids}),
+        )
+        vector = {}
+        for name, block in blocks:
+            norm = math.sqrt(sum(weight * weight for weight in block.values()))
+            for feature, weight in block.items():
+                vector[feature] = self.weights[name] * weight / norm
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {feature: weight / norm for feature, weight in vector.items()} if norm else {}
+
+    def _index(self, event_id):
+        vector = self.vectors[event_id] = self._vector(event_id)
+        for feature, weight in vector.items():
+            self.postings[feature][event_id] = weight
+
+    def remove(self, event_id):
+        for feature in self.vectors.pop(event_id, {}):
+            posting = self.postings[feature]
+            posting.pop(event_id, None)
+            if not posting:
+                del self.postings[feature]
+        for term in self.terms.pop(event_id, {}):
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+        self.features.pop(event_id, None)
+        self.listing.pop(event_id, None)
+
+    def upsert(self, row, artist_ids):
+        self.remove(row.id)
+        self._store(row, artist_ids)
+        self._index(row.id)
+
+    def similar(self, event_id, k):
+        """Up to k (score, event id) pairs, most similar first; None if the event isn't indexed."""
+        vector = self.vectors.get(event_id)
+        if vector is None:
+            return None
+        scores = defaultdict(float)
+        for feature, weight in vector.items():
+            for other, other_weight in self.postings[feature].items():
+                scores[other] += weight * other_weight
+        scores.pop(event_id, None)
+        return nlargest(k, ((score, other) for other, score in scores.items()))
+
+
+def _read_events(executor, event_ids=None):
+    """(event rows, {event id: [artist ids]}) for the given live events, or all of them."""
+    events = select(Event.id, Event.name, Event.date, Event.description, Event.event_type)
+    lineups = select(artist_events.c.event_id, artist_events.c.artist_id)
+    if event_ids is not None:
+        events = events.where(Event.id.in_(event_ids))
+        lineups = lineups.where(artist_events.c.event_id.in_(event_ids))
+    by_event = defaultdict(list)
+    for event_id, artist_id in executor.execute(lineups):
+        by_event[event_id].append(artist_id)
+    return executor.execute(events).all(), by_event
+
+
+class Recommender:
+    """The per-app SimilarityIndex, with build bookkeeping (see autocomplete.Autocomplete)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.index = None
+        self.built_at = None
+        self._lock = threading.Lock()         # guards the index: patches, swaps and lookups
+        self._building = threading.Lock()     # one rebuild at a time
+        self._missed = None                   # patches applied while a rebuild was reading
+        self._syncing = threading.Lock()      # one change-log read at a time
+        self.change_seq = None                # change log position the index has caught up to
+        self.synced_at = -math.inf
+
+    def build(self, max_age=None):
+        with self._building:
+            if max_age is not None and self.built_at is not None and time.monotonic() - self.built_at < max_age:
+                return
+            with self._lock:
+                self._missed = []
+            try:
+                started = time.perf_counter()
+                with self.app.app_context():
+                    # Deletes logged after this are applied by sync() even if the rows below miss them
+                    _, change_seq = changes.deleted_since('events', None)
+                    rows, lineups = _read_events(db.session)
+                index = SimilarityIndex.build(self.app.config['SIMILAR_WEIGHTS'], rows, lineups)
+                with self._lock:
+                    # Patches committed after the rows above were read would otherwise be lost
+                    for patch in self._missed:
+                        _patch(index, *patch)
+                    self.index = index
+                    self.built_at = time.monotonic()
+                    self.change_seq = change_seq
+            finally:
+                with self._lock:
+                    self._missed = None
+        self.app.logger.info("Similar-events index built in %.1f ms: %d events, %d features",
+                             (time.perf_counter() - started) * 1000, len(index.vectors), len(index.postings))
+
+    def ensure_current(self):
+        if self.index is None:
+            # Concurrent first lookups wait for one build instead of each running their own
+            self.build(max_age=math.inf)
+            return
+        refresh = self.app.config['SIMILAR_REBUILD_SECONDS']
+        if refresh and time.monotonic() - self.built_at > refresh:
+            self._rebuild_in_background(refresh)
+        interval = self.app.config['SIMILAR_SYNC_SECONDS']
+        if interval and time.monotonic() - self.synced_at > interval and self._syncing.acquire(blocking=False):
+            try:
+                self.sync()
+            finally:
+                self._syncing.release()
+
+    def sync(self):
+        """Drops events the change log shows deleted since the index last caught up."""
+        self.synced_at = time.monotonic()
+        try:
+            keys, change_seq = changes.deleted_since('events', self.change_seq)
+        except SQLAlchemyError:
+            self.app.logger.exception("Similar-events change-log sync failed")
+            return
+        if keys is None:
+            # Changes were pruned before this worker read them; only a rebuild catches up
+            self._rebuild_in_background(0)
+            return
+        self.apply([], {}, {key['id'] for key in keys})
+        self.change_seq = change_seq
+
+    def _rebuild_in_background(self, max_age):
+        if not self._building.locked():
+            threading.Thread(target=self._rebuild_quietly, args=(max_age,), name='similar-rebuild', daemon=True).start()
+
+    def _rebuild_quietly(self, max_age):
+        try:
+            self.build(max_age)
+        except Exception:
+            self.app.logger.exception("Similar-events rebuild failed")
+            self.built_at = time.monotonic()
+
+    def apply(self, rows, lineups, removed):
+        with self._lock:
+            if self._missed is not None:
+                self._missed.append((rows, lineups, removed))
+            if self.index is not None:
+                _patch(self.index, rows, lineups, removed)
+
+    def similar(self, event_id, k):
+        with self._lock:
+            matches = self.index.similar(event_id, k)
+            if matches is None:
+                return None
+            return [{**self.index.listing[other], 'score': round(score, 4)} for score, other in matches]
+
+
+def _patch(index, rows, lineups, removed):
+    for event_id in removed:
+        index.remove(event_id)
+    for row in rows:
+        index.upsert(row, lineups.get(row.id, ()))
+
+
+#-------------------------------#Change tracking--------------------#
+def _pending(session):
+    return session.info.setdefault('similar', set())
+
+
+def _lineup_changes(obj):
+    history = inspect(obj).attrs.events.history
+    return {related.id for related in (*history.added, *history.deleted) if related.id is not None}
+
+
+def _before_flush(session, flush_context, instances):
+    # Events ON DELETE CASCADE removes along with a venue or user
+    cascaded = cascaded_rows(session, flush_context).get(Event)
+    if cascaded:
+        _pending(session).update(row.id for row in cascaded)
+
+
+def _after_flush(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Event):
+            _pending(session).add(obj.id)
+        elif isinstance(obj, Artist):
+            _pending(session).update(_lineup_changes(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Event):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in (*TRACKED_FIELDS, 'artists')):
+                _pending(session).add(obj.id)
+        elif isinstance(obj, Artist):
+            _pending(session).update(_lineup_changes(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Event):
+            _pending(session).add(obj.id)
+
+
+def _before_commit(session):
+    # Read the changed events inside the transaction; they are applied once it commits
+    session.flush()
+    event_ids = session.info.pop('similar', None)
+    if event_ids:
+        rows, lineups = _read_events(session, event_ids)
+        session.info['similar_ready'] = (rows, lineups, event_ids - {row.id for row in rows})
+
+
+def _after_commit(session):
+    ready = session.info.pop('similar_ready', None)
+    recommender = current_app.extensions.get('similar') if ready else None
+    if recommender is not None:
+        recommender.apply(*ready)
+
+
+def _forget(session, *args):
+    session.info.pop('similar', None)
+    session.info.pop('similar_ready', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'before_commit', _before_commit)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+#-------------------------------#Routes--------------------#
+@similar_api.get('/api/events/<int:id>/similar')
+def similar_events(id):
+    k = max(1, min(request.args.get('k', 10, type=int), MAX_K))
+    recommender = current_app.extensions['similar']
+    recommender.ensure_current()
+    matches = recommender.similar(id, k)
+    if matches is None:
+        return jsonify({"error": "Event not found"}), 404
+    return jsonify(matches), 200
+
+
+def init_app(app):
+    app.config.setdefault('SIMILAR_WEIGHTS', DEFAULT_WEIGHTS)
+    app.config.setdefault('SIMILAR_REBUILD_SECONDS', 3600)
+    app.config.setdefault('SIMILAR_SYNC_SECONDS', 5)
+    app.register_blueprint(similar_api)
+
+    recommender = app.extensions['similar'] = Recommender(app)
+    try:
+        recommender.build()
+    except SQLAlchemyError:
+        # No tables yet (a fresh database); the first lookup builds it
+        app.logger.info("Similar-events index deferred until first use")
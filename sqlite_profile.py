@@ -0,0 +1,118 @@
+# sqlite_profile.py
+# Connection settings and upkeep for SQLite deployments (the default when DATABASE_URL is unset).
+#
+# Every new SQLite connection gets foreign_keys=ON (the ON DELETE actions depend on it) and,
+# unless SQLITE_TUNING is false, the pragmas in SQLITE_PRAGMAS:
+#   journal_mode=WAL      readers no longer block the writer or each other, so several
+#                         gunicorn workers can share the file without "database is locked"
+#   synchronous=NORMAL    fsync at checkpoints instead of every commit; safe with WAL
+#   busy_timeout          a writer waits this many ms for the lock instead of failing at once
+#   cache_size, mmap_size page cache per connection (negative = KiB) and memory-mapped reads
+#   temp_store=MEMORY     sorts and temporary indexes stay off disk
+#
+# Upkeep: `flask sqlite-maintenance` runs PRAGMA optimize (refreshes planner statistics where
+# they are stale) and a WAL checkpoint, so the -wal file doesn't grow without bound between
+# automatic checkpoints. With --interval (default SQLITE_MAINTENANCE_INTERVAL_SECONDS, 0 = run
+# once) it keeps running as its own process and repeats every so many seconds.
+import os
+import time
+
+import click
+from flask import current_app
+from sqlalchemy import event, text
+
+from app import db
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,        # 64 MB
+    'mmap_size': 268435456,      # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+def pragma_listener(pragmas):
+    """A 'connect' event handler applying foreign_keys=ON plus `pragmas` to each new connection."""
+    statements = ["PRAGMA foreign_keys=ON"] + [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    return apply_pragmas
+
+
+def configure_engine(engine, app):
+    """Installs the app's SQLite profile on `engine` (sync, or an AsyncEngine's sync_engine)."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = app.config['SQLITE_PRAGMAS'] if app.config['SQLITE_TUNING'] else {}
+    event.listen(engine, 'connect', pragma_listener(pragmas))
+
+
+def run_maintenance(checkpoint_mode=None):
+    """
+    PRAGMA optimize plus a WAL checkpoint on every SQLite engine of the current app.
+    Returns {engine url: (busy, wal pages, pages checkpointed)}.
+    """
+    mode = (checkpoint_mode or current_app.config['SQLITE_CHECKPOINT_MODE']).upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"checkpoint mode must be one of {', '.join(CHECKPOINT_MODES)}")
+    results = {}
+    for engine in db.engines.values():
+        if engine.dialect.name != 'sqlite':
+            continue
+        with engine.connect() as connection:
+            connection.execute(text("PRAGMA optimize"))
+            results[engine.url.render_as_string()] = tuple(
+                connection.execute(text(f"PRAGMA wal_checkpoint({mode})")).one()
+            )
+            connection.commit()
+    return results
+
+
+@click.command('sqlite-maintenance')
+@click.option('--checkpoint', 'checkpoint_mode', default=None, type=click.Choice(CHECKPOINT_MODES, case_sensitive=False),
+              help="WAL checkpoint mode (default SQLITE_CHECKPOINT_MODE).")
+@click.option('--interval', type=int, default=None,
+              help="Keep running, repeating every this many seconds (default SQLITE_MAINTENANCE_INTERVAL_SECONDS; 0 runs once).")
+def sqlite_maintenance_command(checkpoint_mode, interval):
+    """Run PRAGMA optimize and checkpoint the WAL."""
+    interval = interval if interval is not None else current_app.config['SQLITE_MAINTENANCE_INTERVAL_SECONDS']
+    while True:
+        try:
+            results = run_maintenance(checkpoint_mode)
+        except Exception:
+            if not interval:
+                raise
+            # A busy or briefly unreachable database shouldn't end the long-running job
+            current_app.logger.exception("SQLite maintenance failed")
+            results = None
+        if results == {}:
+            click.echo("No SQLite databases configured.")
+        for url, (busy, wal_pages, checkpointed) in (results or {}).items():
+            if wal_pages < 0:
+                click.echo(f"{url}: optimized (not in WAL mode, nothing to checkpoint)")
+            else:
+                click.echo(f"{url}: optimized, checkpointed {checkpointed}/{wal_pages} WAL pages{' (busy)' if busy else ''}")
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+def init_app(app):
+    app.config.setdefault('SQLITE_TUNING', os.getenv('SQLITE_TUNING', 'true').lower() != 'false')
+    app.config.setdefault('SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    app.config.setdefault('SQLITE_CHECKPOINT_MODE', os.getenv('SQLITE_CHECKPOINT_MODE', 'PASSIVE'))
+    app.config.setdefault('SQLITE_MAINTENANCE_INTERVAL_SECONDS',
+                          int(os.getenv('SQLITE_MAINTENANCE_INTERVAL_SECONDS', '0')))
+    app.cli.add_command(sqlite_maintenance_command)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            configure_engine(engine, app)
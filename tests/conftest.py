@@ -0,0 +1,34 @@
+import pytest
+
+from app import db, create_app, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}"})
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def admin(app, client):
+    """Signs the test client in as an admin; returns the admin's id."""
+    with app.app_context():
+        user = User(username='boss', user_type='admin')
+        user.password = 'secret'
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return user_id
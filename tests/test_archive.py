@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+import archive
+from app import (
+    db, Attendee, Event, Venue, attendee_events, attendee_events_archive, events_archive, sync_schema,
+)
+
+
+def _event(name, days_ago, venue, **extra):
+    return Event(
+        name=name, date=datetime.utcnow() - timedelta(days=days_ago), time='20:00', location='Austin',
+        description='d', event_type='Rock', venue=venue, **extra,
+    )
+
+
+def _seed(app):
+    with app.app_context():
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1')
+        attendee = Attendee(first_name='Ada', last_name='Byron', email='ada@example.com')
+        old = _event('Old', 400, venue, attendees=[attendee])
+        recent = _event('Recent', 1, venue, attendees=[attendee])
+        db.session.add_all([venue, attendee, old, recent])
+        db.session.commit()
+        return old.id, recent.id
+
+
+def test_archive_round_trip(app, client):
+    old_id, recent_id = _seed(app)
+    with app.app_context():
+        assert archive.archive_events(horizon_days=90) == 1
+        assert db.session.get(Event, old_id) is None
+        assert db.session.get(Event, recent_id) is not None
+        assert db.session.execute(select(events_archive.c.name).where(events_archive.c.id == old_id)).scalar() == 'Old'
+        archived_links = db.session.execute(select(attendee_events_archive.c.event_id)).scalars().all()
+        live_links = db.session.execute(select(attendee_events.c.event_id)).scalars().all()
+        assert archived_links == [old_id] and live_links == [recent_id]
+
+    live = {event['id'] for event in client.get('/api/events').get_json()}
+    everything = {event['id'] for event in client.get('/api/events?include_archived=true').get_json()}
+    assert live == {recent_id}
+    assert everything == {old_id, recent_id}
+
+
+def test_archived_ids_are_not_reused(app):
+    old_id, recent_id = _seed(app)
+    with app.app_context():
+        venue = db.session.get(Venue, 1)
+        newest = _event('Newest', 300, venue)
+        db.session.add(newest)
+        db.session.commit()
+        newest_id = newest.id
+        assert archive.archive_events(horizon_days=90) == 2
+
+        again = _event('Again', 300, venue)
+        db.session.add(again)
+        db.session.commit()
+        assert again.id > newest_id
+        assert archive.archive_events(horizon_days=90) == 1
+        assert db.session.execute(select(func.count()).select_from(events_archive)).scalar() == 3
+
+
+def test_sync_schema_adds_autoincrement(app):
+    with app.app_context():
+        # An events table as databases created before AUTOINCREMENT have it
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+            ddl = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'events'").scalar()
+            connection.exec_driver_sql(ddl.replace('AUTOINCREMENT', '').replace('events', 'events__plain', 1))
+            connection.exec_driver_sql("DROP TABLE events")
+            connection.exec_driver_sql("ALTER TABLE events__plain RENAME TO events")
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+            connection.commit()
+        _seed(app)
+        db.session.execute(events_archive.insert().values(
+            id=50, name='Long gone', date=datetime(2000, 1, 1), time='20:00', location='Austin', description='d',
+            event_type='Rock', attendee_count=0, version_id=1, archived_at=datetime(2001, 1, 1),
+        ))
+        db.session.commit()
+
+        assert 'autoincrement events' in sync_schema()
+        ddl = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'events'")).scalar()
+        assert 'AUTOINCREMENT' in ddl.upper()
+        assert db.session.execute(select(func.count()).select_from(Event)).scalar() == 2
+
+        event = _event('Next', 1, db.session.get(Venue, 1))
+        db.session.add(event)
+        db.session.commit()
+        assert event.id > 50
+
+
+def test_workers_drop_archived_events(app, client):
+    old_id, recent_id = _seed(app)
+    app.config.update(SIMILAR_SYNC_SECONDS=1e-9, ITINERARY_SYNC_SECONDS=1e-9)
+    assert [match['id'] for match in client.get(f'/api/events/{recent_id}/similar').get_json()] == [old_id]
+    with app.app_context():
+        # The archiver is a process of its own; nothing tells this one's index directly
+        assert archive.archive_events(horizon_days=90) == 1
+    assert client.get(f'/api/events/{recent_id}/similar').get_json() == []
+    assert client.get(f'/api/events/{old_id}/similar').status_code == 404
@@ -0,0 +1,43 @@
+from app import db, Venue
+
+VENUE = {'name': 'Roxy', 'organizer': 'o', 'email': 'roxy@example.com', 'earnings': '1'}
+
+
+def test_failed_sub_request_does_not_poison_the_next(app, client, admin):
+    assert client.post('/api/venues', json=VENUE).status_code == 201
+
+    response = client.post('/api/batch', json={'requests': [
+        {'method': 'POST', 'path': '/api/venues', 'body': dict(VENUE, name=None)},
+        {'method': 'PATCH', 'path': '/api/venues/1', 'body': {'name': 'The Roxy'}},
+        {'method': 'GET', 'path': '/api/venues/1'},
+    ]})
+    assert response.status_code == 200
+    assert [entry['status'] for entry in response.get_json()] == [400, 200, 200]
+    assert response.get_json()[2]['body']['name'] == 'The Roxy'
+    with app.app_context():
+        assert db.session.get(Venue, 1).name == 'The Roxy'
+        assert Venue.query.count() == 1
+
+
+def test_sub_requests_run_in_order(client, admin):
+    response = client.post('/api/batch', json={'requests': [
+        {'method': 'POST', 'path': '/api/venues', 'body': VENUE},
+        {'method': 'GET', 'path': '/api/venues/1'},
+        {'method': 'GET', 'path': '/api/venues/2'},
+    ]})
+    assert [entry['status'] for entry in response.get_json()] == [201, 200, 404]
+
+
+def test_sub_request_headers_are_filtered(client, admin):
+    client.post('/api/venues', json=dict(VENUE, description='x' * 4096))
+    response = client.post('/api/batch', json={'requests': [
+        {'method': 'GET', 'path': '/api/venues/1', 'headers': {'Accept-Encoding': 'gzip', 'Connection': 'close'}},
+    ]})
+    entry = response.get_json()[0]
+    assert entry['status'] == 200
+    assert entry['body']['description'] == 'x' * 4096
+
+
+def test_nested_batches_are_rejected(client):
+    response = client.post('/api/batch', json={'requests': [{'method': 'POST', 'path': '/api/batch'}]})
+    assert response.status_code == 400
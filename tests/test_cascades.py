@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select
+
+import changes
+from app import db, Artist, Attendee, AttendeeVenue, Event, EventCard, User, Venue
+
+
+def _seed(app):
+    with app.app_context():
+        owner = User(username='owner', user_type='venue', password='secret')
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1', creator=owner)
+        artist = Artist(name='Sleater', creator=owner)
+        show = Event(
+            name='Gig', date=datetime.utcnow() + timedelta(days=5), time='20:00', location='Austin',
+            description='loud', event_type='Rock', venue=venue, artists=[artist],
+        )
+        attendee = Attendee(first_name='Ada', last_name='Byron', email='ada@example.com', attended_events=[show])
+        db.session.add_all([owner, venue, artist, show, attendee])
+        db.session.flush()
+        db.session.add(AttendeeVenue(attendee_id=attendee.id, venue_id=venue.id, rating=4))
+        db.session.commit()
+        return owner.id, venue.id, artist.id, show.id
+
+
+def test_deleting_a_user_reads_its_cascade_once(app):
+    owner_id, venue_id, artist_id, event_id = _seed(app)
+    index = app.extensions['autocomplete']
+    index.build()
+    assert [match['id'] for match in index.search('roxy', ['venue'], 10)] == [venue_id]
+    with app.app_context():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            db.session.delete(db.session.get(User, owner_id))
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        # One SELECT per cascaded model, however many listeners want the rows
+        cascade_reads = [s for s in statements if s.lstrip().startswith('SELECT') and 'created_by_id' in s]
+        assert len(cascade_reads) == 4
+
+        deletes = {
+            (change['entity'], tuple(change['key'].values()))
+            for change in changes.read_changes(0, 100) if change['op'] == 'delete'
+        }
+        assert {('venues', (venue_id,)), ('artists', (artist_id,)), ('events', (event_id,))} <= deletes
+        assert db.session.execute(select(EventCard.event_id)).scalars().all() == []
+        assert index.search('roxy', ['venue'], 10) == []
@@ -0,0 +1,31 @@
+import time
+
+import changes
+from app import db, Venue
+
+
+def test_reading_leaves_the_session_alone(app):
+    with app.test_request_context():
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1')
+        db.session.add(venue)
+        db.session.flush()
+        changes.read_changes(0, 10)
+        assert venue in db.session
+        db.session.commit()
+        venue_id = venue.id
+    with app.app_context():
+        assert [change['key'] for change in changes.read_changes(0, 10)] == [{'id': venue_id}]
+
+
+def test_followers_beyond_the_limit_do_not_wait(app, client):
+    feed = app.extensions['changes'] = changes.ChangeFeed(max_waiters=1)
+    head = client.get('/api/changes').get_json()['next']
+    with feed.waiting() as allowed:
+        assert allowed
+        started = time.monotonic()
+        response = client.get(f'/api/changes?since={head}&wait=5')
+        assert response.get_json() == {'changes': [], 'next': head}
+        assert time.monotonic() - started < 1
+
+        stream = client.get(f'/api/changes?since={head}', headers={'Accept': 'text/event-stream'})
+        assert stream.get_data(as_text=True) == f"retry: {changes.STREAM_BUSY_RETRY_MS}\n\n"
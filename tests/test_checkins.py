@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import db, Attendee, Event, EventCard, Venue
+
+
+@pytest.fixture
+def seeded(app):
+    # Flushes happen when the tests call them, not on the flusher thread's schedule
+    app.config.update(CHECKIN_FLUSH_MS=3_600_000, CHECKIN_CARD_SECONDS=0)
+    with app.app_context():
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1')
+        show = Event(name='Gig', date=datetime.utcnow() + timedelta(days=1), time='20:00', location='Austin',
+                     description='d', event_type='Rock', venue=venue)
+        attendees = [Attendee(first_name=name, last_name='X', email=f'{name}@example.com') for name in 'ABC']
+        db.session.add_all([venue, show, *attendees])
+        db.session.commit()
+        return show.id, [attendee.id for attendee in attendees]
+
+
+def _card_attendees(app, event_id):
+    with app.app_context():
+        payload = db.session.execute(select(EventCard.payload).where(EventCard.event_id == event_id)).scalar()
+        return [attendee['id'] for attendee in payload['attendees']]
+
+
+def _attendance(client, event_id):
+    return client.get(f'/api/events/{event_id}/checkins').get_json()['attendance']
+
+
+def test_flush_writes_checkins_and_counts_them(app, client, seeded):
+    event_id, (a, b, c) = seeded
+    buffer = app.extensions['checkins']
+    assert client.post(f'/api/events/{event_id}/checkins', json={'attendee_ids': [a, b, a, 999]}).status_code == 202
+    assert buffer.flush() == 2
+    assert _attendance(client, event_id) == 2
+    assert _card_attendees(app, event_id) == [a, b]
+
+    # A repeated scan is a no-op for the count
+    client.post(f'/api/events/{event_id}/checkins', json={'attendee_id': a})
+    assert buffer.flush() == 0
+    assert _attendance(client, event_id) == 2
+
+
+def test_cards_update_at_most_once_per_interval(app, client, seeded):
+    event_id, (a, b, c) = seeded
+    app.config['CHECKIN_CARD_SECONDS'] = 3600
+    buffer = app.extensions['checkins']
+    client.post(f'/api/events/{event_id}/checkins', json={'attendee_id': a})
+    buffer.flush()
+    client.post(f'/api/events/{event_id}/checkins', json={'attendee_ids': [b, c]})
+    buffer.flush()
+    assert _attendance(client, event_id) == 3
+    assert _card_attendees(app, event_id) == [a]
+
+    buffer.flush(final=True)
+    assert _card_attendees(app, event_id) == [a, b, c]
+
+
+def test_triggers_follow_orm_deletes(app, client, seeded):
+    event_id, (a, b, c) = seeded
+    client.post(f'/api/events/{event_id}/checkins', json={'attendee_ids': [a, b, c]})
+    app.extensions['checkins'].flush()
+    with app.app_context():
+        db.session.delete(db.session.get(Attendee, b))
+        db.session.commit()
+    assert _attendance(client, event_id) == 2
+    assert _card_attendees(app, event_id) == [a, c]
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from app import db, Event, EventCard, Venue, sync_schema
+
+
+def _seed_without_cards(app):
+    with app.app_context():
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1')
+        db.session.add_all([venue] + [
+            Event(name=name, date=datetime.utcnow() + timedelta(days=3), time='20:00', location='Austin',
+                  description='d', event_type='Rock', venue=venue)
+            for name in ('Gig', 'Jam')
+        ])
+        db.session.commit()
+        # As on a database the cards table was added to after the fact
+        db.session.execute(delete(EventCard.__table__))
+        db.session.commit()
+
+
+def test_listing_falls_back_to_events_before_cards_exist(app, client):
+    _seed_without_cards(app)
+    assert [event['name'] for event in client.get('/api/events').get_json()] == ['Gig', 'Jam']
+    assert [event['name'] for event in client.get('/api/events/search?searchTerm=jam').get_json()] == ['Jam']
+
+
+def test_sync_schema_fills_the_cards(app, client):
+    _seed_without_cards(app)
+    with app.app_context():
+        assert 'event cards (2)' in sync_schema()
+        assert db.session.execute(select(func.count()).select_from(EventCard)).scalar() == 2
+        assert 'event cards (2)' not in sync_schema()
+    assert [event['name'] for event in client.get('/api/events').get_json()] == ['Gig', 'Jam']
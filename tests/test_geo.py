@@ -0,0 +1,45 @@
+import pytest
+
+from geo import bounding_box, covering_prefixes, geohash_encode
+
+
+def _create(client, name, latitude, longitude):
+    response = client.post('/api/events', json={
+        'name': name, 'date': '2030-06-01', 'time': '20:00', 'location': 'Pacific', 'description': 'd',
+        'event_type': 'Rock', 'latitude': latitude, 'longitude': longitude,
+    })
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize('lon', [179.9, -179.9])
+def test_bounding_box_splits_at_the_antimeridian(lon):
+    min_lat, max_lat, lon_ranges = bounding_box(0.0, lon, 50)
+    assert min_lat < 0 < max_lat
+    (west, west_edge), (east_edge, east) = lon_ranges
+    assert (west_edge, east_edge) == (180.0, -180.0)
+    assert 179.0 < west < 180.0 and -180.0 < east < -179.0
+    assert west <= lon <= west_edge or east_edge <= lon <= east
+
+
+def test_bounding_box_away_from_the_antimeridian_is_one_range():
+    assert len(bounding_box(0.0, 0.0, 50)[2]) == 1
+
+
+def test_bounding_box_covering_a_pole_spans_every_longitude():
+    assert bounding_box(89.99, 10.0, 50)[2] == [(-180.0, 180.0)]
+
+
+def test_covering_prefixes_wrap_the_antimeridian():
+    prefixes = covering_prefixes(0.0, -179.99, 10)
+    assert any(geohash_encode(0.0, 179.99).startswith(prefix) for prefix in prefixes)
+
+
+def test_nearby_finds_events_across_the_antimeridian(client):
+    _create(client, 'Fiji', -17.0, 179.95)
+    _create(client, 'Taveuni', -17.0, -179.95)
+    _create(client, 'Far away', -17.0, 170.0)
+
+    for lon in (179.95, -179.95):
+        response = client.get('/api/events/nearby', query_string={'lat': -17.0, 'lon': lon, 'radius': 50})
+        assert response.status_code == 200
+        assert sorted(event['name'] for event in response.get_json()) == ['Fiji', 'Taveuni']
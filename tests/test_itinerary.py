@@ -0,0 +1,59 @@
+def _event(client, name, date, time, location):
+    response = client.post('/api/events', json={
+        'name': name, 'date': date, 'time': time, 'location': location, 'description': 'd', 'event_type': 'Rock',
+    })
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def _tour(client, event_ids, start='06/01/2030', end='06/30/2030'):
+    return client.post('/api/tours', json={
+        'name': 'Summer', 'description': 'd', 'start_date': start, 'end_date': end, 'event_ids': event_ids,
+    })
+
+
+def test_itinerary_orders_events_and_reports_stats(client):
+    late = _event(client, 'Closer', '2030-06-10', '21:00', 'Dallas')
+    early = _event(client, 'Opener', '2030-06-02', '20:00', 'Austin')
+    same_day = _event(client, 'Second night', '2030-06-03', '19:00', '  austin ')
+    tour = _tour(client, [late, early, same_day])
+    assert tour.status_code == 201
+
+    itinerary = client.get(f"/api/tours/{tour.get_json()['id']}/itinerary").get_json()
+    assert [event['id'] for event in itinerary['events']] == [early, same_day, late]
+    stats = itinerary['stats']
+    assert stats['event_count'] == 3
+    assert stats['cities'] == ['Austin', 'Dallas']
+    assert (stats['first_date'], stats['last_date'], stats['span_days']) == ('06/02/2030', '06/10/2030', 9)
+    assert stats['gaps'] == [{'from': '06/03/2030', 'to': '06/10/2030', 'days_off': 6}]
+    assert stats['longest_gap_days'] == 6
+    assert stats['outside_tour'] == []
+
+
+def test_itinerary_of_a_missing_tour_is_404(client):
+    assert client.get('/api/tours/999/itinerary').status_code == 404
+
+
+def test_create_rejects_events_outside_the_tour(client):
+    inside = _event(client, 'Inside', '2030-06-05', '20:00', 'Austin')
+    outside = _event(client, 'Outside', '2030-07-05', '20:00', 'Austin')
+
+    response = _tour(client, [inside, outside])
+    assert response.status_code == 400
+    assert [event['id'] for event in response.get_json()['events_outside_tour']] == [outside]
+    assert _tour(client, [inside], start='06/30/2030', end='06/01/2030').status_code == 400
+    assert client.get('/api/tours').get_json() == []
+
+
+def test_edit_rejects_dates_that_strand_events(client, admin):
+    event_id = _event(client, 'Opener', '2030-06-20', '20:00', 'Austin')
+    tour_id = _tour(client, [event_id]).get_json()['id']
+    client.get(f'/api/tours/{tour_id}/itinerary')  # cache it
+
+    response = client.patch(f'/api/tours/{tour_id}', json={'end_date': '06/15/2030'})
+    assert response.status_code == 400
+    assert response.get_json()['events_outside_tour'][0]['id'] == event_id
+    assert client.patch(f'/api/tours/{tour_id}', json={'end_date': '05/15/2030'}).status_code == 400
+
+    assert client.patch(f'/api/tours/{tour_id}', json={'end_date': '06/25/2030'}).status_code == 200
+    assert client.get(f'/api/tours/{tour_id}/itinerary').get_json()['tour']['end_date'] == '06/25/2030'
@@ -0,0 +1,29 @@
+import pytest
+
+from app import db, Attendee, AttendeeVenue, Venue
+
+
+@pytest.fixture(autouse=True)
+def venue_and_attendee(app):
+    with app.app_context():
+        db.session.add_all([
+            Venue(id=1, name='Roxy', organizer='o', email='roxy@example.com', earnings='1'),
+            Attendee(id=1, first_name='Ada', last_name='Byron', email='ada@example.com'),
+        ])
+        db.session.commit()
+
+
+def test_update_rating(app, client):
+    response = client.post('/api/venues/1/rate', json={'attendee_id': 1, 'rating': 2})
+    assert response.status_code == 200
+
+    # Updating goes through the ORM, so every flush hook sees a dirty AttendeeVenue
+    response = client.patch('/api/venues/1/rate', json={'attendee_id': 1, 'rating': 5})
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(AttendeeVenue, (1, 1)).rating == 5
+
+
+def test_update_missing_rating(client):
+    response = client.patch('/api/venues/1/rate', json={'attendee_id': 1, 'rating': 5})
+    assert response.status_code == 404
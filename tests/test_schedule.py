@@ -0,0 +1,34 @@
+import pytest
+
+from app import db, Venue
+
+
+@pytest.fixture
+def venue_id(app):
+    with app.app_context():
+        venue = Venue(name='Roxy', organizer='o', email='roxy@example.com', earnings='1')
+        db.session.add(venue)
+        db.session.commit()
+        return venue.id
+
+
+def _create(client, venue_id, name, time, **extra):
+    return client.post('/api/events', json={
+        'name': name, 'date': '2030-06-01', 'time': time, 'location': 'Austin', 'description': 'd',
+        'event_type': 'Rock', 'venue_id': venue_id, **extra,
+    })
+
+
+@pytest.mark.parametrize('time', ['TBD', '7pm-10pm', 'Doors 8'])
+def test_unreadable_times_book_nothing(client, venue_id, time):
+    vague = _create(client, venue_id, 'Vague', time)
+    assert vague.status_code == 201
+    assert vague.get_json()['start_at'] is None and vague.get_json()['end_at'] is None
+    assert _create(client, venue_id, 'Evening', '20:00').status_code == 201
+
+
+def test_overlapping_bookings_conflict(client, venue_id):
+    assert _create(client, venue_id, 'Early', '19:00', end_time='22:00').status_code == 201
+    clash = _create(client, venue_id, 'Late', '8:30 PM')
+    assert clash.status_code == 409
+    assert _create(client, venue_id, 'Later', '22:00').status_code == 201
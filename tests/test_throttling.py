@@ -0,0 +1,31 @@
+import sqlite3
+
+from app import create_app
+from throttling import SQLiteStore
+
+
+def test_anonymous_clients_are_keyed_by_forwarded_address(tmp_path):
+    app = create_app({
+        'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}", 'PROXY_HOPS': 1,
+        'RATELIMIT_ROUTES': {'api.signin': (1 / 60, 1)},
+    })
+    client = app.test_client()
+
+    def signin(address):
+        return client.post('/api/signin', json={}, headers={'X-Forwarded-For': address}).status_code
+
+    assert signin('203.0.113.5') != 429
+    assert signin('203.0.113.5') == 429
+    # Same proxy, another client behind it
+    assert signin('198.51.100.7') != 429
+
+
+def test_sqlite_store_prunes_refilled_buckets(tmp_path):
+    path = tmp_path / 'buckets.db'
+    store = SQLiteStore(str(path), horizon=10, prune_every=3)
+    store.take('a', 1, 10, now=100)
+    store.take('b', 1, 10, now=105)
+    assert store.take('c', 1, 10, now=112) == (True, 0)
+
+    keys = {key for key, in sqlite3.connect(path).execute("SELECT key FROM rate_buckets")}
+    assert keys == {'b', 'c'}
@@ -0,0 +1,220 @@
+# throttling.py
+# Per-route token-bucket rate limiting and in-flight load shedding.
+#
+# Configuration (all optional, see DEFAULT_RATE_LIMITS / DEFAULT_INFLIGHT_LIMITS):
+#   RATELIMIT_ENABLED        turn the whole thing off with False
+#   RATELIMIT_STORAGE        'memory' (per worker) or 'sqlite:///path/to/file.db' (shared by workers)
+#   RATELIMIT_ROUTES         {endpoint: (tokens_per_second, burst)}
+#   LOADSHED_ROUTES          {endpoint: max in-flight requests for that endpoint in this worker}
+#   LOADSHED_MAX_INFLIGHT    max in-flight requests across the whole worker, 0 for no limit
+#   PROXY_HOPS               reverse proxies in front of the app (default 0); anonymous clients
+#                            are keyed by the address the outermost of them saw
+#
+# In-flight limits count the requests one worker serves at once, so they only bite when a
+# worker serves several: the bundled gunicorn config runs 8 threads per worker, and a
+# route limit of 4 keeps half of them free for other routes. (A single-threaded sync worker
+# never has more than one request in flight, and sheds nothing.)
+#
+# The SQLite store deletes buckets that have been full again for a while (untouched for
+# longer than the slowest route takes to refill) every RATELIMIT_PRUNE_EVERY takes per worker.
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, jsonify, request, session
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+SEARCH_ENDPOINTS = (
+    'api.search_events_by_name',
+    'api.search_venues_by_name',
+    'api.search_attendees_by_name',
+    'api.search_artists_by_name',
+    'api.search_tours_by_name',
+    'api.search_users',
+)
+
+DEFAULT_RATE_LIMITS = {
+    'api.signin': (5 / 60, 5),    # 5 per minute
+    'api.signup': (3 / 60, 3),    # 3 per minute
+    **{endpoint: (2, 10) for endpoint in SEARCH_ENDPOINTS},
+}
+
+DEFAULT_INFLIGHT_LIMITS = {
+    'api.signin': 4,
+    'api.signup': 4,
+    **{endpoint: 4 for endpoint in SEARCH_ENDPOINTS},
+}
+
+
+class MemoryStore:
+    """
+    Token buckets kept in a plain dict, one per worker.
+    No lock: each update is a single dict assignment, so concurrent requests on the
+    same key can at worst both spend the same token, which is fine for a limiter.
+    """
+
+    def __init__(self, max_keys=50000):
+        self._buckets = {}          # key -> (tokens, stamp, time the bucket is full again)
+        self.max_keys = max_keys
+        # Past max_keys, sweep once per this many new keys rather than on every request
+        self.prune_every = max(1, max_keys // 10)
+        self._added = 0
+
+    def take(self, key, rate, burst, now):
+        tokens, stamp, _ = self._buckets.get(key) or (burst, now, now)
+        if key not in self._buckets:
+            self._added += 1
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+        if len(self._buckets) > self.max_keys and self._added >= self.prune_every:
+            self._prune(now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _prune(self, now):
+        # A bucket full again carries no state worth keeping, whatever route it limits
+        self._added = 0
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                self._buckets.pop(key, None)
+
+
+class SQLiteStore:
+    """Token buckets in a SQLite file, so all workers on a host share the same limits."""
+
+    def __init__(self, path, horizon, prune_every=1000):
+        self.path = path
+        self.horizon = horizon            # seconds after which an untouched bucket is full again
+        self.prune_every = prune_every
+        self._takes = itertools.count(1)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, stamp REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, stamp FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, stamp = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, stamp) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, stamp = excluded.stamp",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if next(self._takes) % self.prune_every == 0:
+            self._prune(now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _prune(self, now):
+        # Outside the take's transaction, so the sweep never holds up a request's bucket
+        self._conn().execute("DELETE FROM rate_buckets WHERE stamp < ?", (now - self.horizon,))
+
+
+class InflightGate:
+    """Counts requests currently being served, per endpoint and for the whole worker."""
+
+    def __init__(self, route_limits, max_inflight=0):
+        self._routes = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in route_limits.items()}
+        self._total = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+
+    def enter(self, endpoint):
+        """Returns the semaphores held for this request, or None if the request must be shed."""
+        held = []
+        for sem in (self._total, self._routes.get(endpoint)):
+            if sem is None:
+                continue
+            if not sem.acquire(blocking=False):
+                for taken in held:
+                    taken.release()
+                return None
+            held.append(sem)
+        return held
+
+
+def make_store(uri, horizon, prune_every):
+    if uri and uri.startswith('sqlite:///'):
+        return SQLiteStore(uri[len('sqlite:///'):], horizon, prune_every)
+    return MemoryStore()
+
+
+def client_key():
+    """Signed-in users are limited per account, anonymous clients per address."""
+    user_id = session.get('user_id')
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.remote_addr}"
+
+
+def init_app(app):
+    app.config.setdefault('RATELIMIT_ENABLED', os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false')
+    app.config.setdefault('RATELIMIT_STORAGE', os.getenv('RATELIMIT_STORAGE', 'memory'))
+    app.config.setdefault('RATELIMIT_ROUTES', DEFAULT_RATE_LIMITS)
+    app.config.setdefault('LOADSHED_ROUTES', DEFAULT_INFLIGHT_LIMITS)
+    app.config.setdefault('LOADSHED_MAX_INFLIGHT', 0)
+    app.config.setdefault('RATELIMIT_PRUNE_EVERY', 1000)
+    app.config.setdefault('PROXY_HOPS', int(os.getenv('PROXY_HOPS', '0')))
+
+    hops = app.config['PROXY_HOPS']
+    if hops:
+        # Only as many X-Forwarded-* entries as there are proxies are trusted; anything
+        # further left was written by the client
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+    if not app.config['RATELIMIT_ENABLED']:
+        return
+
+    routes = app.config['RATELIMIT_ROUTES']
+    horizon = max((burst / rate for rate, burst in routes.values()), default=0)
+    store = make_store(app.config['RATELIMIT_STORAGE'], horizon, app.config['RATELIMIT_PRUNE_EVERY'])
+    gate = InflightGate(app.config['LOADSHED_ROUTES'], app.config['LOADSHED_MAX_INFLIGHT'])
+    app.extensions['throttling'] = {'store': store, 'gate': gate}
+
+    @app.before_request
+    def throttle():
+        endpoint = request.endpoint
+        limit = routes.get(endpoint)
+        if limit:
+            rate, burst = limit
+            allowed, retry_after = store.take(f"{endpoint}:{client_key()}", rate, burst, time.time())
+            if not allowed:
+                response = jsonify({"error": "Too many requests. Please slow down."})
+                response.headers['Retry-After'] = str(max(1, round(retry_after)))
+                return response, 429
+
+        held = gate.enter(endpoint)
+        if held is None:
+            response = jsonify({"error": "Server is busy. Please try again shortly."})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        g.throttling_held = held
+
+    @app.teardown_request
+    def release_inflight(exception=None):
+        for sem in g.pop('throttling_held', ()):
+            sem.release()
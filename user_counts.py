@@ -0,0 +1,227 @@
+# user_counts.py
+# Totals for the admin user list without a COUNT(*) per page.
+#
+#   GET /api/all-users?role=artist&status=active&page=3               total from the counters
+#   GET /api/all-users?role=artist&status=active&page=3&exact_total=true   total from COUNT(*)
+#
+# user_counts holds one row per (user_type, status) with the number of users in it, status
+# being 'active' (profile completed), 'inactive' or 'unset'. Any role/status filter of the
+# listing is the sum of a few of those rows, all read with one tiny query. The counters are
+# updated in the transaction that signs a user up, changes a role, completes a profile or
+# deletes a user (session hooks on User, applied as upserts just before the commit), so
+# they stay exact as long as users are only written through the ORM.
+#
+# The counters are trusted once `flask recount-users` has filled them in, which it marks
+# with a ('', 'recounted') row; deltas applied before that only adjust partial counts.
+# Until then totals are the query planner's row estimate on PostgreSQL, and elsewhere a
+# COUNT(*) cached per worker for USER_TOTALS_CACHE_SECONDS (default 60). "total_source" in the response says
+# which: count, counters, estimate or cached. After upgrading an existing database run
+#
+#   flask sync-schema && flask recount-users
+#
+# to create the table and fill it in.
+import json
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app
+from sqlalchemy import delete, event, func, inspect, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db, User
+
+TRACKED_FIELDS = ('user_type', 'profile_completed')
+# Written by recount_users(): the counters are complete from then on
+RECOUNTED = ('', 'recounted')
+
+
+class UserCount(db.Model):
+    __tablename__ = 'user_counts'
+    user_type = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def status_of(profile_completed):
+    """The listing's status filter value for a profile_completed value."""
+    if profile_completed is None:
+        return 'unset'
+    return 'active' if profile_completed else 'inactive'
+
+
+def _matches(status, wanted):
+    # Mirrors get_all_users: 'active' means completed, any other status means not completed
+    if wanted is None:
+        return True
+    return status == ('active' if wanted.lower() == 'active' else 'inactive')
+
+
+#-------------------------------#Counters--------------------#
+def _pending(session):
+    return session.info.setdefault('user_counts', Counter())
+
+
+def _before_flush(session, flush_context, instances):
+    # Old values have to be read while the rows still hold them
+    with session.no_autoflush:
+        for obj in session.deleted:
+            if isinstance(obj, User) and obj.id is not None:
+                _pending(session)[obj.user_type, status_of(obj.profile_completed)] -= 1
+        for obj in session.dirty:
+            if not isinstance(obj, User) or obj.id is None:
+                continue
+            state = inspect(obj)
+            histories = [state.attrs[name].history for name in TRACKED_FIELDS]
+            if not any(history.has_changes() for history in histories):
+                continue
+            old = [(history.deleted or history.unchanged or [None])[0] for history in histories]
+            if not all(history.deleted or history.unchanged for history in histories):
+                # Changed without having been loaded; the row still holds the old values
+                old = session.execute(select(User.user_type, User.profile_completed).where(User.id == obj.id)).one()
+            pending = _pending(session)
+            pending[old[0], status_of(old[1])] -= 1
+            pending[obj.user_type, status_of(obj.profile_completed)] += 1
+
+
+def _after_flush(session, flush_context):
+    # New users after the INSERT, so column defaults are filled in
+    for obj in session.new:
+        if isinstance(obj, User):
+            _pending(session)[obj.user_type, status_of(obj.profile_completed)] += 1
+
+
+def _before_commit(session):
+    session.flush()
+    deltas = session.info.pop('user_counts', None)
+    if deltas:
+        apply_deltas(session, deltas)
+
+
+def _forget(session, *args):
+    session.info.pop('user_counts', None)
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'before_commit', _before_commit)
+event.listen(db.session, 'after_rollback', _forget)
+
+
+def apply_deltas(executor, deltas):
+    """Adds {(user_type, status): delta} to the counters, in key order so writers never deadlock."""
+    table = UserCount.__table__
+    bind = executor.get_bind() if hasattr(executor, 'get_bind') else executor
+    dialect = bind.dialect.name
+    for (user_type, status), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        if dialect in ('postgresql', 'sqlite'):
+            dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = dialect_insert(table).values(user_type=user_type, status=status, count=delta)
+            executor.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.user_type, table.c.status],
+                set_={'count': table.c.count + statement.excluded.count},
+            ))
+            continue
+        matched = executor.execute(
+            update(table).where(table.c.user_type == user_type, table.c.status == status)
+            .values(count=table.c.count + delta)
+        ).rowcount
+        if not matched:
+            executor.execute(insert(table).values(user_type=user_type, status=status, count=delta))
+
+
+def recount_users():
+    """Recomputes every counter from the users table. Returns the number of users."""
+    table = UserCount.__table__
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Hold off signups and role changes so no delta lands between the delete and the insert
+            connection.execute(text("LOCK TABLE users IN SHARE MODE"))
+        rows = connection.execute(
+            select(User.user_type, User.profile_completed, func.count()).group_by(User.user_type, User.profile_completed)
+        ).all()
+        counts = Counter()
+        for user_type, profile_completed, count in rows:
+            counts[user_type, status_of(profile_completed)] += count
+        connection.execute(delete(table))
+        connection.execute(insert(table), [
+            {'user_type': user_type, 'status': status, 'count': count}
+            for (user_type, status), count in [*counts.items(), (RECOUNTED, 0)]
+        ])
+    _fallback_cache.clear()
+    return sum(counts.values())
+
+
+#-------------------------------#Totals--------------------#
+class _TotalsCache:
+    """Exact totals per filter, each kept for ttl seconds (only used before the counters exist)."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._entries.get(key)
+        return hit[1] if hit is not None and hit[0] > time.monotonic() else None
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_fallback_cache = _TotalsCache()
+
+
+def _planner_estimate(query):
+    """PostgreSQL's estimated row count for the query, without running it."""
+    statement = query.with_entities(User.id).order_by(None).statement
+    compiled = statement.compile(dialect=db.session.get_bind().dialect)
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def user_total(query, role, status, exact=False):
+    """
+    (total, source) for the filtered user query: COUNT(*) when exact is asked for, else the
+    counters, else a planner estimate or a cached count.
+    """
+    if exact:
+        return query.order_by(None).count(), 'count'
+
+    counters = db.session.execute(select(UserCount.user_type, UserCount.status, UserCount.count)).all()
+    if any((user_type, row_status) == RECOUNTED for user_type, row_status, _ in counters):
+        # Same test as the listing's filter: an empty role means every role
+        total = sum(count for user_type, row_status, count in counters
+                    if (user_type, row_status) != RECOUNTED
+                    and (not role or user_type == role) and _matches(row_status, status))
+        return max(total, 0), 'counters'
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return _planner_estimate(query), 'estimate'
+    key = (role or None, status)
+    total = _fallback_cache.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        _fallback_cache.put(key, total, current_app.config['USER_TOTALS_CACHE_SECONDS'])
+    return total, 'cached'
+
+
+@click.command('recount-users')
+def recount_users_command():
+    """Recompute the user_counts table from users."""
+    click.echo(f"Counted {recount_users()} users.")
+
+
+def init_app(app):
+    app.config.setdefault('USER_TOTALS_CACHE_SECONDS', 60)
+    app.cli.add_command(recount_users_command)
@@ -0,0 +1,6 @@
+# wsgi.py
+# Entry point for gunicorn: `gunicorn -c gunicorn.conf.py wsgi:app`
+# Safe to load with --preload; see post_fork in gunicorn.conf.py.
+from app import create_app
+
+app = create_app()